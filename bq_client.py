@@ -1,11 +1,89 @@
 import os
-from google.cloud import bigquery
-from google.oauth2 import service_account
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+
 from utils.logger import Logger
+from config import (
+    QUERY_PAGE_SIZE,
+    QUERY_TIMEOUT_SECONDS,
+    QUERY_MAX_ATTEMPTS,
+    QUERY_RETRY_BACKOFF_SECONDS,
+    QUERY_HEDGE,
+    QUERY_HEDGE_QUANTILE,
+    QUERY_HEDGE_MIN_SAMPLES,
+)
+from utils.metrics import current_stage, get_run_metrics
 
 logger = Logger(__name__)
 
+
+class QueryTimeout(Exception):
+    """A query job did not finish within QUERY_TIMEOUT_SECONDS and was cancelled."""
+
+
+# Job error reasons BigQuery documents as safe to retry
+_RETRYABLE_REASONS = {"backendError", "internalError", "rateLimitExceeded", "jobRateLimitExceeded"}
+
+
+def _retryable_exceptions():
+    # Imported on first use, so runs that never query (e.g. --reevaluate) do
+    # not load the Google client libraries
+    import requests
+    from google.api_core import exceptions as api_exceptions
+
+    return (
+        api_exceptions.InternalServerError,
+        api_exceptions.BadGateway,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.GatewayTimeout,
+        api_exceptions.TooManyRequests,
+        requests.exceptions.ConnectionError,
+        ConnectionError,
+        QueryTimeout,
+    )
+
+
+def is_retryable(error):
+    if isinstance(error, _retryable_exceptions()):
+        return True
+    reasons = [e.get("reason") for e in getattr(error, "errors", None) or [] if isinstance(e, dict)]
+    return any(reason in _RETRYABLE_REASONS for reason in reasons)
+
+
+class _LatencyTracker:
+    """Recent job latencies per metrics stage, for the hedging threshold.
+
+    Queries of one stage (e.g. "fetch_service_types") run the same SQL for
+    different clients, so their latency distribution is a usable baseline.
+    """
+
+    def __init__(self, window=200):
+        self._latencies = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._latencies.setdefault(stage, deque(maxlen=self._window)).append(seconds)
+
+    def threshold(self, stage):
+        """QUERY_HEDGE_QUANTILE latency of `stage`, or None until enough samples exist."""
+        with self._lock:
+            samples = sorted(self._latencies.get(stage, ()))
+        if len(samples) < QUERY_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(len(samples) * QUERY_HEDGE_QUANTILE), len(samples) - 1)]
+
+
+_latencies = _LatencyTracker()
+
 def get_bq_client():
+    from google.cloud import bigquery
+    from google.oauth2 import service_account
+
     # Path to your service-account JSON key.
     # By default GOOGLE_APPLICATION_CREDENTIALS points here,
     # but you can hard-code a path if you prefer.
@@ -29,3 +107,155 @@ def get_bq_client():
         credentials=creds,
         project=creds.project_id,
     )
+
+
+def _cancel(job):
+    try:
+        job.cancel()
+    except Exception as e:
+        logger.debug(f"Could not cancel job {job.job_id}: {e}")
+
+
+def _wait_for_job(bq_client, query, job_config=None, hedge=False):
+    """Start `query` and wait until its job is done.
+
+    Returns (job, hedged). The job is cancelled after QUERY_TIMEOUT_SECONDS
+    (QueryTimeout). With `hedge`, a duplicate job is started once the query
+    outlives its stage's latency threshold and the first to succeed is kept.
+    """
+    timeout = QUERY_TIMEOUT_SECONDS or None
+    stage = current_stage()[1]
+    hedge_after = _latencies.threshold(stage) if hedge else None
+    if hedge_after is not None and timeout is not None and hedge_after >= timeout:
+        hedge_after = None
+
+    started = time.perf_counter()
+    job = bq_client.query(query, job_config=job_config)
+    try:
+        job.result(timeout=hedge_after if hedge_after is not None else timeout)
+        _latencies.add(stage, time.perf_counter() - started)
+        return job, False
+    except FutureTimeoutError:
+        if hedge_after is None:
+            _cancel(job)
+            raise QueryTimeout(f"Job {job.job_id} did not finish within {timeout:.0f}s")
+
+    duplicate = bq_client.query(query, job_config=job_config)
+    logger.info(f"Hedging job {job.job_id} after {hedge_after:.1f}s ({stage}) with {duplicate.job_id}")
+    remaining = None if timeout is None else timeout - (time.perf_counter() - started)
+    # Each waiting thread blocks in job.result(); cancelling the loser releases it
+    pool = ThreadPoolExecutor(max_workers=2)
+    futures = {pool.submit(j.result): j for j in (job, duplicate)}
+    pending = set(futures)
+    error = None
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                raise QueryTimeout(f"Jobs {job.job_id} and {duplicate.job_id} did not finish within {timeout:.0f}s")
+            for future in done:
+                if future.exception() is None:
+                    winner = futures[future]
+                    _latencies.add(stage, time.perf_counter() - started)
+                    return winner, True
+                error = future.exception()
+            if remaining is not None:
+                remaining = timeout - (time.perf_counter() - started)
+        raise error
+    finally:
+        for future in pending:
+            _cancel(futures[future])
+        pool.shutdown(wait=False)
+
+
+def _with_retries(attempt):
+    """Call `attempt()` up to QUERY_MAX_ATTEMPTS times while it fails with a retryable error.
+
+    Returns (result, attempts). Backoff doubles per attempt with full jitter,
+    so parallel workers hitting the same rate limit do not retry in lockstep.
+    """
+    for number in range(1, QUERY_MAX_ATTEMPTS + 1):
+        try:
+            return attempt(), number
+        except Exception as e:
+            if number >= QUERY_MAX_ATTEMPTS or not is_retryable(e):
+                raise
+            delay = random.uniform(0, QUERY_RETRY_BACKOFF_SECONDS * 2 ** (number - 1))
+            logger.warning(f"Query attempt {number}/{QUERY_MAX_ATTEMPTS} failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def run_query(bq_client, query):
+    """Run `query` and return the result as a DataFrame.
+
+    Timeouts and transient errors are retried and slow jobs optionally hedged
+    (see QUERY_TIMEOUT_SECONDS and QUERY_HEDGE in config.py). Job statistics
+    (bytes processed/billed, slot-ms, cache hit), latency, attempts and
+    hedging are recorded against the metrics stage active in the calling thread.
+    """
+    started = time.perf_counter()
+
+    def attempt():
+        job, hedged = _wait_for_job(bq_client, query, hedge=QUERY_HEDGE)
+        return job, hedged, job.to_dataframe()
+
+    (job, hedged, df), attempts = _with_retries(attempt)
+    get_run_metrics().record_query(job, time.perf_counter() - started, attempts=attempts, hedged=hedged)
+    return df
+
+
+def run_statement(bq_client, query):
+    """Run a DDL/DML statement, wait for it and return the finished job.
+
+    Job statistics are recorded like `run_query`; `job.num_dml_affected_rows`
+    carries the row count of DML statements. Statements are retried but never
+    hedged, since two concurrent DML jobs would both apply.
+    """
+    started = time.perf_counter()
+    (job, _), attempts = _with_retries(lambda: _wait_for_job(bq_client, query))
+    get_run_metrics().record_query(job, time.perf_counter() - started, attempts=attempts)
+    return job
+
+
+def iter_query_chunks(bq_client, query, page_size=None):
+    """Run `query` and yield its result as DataFrames of about `page_size` rows.
+
+    At least one (possibly empty) frame is yielded, so callers always see the
+    result columns. Job statistics are recorded once the last page has been read.
+    Retries and hedging apply until the job is done, not to the page downloads,
+    since pages already yielded cannot be taken back.
+    """
+    started = time.perf_counter()
+    (job, hedged), attempts = _with_retries(lambda: _wait_for_job(bq_client, query, hedge=QUERY_HEDGE))
+    rows = job.result(page_size=page_size or QUERY_PAGE_SIZE)
+    empty = True
+    for chunk in rows.to_dataframe_iterable():
+        empty = False
+        yield chunk
+    if empty:
+        yield job.to_dataframe()
+    get_run_metrics().record_query(job, time.perf_counter() - started, attempts=attempts, hedged=hedged)
+
+
+def run_query_chunked(bq_client, query, cast, page_size=None):
+    """Run `query` and download it page by page, casting each page with `cast`.
+
+    Peak memory is bounded by one uncast page plus the already-cast result,
+    instead of the whole uncast result.
+    """
+    from data_fetching.schemas import concat_cast_frames
+
+    return concat_cast_frames([cast(chunk) for chunk in iter_query_chunks(bq_client, query, page_size)])
+
+
+def dry_run_bytes(bq_client, query):
+    """Bytes `query` would process, from a free dry run; None if the dry run fails."""
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    try:
+        job = bq_client.query(query, job_config=job_config)
+    except Exception as e:
+        logger.warning(f"Dry run failed: {e}")
+        return None
+    return int(job.total_bytes_processed or 0)
@@ -1,5 +1,4 @@
 import os
-from google.cloud import bigquery
 
 # Optionally point to a service account key via environment variable
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -18,9 +17,21 @@ ASK_CLIENT_TABLE = os.getenv("ASK_CLIENT_TABLE", f"{DATASET_ID}.ask_client_flags
 SERVICE_TYPES_TABLE = os.getenv(
     "SERVICE_TYPES_TABLE", f"{RAW_DATASET_ID}.FR_SERVICE_TYPE"
 )
+# Latest row per (CLIENT, TYPE_ID) of SERVICE_TYPES_TABLE, maintained by
+# data_fetching/snapshot.py and refreshed incrementally at the start of a run.
+# Set USE_SERVICE_TYPE_SNAPSHOT=0 to read the load history directly.
+SERVICE_TYPES_SNAPSHOT_TABLE = os.getenv(
+    "SERVICE_TYPES_SNAPSHOT_TABLE", f"{DATASET_ID}.FR_SERVICE_TYPE_latest"
+)
+USE_SERVICE_TYPE_SNAPSHOT = os.getenv("USE_SERVICE_TYPE_SNAPSHOT", "1").lower() not in ("0", "false", "no")
 MERGED_APPOINTMENT_TABLE = os.getenv("MERGED_APPOINTMENT_TABLE", f"{TRANSFORMATION_DATASET_ID}.merged_appointment")
 MERGED_SUBSCRIPTION_TABLE = os.getenv("MERGED_SUBSCRIPTION_TABLE", f"{TRANSFORMATION_DATASET_ID}.merged_subscription")
 MERGED_SERVICE_TYPE_TABLE = os.getenv("MERGED_SERVICE_TYPE_TABLE", f"{TRANSFORMATION_DATASET_ID}.merged_service_type")
+# Service types that disagree with MERGED_SERVICE_TYPE_TABLE (missing TYPE_ID or
+# different description), rebuilt by one anti-join at the start of each run
+# (data_fetching/reconciliation.py). Set RECONCILE_MERGED_SERVICE_TYPES=0 to skip.
+MERGED_MISMATCH_TABLE = os.getenv("MERGED_MISMATCH_TABLE", f"{DATASET_ID}.merged_service_type_mismatches")
+RECONCILE_MERGED_SERVICE_TYPES = os.getenv("RECONCILE_MERGED_SERVICE_TYPES", "1").lower() not in ("0", "false", "no")
 
 # Lookup table for service type recurrence mapping
 LKP_RECURRING_TABLE = os.getenv(
@@ -28,9 +39,130 @@ LKP_RECURRING_TABLE = os.getenv(
     f"{RAW_DATASET_ID}.lkp_sales_mapping_recurring",
 )
 
+# Optional lookback window for appointment fetches, in whole years. 0 (default)
+# fetches the full history. Values below 2 would truncate hasVisitsInPast2Years.
+# APPOINTMENT_PARTITION_COLUMN names the table's date partitioning column when it
+# is not appointmentDate itself, so that the same cutoff also prunes partitions.
+APPOINTMENT_LOOKBACK_YEARS = int(os.getenv("APPOINTMENT_LOOKBACK_YEARS", "0") or 0)
+APPOINTMENT_PARTITION_COLUMN = os.getenv("APPOINTMENT_PARTITION_COLUMN")
+
+# Fetched frames are cast by data_fetching/schemas.py. Values that cannot be
+# cast become NA and are logged; if more than CAST_MAX_INVALID_FRACTION of an
+# ID or flag column's non-null values fail, the fetch raises instead of
+# analyzing a frame whose IDs or flags were silently dropped.
+CAST_MAX_INVALID_FRACTION = float(os.getenv("CAST_MAX_INVALID_FRACTION", "0.05"))
+
+# Fetch planning (`main.py --plan` / `--plan-only`). Each client's queries are
+# dry-run and its appointments counted; clients up to PLAN_RAW_MAX_ROWS fetch
+# raw rows, up to PLAN_CHUNKED_MAX_ROWS stream them page by page, and larger
+# ones use PLAN_LARGE_STRATEGY: "aggregate" computes per-(type, account)
+# statistics in BigQuery, "stream" computes the same statistics locally from
+# pages of rows with bounded memory.
+# BQ_PRICE_PER_TIB (USD, on-demand) turns dry-run bytes into a predicted cost.
+FETCH_PLANNING = os.getenv("FETCH_PLANNING", "").lower() in ("1", "true", "yes")
+PLAN_RAW_MAX_ROWS = int(os.getenv("PLAN_RAW_MAX_ROWS", "2000000"))
+PLAN_CHUNKED_MAX_ROWS = int(os.getenv("PLAN_CHUNKED_MAX_ROWS", "10000000"))
+PLAN_LARGE_STRATEGY = os.getenv("PLAN_LARGE_STRATEGY", "aggregate")
+BQ_PRICE_PER_TIB = float(os.getenv("BQ_PRICE_PER_TIB", "6.25"))
+QUERY_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", "100000"))
+
+# Tail-latency control for queries (bq_client.py). With QUERY_TIMEOUT_SECONDS
+# set (default 0, no limit), a job that has not finished after that many
+# seconds is cancelled; set it above the slowest legitimate query, e.g. a
+# large client's appointment download. Timeouts and transient errors (5xx,
+# 429, rate limits, backend errors) are retried up to QUERY_MAX_ATTEMPTS times
+# with exponential backoff and jitter. With
+# QUERY_HEDGE, a query still running after its stage's QUERY_HEDGE_QUANTILE
+# latency (learned from at least QUERY_HEDGE_MIN_SAMPLES queries of the same
+# stage in this run) gets a duplicate job; the first to finish wins and the
+# other is cancelled. Hedged duplicates may bill extra bytes.
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "0"))
+# At least one attempt, so QUERY_MAX_ATTEMPTS=0 still runs each query once
+QUERY_MAX_ATTEMPTS = max(1, int(os.getenv("QUERY_MAX_ATTEMPTS", "3")))
+QUERY_RETRY_BACKOFF_SECONDS = float(os.getenv("QUERY_RETRY_BACKOFF_SECONDS", "2"))
+QUERY_HEDGE = os.getenv("QUERY_HEDGE", "").lower() in ("1", "true", "yes")
+QUERY_HEDGE_QUANTILE = float(os.getenv("QUERY_HEDGE_QUANTILE", "0.95"))
+QUERY_HEDGE_MIN_SAMPLES = int(os.getenv("QUERY_HEDGE_MIN_SAMPLES", "20"))
+
 # Optional Google Drive folder ID for exporting per-client sheets
 GOOGLE_SHEETS_FOLDER_ID = os.getenv("GOOGLE_SHEETS_FOLDER_ID")
 
+# Output sinks fed by a single pipeline run (see output/sinks.py):
+#   askclient   AskClient rows (Expired Code filtered) to ASK_CLIENT_TABLE + askclient_final.xlsx
+#   bigquery    full results (active-subscription filtered) to BQ_OUTPUT_TABLE
+#   excel       filtered final_df.xlsx
+#   unfiltered  final_df_unfiltered.xlsx + askclient_final_unfiltered.xlsx
+#   sheets      per-client Google Sheets (needs GOOGLE_SHEETS_FOLDER_ID)
+OUTPUT_SINKS = os.getenv("OUTPUT_SINKS", "askclient,bigquery,excel,unfiltered,sheets")
+# Default sinks of a `--type-ids` run. Its results cover only the selected
+# types, so sinks that replace a BigQuery table are refused.
+TARGETED_OUTPUT_SINKS = os.getenv("TARGETED_OUTPUT_SINKS", "unfiltered")
+
+# Local directory for per-run checkpoints (`main.py --resume <run-id>`).
+# Checkpoints keep analysis rows; set CHECKPOINT_FETCH_CACHE=1 to also keep a
+# client's fetched frames until its rows are saved, so a resume can skip them.
+RUN_DIR = os.getenv("RUN_DIR", "runs")
+CHECKPOINT_FETCH_CACHE = os.getenv("CHECKPOINT_FETCH_CACHE", "").lower() in ("1", "true", "yes")
+
+# Per-type analysis features (processing/feature_store.py), stored per run so
+# `main.py --reevaluate [RUN_ID]` can re-apply changed rules without BigQuery.
+# Set FEATURE_STORE=1 to write them. Only the FEATURE_STORE_KEEP_RUNS most
+# recent runs are kept.
+FEATURE_STORE = os.getenv("FEATURE_STORE", "").lower() in ("1", "true", "yes")
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "output/features")
+FEATURE_STORE_KEEP_RUNS = max(1, int(os.getenv("FEATURE_STORE_KEEP_RUNS", "5")))
+REEVALUATE_DIFF_PATH = os.getenv("REEVALUATE_DIFF_PATH", "output/reevaluate_diff.csv")
+
+# In-warehouse runs (`main.py --in-warehouse`): the rules are compiled to one
+# BigQuery query (processing/sql_compiler.py) that writes BQ_OUTPUT_TABLE.
+# WAREHOUSE_CROSS_CHECK_CLIENTS randomly chosen clients are also analyzed in
+# Python and flag differences are written to WAREHOUSE_CROSS_CHECK_PATH.
+WAREHOUSE_CROSS_CHECK_CLIENTS = int(os.getenv("WAREHOUSE_CROSS_CHECK_CLIENTS", "3"))
+WAREHOUSE_CROSS_CHECK_PATH = os.getenv("WAREHOUSE_CROSS_CHECK_PATH", "output/warehouse_cross_check.csv")
+
+# Service mode (`main.py --serve`, service.py): a local HTTP endpoint that
+# analyzes one client on request. Each client's rows are cached for
+# SERVICE_CACHE_TTL_SECONDS, for at most SERVICE_CACHE_CLIENTS clients.
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_CACHE_TTL_SECONDS = float(os.getenv("SERVICE_CACHE_TTL_SECONDS", "900"))
+SERVICE_CACHE_CLIENTS = int(os.getenv("SERVICE_CACHE_CLIENTS", "50"))
+
+# Run report with per-client stage timings and BigQuery job statistics
+RUN_REPORT_JSON_PATH = os.getenv("RUN_REPORT_JSON_PATH", "output/run_report.json")
+RUN_REPORT_PROM_PATH = os.getenv("RUN_REPORT_PROM_PATH", "output/run_report.prom")
+
+# Logging: level, "text" or "json" lines, asynchronous writer thread, and
+# per-client summary mode that replaces per-type lines with event counters
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_ASYNC = os.getenv("LOG_ASYNC", "").lower() in ("1", "true", "yes")
+LOG_SUMMARY = os.getenv("LOG_SUMMARY", "").lower() in ("1", "true", "yes")
+
+# Client scheduling (utils/scheduler.py): clients are started largest first,
+# estimated from the previous run report, else appointment rows x seconds per
+# row. With `--time-budget`, clients in CLIENT_PRIORITY_PATH ({client: weight},
+# e.g. revenue) always run and the rest may be deferred to `--resume`.
+CLIENT_WORKERS = int(os.getenv("CLIENT_WORKERS", "1"))
+CLIENT_PRIORITY_PATH = os.getenv("CLIENT_PRIORITY_PATH")
+# Pipelined mode (`--prefetch K`): fetch up to K clients ahead of the one being
+# analyzed while per-client sink writes run on their own thread. 0 = off.
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "0"))
+SCHEDULER_SECONDS_PER_ROW = float(os.getenv("SCHEDULER_SECONDS_PER_ROW", "0.00002"))
+SCHEDULER_DEFAULT_SECONDS = float(os.getenv("SCHEDULER_DEFAULT_SECONDS", "60"))
+
+# Thread pool size for get_table fallbacks in utils/bq_catalog.py
+CATALOG_MAX_WORKERS = int(os.getenv("CATALOG_MAX_WORKERS", "16"))
+
+# Import-time budget for `python -m utils.import_budget` (import of main.py),
+# with every measurement appended to a JSON Lines history
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+IMPORT_TIME_HISTORY_PATH = os.getenv("IMPORT_TIME_HISTORY_PATH", "output/import_time.jsonl")
+
+# Output location and summary size for `main.py --profile cpu|mem`
+PROFILE_DIR = os.getenv("PROFILE_DIR", "output/profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+
 # Keyword lists for text-based signal detection
 WORD_SIGNALS = {
     "reservice": [
@@ -47,24 +179,33 @@ WORD_SIGNALS = {
     ]
 }
 
-# Business rules for API signal mapping
+# Text signal results are memoized per normalized description for the whole
+# run (bounded LRU). Set TEXT_SIGNAL_CACHE_PATH to keep them between runs; the
+# file is ignored automatically once WORD_SIGNALS changes.
+TEXT_SIGNAL_CACHE_SIZE = int(os.getenv("TEXT_SIGNAL_CACHE_SIZE", "50000"))
+TEXT_SIGNAL_CACHE_PATH = os.getenv("TEXT_SIGNAL_CACHE_PATH")
+
+# Business rules for API signal mapping. Each rule is (operator, operand, value
+# if the flag matches[, value otherwise]), plain data rather than a lambda so
+# that processing/rules.py can build ApiRules that both the analyzer and
+# processing/sql_compiler.py use; see there for the order flags are applied in.
 API_SIGNAL_RULES = {
     "FREQUENCY": {
         # isRecurring: if > 0 then True
-        "isRecurring": lambda x: True if x is not None and x > 0 else None,
+        "isRecurring": (">", 0, True),
         "has_reservice": None,
         # isRervice: if = 0 then True
-        # "isRervice": lambda x: True if x == 0 else None,
+        # "isRervice": ("==", 0, True),
         "isRervice": None,
         "zeroVisitTime": None,
     },
     "RESERVICE": {
         # isRecurring: if = 1 then False
-        "isRecurring": lambda x: False if x == 1 else None,
+        "isRecurring": ("==", 1, False),
         # has_reservice: if = 1 then False
-        "has_reservice": lambda x: False if x == 1 else None,
-        # isRervice: if = 1 then True
-        "isRervice": lambda x: True if x == 1 else False,
+        "has_reservice": ("==", 1, False),
+        # isRervice: if = 1 then True, else False
+        "isRervice": ("==", 1, True, False),
         "zeroVisitTime": None,
     },
     "DEFAULT_LENGTH": {
@@ -72,7 +213,7 @@ API_SIGNAL_RULES = {
         "has_reservice": None,
         "isRervice": None,
         # zeroVisitTime: if = 0 then True
-        "zeroVisitTime": lambda x: True if x == 0 else None,
+        "zeroVisitTime": ("==", 0, True),
     },
     "INITIAL_ID": {
         # isRecurring: rule removed
@@ -89,12 +230,12 @@ API_SIGNAL_RULES = {
     },
     "INITIAL": {
         # isRecurring: if = 1 then False
-        "isRecurring": lambda x: False if x == 1 else None,
+        "isRecurring": ("==", 1, False),
         "has_reservice": None,
         # isRervice: if = 1 then False
-        "isRervice": lambda x: False if x == 1 else None,
+        "isRervice": ("==", 1, False),
         # zeroVisitTime: if = 1 then False
-        "zeroVisitTime": lambda x: False if x == 1 else None,
+        "zeroVisitTime": ("==", 1, False),
     },
 }
 
@@ -120,42 +261,56 @@ BQ_APPOINTMENT_RULES = {
     "POP_RATIO_STRONG": 0.6,
 }
 
+# Sampling mode for the appointment recurring score: types with at least
+# APPT_SAMPLE_MIN_ACCOUNTS accounts are scored on a stratified random sample
+# (by visits per account) that starts at APPT_SAMPLE_INITIAL accounts and
+# doubles until the APPT_SAMPLE_CONFIDENCE interval of the strong-account
+# ratio lies clearly above or below POP_RATIO_STRONG. The seed keeps runs
+# reproducible.
+APPT_SAMPLING = os.getenv("APPT_SAMPLING", "").lower() in ("1", "true", "yes")
+APPT_SAMPLE_MIN_ACCOUNTS = int(os.getenv("APPT_SAMPLE_MIN_ACCOUNTS", "5000"))
+APPT_SAMPLE_INITIAL = int(os.getenv("APPT_SAMPLE_INITIAL", "400"))
+APPT_SAMPLE_CONFIDENCE = float(os.getenv("APPT_SAMPLE_CONFIDENCE", "0.95"))
+APPT_SAMPLE_SEED = int(os.getenv("APPT_SAMPLE_SEED", "0"))
+
+# (column, BigQuery type) of BQ_OUTPUT_TABLE. Kept declarative so importing
+# config does not load google.cloud.bigquery; see output/uploader.py.
 BQ_OUTPUT_SCHEMA = [
-    bigquery.SchemaField("TYPE_ID", "INT64"),
-    bigquery.SchemaField("DESCRIPTION", "STRING"),
-    bigquery.SchemaField("API RESERVICE FLAG", "INT64"),
-    bigquery.SchemaField("API REGULAR_SERVICE FLAG", "INT64"),
-    bigquery.SchemaField("API FREQUENCY FLAG", "INT64"),
-    bigquery.SchemaField("API DEFAULT_LENGTH FLAG", "INT64"),
-    bigquery.SchemaField("API INITIAL ID FLAG", "INT64"),
-    bigquery.SchemaField("API INITIAL FLAG", "INT64"),
-    bigquery.SchemaField("hasVisitsInPast2Years", "BOOL"),
-    bigquery.SchemaField("hasActiveSubscription", "BOOL"),
-    bigquery.SchemaField("Repeated Name", "BOOL"),
-    bigquery.SchemaField("API Reservice", "BOOL"),
-    bigquery.SchemaField("API Recurring", "BOOL"),
-    bigquery.SchemaField("API Zero Time", "BOOL"),
-    bigquery.SchemaField("API Has Reservice", "BOOL"),
-    bigquery.SchemaField("Word Signal Reservice", "BOOL"),
-    bigquery.SchemaField("Word Signal Recurring", "BOOL"),
-    bigquery.SchemaField("Word Signal Zero Time", "BOOL"),
-    bigquery.SchemaField("Word Signal Has Reservice", "BOOL"),
-    bigquery.SchemaField("Appt Recurring", "BOOL"),
-    bigquery.SchemaField("Appt Recurring Score", "FLOAT"),
-    bigquery.SchemaField("Appt Recurring - Reason", "STRING"),
-    bigquery.SchemaField("Final Reservice", "BOOL"),
-    bigquery.SchemaField("Final Recurring", "BOOL"),
-    bigquery.SchemaField("Final Zero Time", "BOOL"),
-    bigquery.SchemaField("Final Has Reservice", "BOOL"),
-    bigquery.SchemaField("Expired Code", "BOOL"),
-    bigquery.SchemaField("AskClient Reservice - Reason", "STRING"),
-    bigquery.SchemaField("AskClient Recurring - Reason", "STRING"),
-    bigquery.SchemaField("AskClient Zero Time - Reason", "STRING"),
-    bigquery.SchemaField("AskClient Has Reservice - Reason", "STRING"),
-    bigquery.SchemaField("AskClient", "BOOL"),
-    bigquery.SchemaField("Appointment Share Pct", "FLOAT"),
-    bigquery.SchemaField("Revenue Share Pct", "FLOAT"),
-    bigquery.SchemaField("AskClient High Priority - Reason", "STRING"),
-    bigquery.SchemaField("AskClient High Revenue - Reason", "STRING"),
-    bigquery.SchemaField("Client", "STRING"),
+    ("TYPE_ID", "INT64"),
+    ("DESCRIPTION", "STRING"),
+    ("API RESERVICE FLAG", "INT64"),
+    ("API REGULAR_SERVICE FLAG", "INT64"),
+    ("API FREQUENCY FLAG", "INT64"),
+    ("API DEFAULT_LENGTH FLAG", "INT64"),
+    ("API INITIAL ID FLAG", "INT64"),
+    ("API INITIAL FLAG", "INT64"),
+    ("hasVisitsInPast2Years", "BOOL"),
+    ("hasActiveSubscription", "BOOL"),
+    ("Repeated Name", "BOOL"),
+    ("API Reservice", "BOOL"),
+    ("API Recurring", "BOOL"),
+    ("API Zero Time", "BOOL"),
+    ("API Has Reservice", "BOOL"),
+    ("Word Signal Reservice", "BOOL"),
+    ("Word Signal Recurring", "BOOL"),
+    ("Word Signal Zero Time", "BOOL"),
+    ("Word Signal Has Reservice", "BOOL"),
+    ("Appt Recurring", "BOOL"),
+    ("Appt Recurring Score", "FLOAT"),
+    ("Appt Recurring - Reason", "STRING"),
+    ("Final Reservice", "BOOL"),
+    ("Final Recurring", "BOOL"),
+    ("Final Zero Time", "BOOL"),
+    ("Final Has Reservice", "BOOL"),
+    ("Expired Code", "BOOL"),
+    ("AskClient Reservice - Reason", "STRING"),
+    ("AskClient Recurring - Reason", "STRING"),
+    ("AskClient Zero Time - Reason", "STRING"),
+    ("AskClient Has Reservice - Reason", "STRING"),
+    ("AskClient", "BOOL"),
+    ("Appointment Share Pct", "FLOAT"),
+    ("Revenue Share Pct", "FLOAT"),
+    ("AskClient High Priority - Reason", "STRING"),
+    ("AskClient High Revenue - Reason", "STRING"),
+    ("Client", "STRING"),
 ]
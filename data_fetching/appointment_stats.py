@@ -0,0 +1,171 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from config import APPOINTMENT_LOOKBACK_YEARS, MERGED_APPOINTMENT_TABLE
+from bq_client import iter_query_chunks
+from data_fetching.appointments import appointment_lookback_filter
+from data_fetching.schemas import cast_frame
+from data_fetching.service_types import type_id_filter
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+# Years are stored as bits relative to this year; earlier dates are clamped to it
+_YEAR_BASE = 1900
+
+STATS_COLUMNS = [
+    "type", "individualAccountID", "appointmentCount", "visits", "last_date",
+    "years_count", "has_consecutive_years", "median_delta_days",
+]
+
+
+def appointment_stream_query(client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, type_ids=None, now=None):
+    """Only the columns the accumulators need, ordered so each account's visits arrive in date order."""
+    return f"""
+        SELECT
+            type,
+            individualAccountID,
+            appointmentDate
+        FROM `{MERGED_APPOINTMENT_TABLE}`
+        WHERE clientID = '{client_id}'
+        {appointment_lookback_filter(lookback_years, today=now)}
+        {type_id_filter("type", type_ids)}
+        ORDER BY type, individualAccountID, SAFE_CAST(appointmentDate AS TIMESTAMP)
+    """
+
+
+class _AccountAccumulator:
+    __slots__ = ("count", "visits", "last_date", "years_mask", "deltas")
+
+    def __init__(self):
+        self.count = 0
+        self.visits = 0
+        self.last_date = None
+        self.years_mask = 0
+        # Exact histogram of inter-visit days; accounts have few distinct gaps
+        self.deltas = Counter()
+
+    def median_delta(self):
+        n = sum(self.deltas.values())
+        if n == 0:
+            return None
+        lo_rank, hi_rank = (n - 1) // 2, n // 2
+        lo = hi = None
+        seen = 0
+        for days in sorted(self.deltas):
+            seen += self.deltas[days]
+            if lo is None and seen > lo_rank:
+                lo = days
+            if seen > hi_rank:
+                hi = days
+                break
+        return (lo + hi) / 2
+
+
+def _days(delta):
+    """Whole days of a datetime64 difference, truncated like TIMESTAMP_DIFF(..., DAY)."""
+    return delta.astype("timedelta64[D]").astype(np.int64)
+
+
+class AppointmentStatsAccumulator:
+    """Online per-(type, account) appointment statistics.
+
+    Chunks must arrive ordered by type, account and date (see
+    `appointment_stream_query`), so an account split across chunks continues
+    from the last date seen in earlier chunks. Each chunk is summarized with
+    vectorized group boundaries; only the per-account merge loops, once per
+    account rather than per appointment. Memory is bounded by the number of
+    (type, account) pairs, not appointments. `to_frame` yields the same
+    columns as the server-side `appointment_stats_query`.
+    """
+
+    def __init__(self):
+        self._accounts = {}
+        self.rows = 0
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        if chunk.empty:
+            return
+        keys = chunk[["type", "individualAccountID"]]
+        group = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().to_numpy()
+        groups = int(group.max()) + 1
+        starts = np.unique(group, return_index=True)[1]
+        counts = np.bincount(group, minlength=groups)
+
+        dates = chunk["appointmentDate"].to_numpy(dtype="datetime64[ns]")
+        valid = ~np.isnat(dates)
+        valid_group, valid_dates = group[valid], dates[valid]
+        # Rows arrive in date order within an account, so one stable sort keeps them there
+        order = np.argsort(valid_group, kind="stable")
+        valid_group, valid_dates = valid_group[order], valid_dates[order]
+        visits = np.bincount(valid_group, minlength=groups)
+        first_valid = np.r_[True, valid_group[1:] != valid_group[:-1]] if len(valid_group) else np.array([], bool)
+        last_valid = np.r_[first_valid[1:], True] if len(valid_group) else np.array([], bool)
+
+        # Deltas inside the chunk, as (group, days) counts
+        inner = ~first_valid
+        inner_days = _days(valid_dates[inner] - valid_dates[np.flatnonzero(inner) - 1])
+        delta_pairs, delta_counts = np.unique(np.stack([valid_group[inner], inner_days]), axis=1, return_counts=True)
+
+        # Distinct years per group
+        years = valid_dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        year_pairs = np.unique(np.stack([valid_group, np.maximum(years - _YEAR_BASE, 0)]), axis=1)
+
+        accumulators = []
+        key_columns = [keys[column].iloc[starts].tolist() for column in keys.columns]
+        for index, key in enumerate(zip(*key_columns)):
+            # NULL IDs come back as NA/NaN, which never compares equal across chunks
+            key = tuple(None if pd.isna(k) else int(k) for k in key)
+            acc = self._accounts.get(key)
+            if acc is None:
+                acc = self._accounts[key] = _AccountAccumulator()
+            acc.count += int(counts[index])
+            acc.visits += int(visits[index])
+            accumulators.append(acc)
+
+        first_dates = dict(zip(valid_group[first_valid].tolist(), valid_dates[first_valid]))
+        last_dates = dict(zip(valid_group[last_valid].tolist(), valid_dates[last_valid]))
+        for index, first in first_dates.items():
+            acc = accumulators[index]
+            if acc.last_date is not None:
+                acc.deltas[int(_days(first - acc.last_date))] += 1
+            acc.last_date = last_dates[index]
+        for (index, days), n in zip(delta_pairs.T.tolist(), delta_counts.tolist()):
+            accumulators[index].deltas[days] += n
+        for index, bit in year_pairs.T.tolist():
+            accumulators[index].years_mask |= 1 << bit
+
+    def to_frame(self):
+        records = []
+        for (type_id, account_id), acc in self._accounts.items():
+            mask = acc.years_mask
+            records.append({
+                "type": type_id,
+                "individualAccountID": account_id,
+                "appointmentCount": acc.count,
+                "visits": acc.visits,
+                "last_date": acc.last_date,
+                "years_count": bin(mask).count("1"),
+                "has_consecutive_years": bool(mask & (mask >> 1)),
+                "median_delta_days": acc.median_delta(),
+            })
+        return cast_frame(pd.DataFrame.from_records(records, columns=STATS_COLUMNS), "appointment_stats")
+
+
+def stream_appointment_stats_for_client(bq_client, client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, type_ids=None, now=None):
+    """Read a client's appointments page by page into per-(type, account) accumulators.
+
+    Only one page of raw rows is held at a time; the result has the shape of
+    `get_appointment_stats_for_client`, for analysis with bounded memory.
+    """
+    logger.info(f"Streaming appointments for client: {client_id}")
+    accumulator = AppointmentStatsAccumulator()
+    query = appointment_stream_query(client_id, lookback_years, type_ids, now)
+    for chunk in iter_query_chunks(bq_client, query):
+        accumulator.update(cast_frame(chunk, "appointments"))
+    stats_df = accumulator.to_frame()
+    logger.info(f"Streamed {accumulator.rows} appointments for {client_id} into {len(stats_df)} account statistics")
+    return stats_df
@@ -1,11 +1,42 @@
 import pandas as pd
-from config import MERGED_APPOINTMENT_TABLE
+from config import (
+    MERGED_APPOINTMENT_TABLE,
+    APPOINTMENT_LOOKBACK_YEARS,
+    APPOINTMENT_PARTITION_COLUMN,
+)
+from bq_client import run_query, run_query_chunked
+from data_fetching.schemas import cast_frame
+from data_fetching.service_types import type_id_filter
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
-def get_appointments_for_client(bq_client, client_id):
-    query = f"""
+if 0 < APPOINTMENT_LOOKBACK_YEARS < 2:
+    logger.warning(
+        f"APPOINTMENT_LOOKBACK_YEARS={APPOINTMENT_LOOKBACK_YEARS} is shorter than the 2-year "
+        "window used for hasVisitsInPast2Years; recent-visit flags will be incomplete"
+    )
+
+
+def appointment_lookback_filter(lookback_years=APPOINTMENT_LOOKBACK_YEARS, today=None):
+    """Return the SQL predicate (with leading AND) limiting appointments to the lookback window.
+
+    The cutoff is rendered as a constant date literal so BigQuery can prune
+    partitions when the table is partitioned on the filtered column. Pass the
+    run's analysis date as `today` so that a resumed run fetches the same window.
+    """
+    if not lookback_years:
+        return ""
+    today = pd.Timestamp.today() if today is None else pd.Timestamp(today)
+    cutoff = (today.normalize() - pd.DateOffset(years=lookback_years)).date().isoformat()
+    predicate = f"AND appointmentDate >= '{cutoff}'"
+    if APPOINTMENT_PARTITION_COLUMN and APPOINTMENT_PARTITION_COLUMN != "appointmentDate":
+        predicate += f"\n          AND {APPOINTMENT_PARTITION_COLUMN} >= '{cutoff}'"
+    return predicate
+
+
+def appointments_query(client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, type_ids=None, now=None):
+    return f"""
         SELECT
             individualAccountID,
             type,
@@ -14,8 +45,134 @@ def get_appointments_for_client(bq_client, client_id):
             productionValue
         FROM `{MERGED_APPOINTMENT_TABLE}`
         WHERE clientID = '{client_id}'
+        {appointment_lookback_filter(lookback_years, today=now)}
+        {type_id_filter("type", type_ids)}
     """
-    logger.info(f"Fetching appointments for client: {client_id}")
-    df = bq_client.query(query).to_dataframe()
-    df['appointmentDate'] = pd.to_datetime(df['appointmentDate'], errors='coerce')
-    return df
+
+
+def appointment_count_query(client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, now=None):
+    return f"""
+        SELECT COUNT(*) AS n
+        FROM `{MERGED_APPOINTMENT_TABLE}`
+        WHERE clientID = '{client_id}'
+        {appointment_lookback_filter(lookback_years, today=now)}
+    """
+
+
+def appointment_stats_query(client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, type_ids=None, now=None):
+    """Per-(type, account) appointment statistics computed inside BigQuery.
+
+    Produces the same evidence that analyze_appointment_recurring derives from
+    raw rows: visit count, distinct years and whether two are consecutive,
+    median inter-visit days and the last visit. appointmentCount includes rows
+    without a valid date so that appointment shares match the raw path.
+    """
+    return account_stats_sql(f"clientID = '{client_id}' {type_id_filter('type', type_ids)}", lookback_years, now)
+
+
+def account_stats_sql(where_clause, lookback_years=APPOINTMENT_LOOKBACK_YEARS, now=None):
+    """Per-(clientID, type, account) statistics of the appointments matching `where_clause`."""
+    return f"""
+        WITH appts AS (
+            SELECT
+                clientID,
+                type,
+                individualAccountID,
+                SAFE_CAST(appointmentDate AS TIMESTAMP) AS ts
+            FROM `{MERGED_APPOINTMENT_TABLE}`
+            WHERE {where_clause}
+            {appointment_lookback_filter(lookback_years, today=now)}
+        ),
+        deltas AS (
+            SELECT
+                clientID,
+                type,
+                individualAccountID,
+                ts,
+                TIMESTAMP_DIFF(ts, LAG(ts) OVER w, DAY) AS delta
+            FROM appts
+            WHERE ts IS NOT NULL
+            WINDOW w AS (PARTITION BY clientID, type, individualAccountID ORDER BY ts)
+        ),
+        medians AS (
+            SELECT DISTINCT
+                clientID,
+                type,
+                individualAccountID,
+                PERCENTILE_CONT(delta, 0.5) OVER (PARTITION BY clientID, type, individualAccountID) AS median_delta_days
+            FROM deltas
+        ),
+        account_years AS (
+            SELECT
+                clientID,
+                type,
+                individualAccountID,
+                yr,
+                LAG(yr) OVER (PARTITION BY clientID, type, individualAccountID ORDER BY yr) AS prev_yr
+            FROM (
+                SELECT DISTINCT clientID, type, individualAccountID, EXTRACT(YEAR FROM ts) AS yr
+                FROM deltas
+            )
+        ),
+        years AS (
+            SELECT
+                clientID,
+                type,
+                individualAccountID,
+                COUNT(*) AS years_count,
+                COALESCE(LOGICAL_OR(yr - prev_yr = 1), FALSE) AS has_consecutive_years
+            FROM account_years
+            GROUP BY clientID, type, individualAccountID
+        ),
+        counts AS (
+            SELECT
+                clientID,
+                type,
+                individualAccountID,
+                COUNT(*) AS appointmentCount,
+                COUNT(ts) AS visits,
+                MAX(ts) AS last_date
+            FROM appts
+            GROUP BY clientID, type, individualAccountID
+        )
+        SELECT
+            c.clientID,
+            c.type,
+            c.individualAccountID,
+            c.appointmentCount,
+            c.visits,
+            c.last_date,
+            COALESCE(y.years_count, 0) AS years_count,
+            COALESCE(y.has_consecutive_years, FALSE) AS has_consecutive_years,
+            m.median_delta_days
+        FROM counts c
+        LEFT JOIN years y
+            ON c.clientID = y.clientID AND c.type = y.type AND c.individualAccountID = y.individualAccountID
+        LEFT JOIN medians m
+            ON c.clientID = m.clientID AND c.type = m.type AND c.individualAccountID = m.individualAccountID
+    """
+
+
+def get_appointments_for_client(bq_client, client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, chunked=False, type_ids=None, now=None):
+    """Raw appointment rows. With chunked=True the result is downloaded page by
+    page and each page is cast before the next arrives, which bounds the
+    object-dtype peak for large clients."""
+    if lookback_years:
+        logger.info(f"Fetching appointments for client: {client_id} (last {lookback_years} years)")
+    else:
+        logger.info(f"Fetching appointments for client: {client_id}")
+    query = appointments_query(client_id, lookback_years, type_ids, now)
+    if chunked:
+        return run_query_chunked(bq_client, query, lambda df: cast_frame(df, "appointments"))
+    return cast_frame(run_query(bq_client, query), "appointments")
+
+
+def get_appointment_stats_for_client(bq_client, client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, type_ids=None, now=None):
+    logger.info(f"Fetching aggregated appointment statistics for client: {client_id}")
+    query = appointment_stats_query(client_id, lookback_years, type_ids, now)
+    return cast_frame(run_query(bq_client, query), "appointment_stats")
+
+
+def count_appointments_for_client(bq_client, client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, now=None):
+    df = run_query(bq_client, appointment_count_query(client_id, lookback_years, now))
+    return int(df["n"].iloc[0]) if not df.empty else 0
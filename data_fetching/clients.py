@@ -1,23 +1,27 @@
-import os
+import re
 
-# Table ID can be overridden with environment variables. It defaults to the
-# DATASET_ID defined in config combined with the service types table name.
-from config import RAW_DATASET_ID
+from bq_client import run_query
+from data_fetching.snapshot import clients_source
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
-SERVICE_TYPES_TABLE = os.getenv(
-    "SERVICE_TYPES_TABLE", f"{RAW_DATASET_ID}.FR_SERVICE_TYPE"
-)
+# Client IDs are interpolated into query text, so IDs from untrusted input
+# (the --serve endpoint) must match this before reaching a fetcher.
+CLIENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def is_valid_client_id(client_id):
+    return bool(CLIENT_ID_PATTERN.match(client_id))
 
 
 def get_distinct_clients(bq_client):
+    # Reads the compact latest-snapshot table when enabled (data_fetching.snapshot)
     query = f"""
         SELECT DISTINCT CLIENT AS clientId
-        FROM `{SERVICE_TYPES_TABLE}`
+        FROM `{clients_source()}`
         WHERE CLIENT IS NOT NULL
     """
     logger.info("Fetching distinct clients...")
-    df = bq_client.query(query).to_dataframe()
+    df = run_query(bq_client, query)
     return df['clientId'].tolist()
@@ -0,0 +1,112 @@
+from bq_client import dry_run_bytes
+from config import (
+    APPOINTMENT_LOOKBACK_YEARS,
+    PLAN_RAW_MAX_ROWS,
+    PLAN_CHUNKED_MAX_ROWS,
+    PLAN_LARGE_STRATEGY,
+    BQ_PRICE_PER_TIB,
+)
+from data_fetching.service_types import service_types_query
+from data_fetching.recurring_lookup import recurring_lookup_query
+from data_fetching.subscriptions import subscriptions_query
+from data_fetching.appointments import (
+    appointments_query,
+    appointment_stats_query,
+    count_appointments_for_client,
+)
+from data_fetching.appointment_stats import appointment_stream_query
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+# Appointment fetch strategies, from cheapest to most scalable:
+#   raw        one query, whole result downloaded at once (historical behaviour)
+#   chunked    same rows, downloaded and cast page by page
+#   stream     rows read page by page into per-(type, account) accumulators locally
+#   aggregate  per-(type, account) statistics computed in BigQuery; raw rows never leave it
+STRATEGY_RAW = "raw"
+STRATEGY_CHUNKED = "chunked"
+STRATEGY_STREAM = "stream"
+STRATEGY_AGGREGATE = "aggregate"
+STRATEGIES = (STRATEGY_RAW, STRATEGY_CHUNKED, STRATEGY_STREAM, STRATEGY_AGGREGATE)
+
+TIB = 2**40
+
+
+def choose_strategy(appointment_rows):
+    if appointment_rows <= PLAN_RAW_MAX_ROWS:
+        return STRATEGY_RAW
+    if appointment_rows <= PLAN_CHUNKED_MAX_ROWS:
+        return STRATEGY_CHUNKED
+    return PLAN_LARGE_STRATEGY
+
+
+def plan_client(bq_client, client_id, lookback_years=APPOINTMENT_LOOKBACK_YEARS, now=None):
+    """Estimate one client's fetch and pick its appointment strategy.
+
+    Every query the client would run is dry-run (free) for bytes; the
+    appointment row count comes from a COUNT(*) query, since dry runs do not
+    estimate rows. `now` is the run's analysis date, which ends the lookback
+    window as it will in the fetch. Returns a plan dict as consumed by
+    `format_plan`.
+    """
+    appointment_rows = count_appointments_for_client(bq_client, client_id, lookback_years, now=now)
+    strategy = choose_strategy(appointment_rows)
+    if strategy == STRATEGY_AGGREGATE:
+        appointments_sql = appointment_stats_query(client_id, lookback_years, now=now)
+    elif strategy == STRATEGY_STREAM:
+        appointments_sql = appointment_stream_query(client_id, lookback_years, now=now)
+    else:
+        appointments_sql = appointments_query(client_id, lookback_years, now=now)
+    queries = {
+        "service_types": service_types_query(client_id),
+        "recurring_lookup": recurring_lookup_query(client_id),
+        "appointments": appointments_sql,
+        "subscriptions": subscriptions_query(client_id),
+    }
+    bytes_by_query = {name: dry_run_bytes(bq_client, sql) for name, sql in queries.items()}
+    total_bytes = sum(b for b in bytes_by_query.values() if b is not None)
+    plan = {
+        "client_id": client_id,
+        "appointment_rows": appointment_rows,
+        "strategy": strategy,
+        "bytes": bytes_by_query,
+        "total_bytes": total_bytes,
+        "predicted_cost_usd": total_bytes / TIB * BQ_PRICE_PER_TIB,
+    }
+    logger.info(
+        f"Plan for {client_id}: {strategy} ({appointment_rows} appointment rows, "
+        f"{total_bytes / 2**30:.2f} GiB, ${plan['predicted_cost_usd']:.4f})"
+    )
+    return plan
+
+
+def plan_clients(bq_client, clients, metrics, now=None):
+    plans = []
+    for client_id in clients:
+        with metrics.stage(client_id, "planning"):
+            plans.append(plan_client(bq_client, client_id, now=now))
+    return plans
+
+
+def format_plan(plans):
+    """Render plans as a fixed-width table with a total line."""
+    header = f"{'client':<24} {'strategy':<10} {'appt rows':>12} {'GiB':>10} {'cost USD':>10}"
+    lines = [header, "-" * len(header)]
+    for plan in plans:
+        lines.append(
+            f"{str(plan['client_id']):<24} {plan['strategy']:<10} {plan['appointment_rows']:>12,} "
+            f"{plan['total_bytes'] / 2**30:>10.2f} {plan['predicted_cost_usd']:>10.4f}"
+        )
+        failed = [name for name, b in plan["bytes"].items() if b is None]
+        if failed:
+            lines.append(f"  dry run failed for: {', '.join(failed)} (not included in estimate)")
+    total_bytes = sum(p["total_bytes"] for p in plans)
+    total_cost = sum(p["predicted_cost_usd"] for p in plans)
+    lines.append("-" * len(header))
+    lines.append(
+        f"{'total':<24} {'':<10} {sum(p['appointment_rows'] for p in plans):>12,} "
+        f"{total_bytes / 2**30:>10.2f} {total_cost:>10.4f}"
+    )
+    lines.append(f"Predicted cost at ${BQ_PRICE_PER_TIB}/TiB on-demand; cached results may bill less.")
+    return "\n".join(lines)
@@ -0,0 +1,89 @@
+from config import MERGED_SERVICE_TYPE_TABLE, MERGED_MISMATCH_TABLE
+from bq_client import run_query, run_statement
+from data_fetching.snapshot import service_types_source
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+# Clients listed individually in the mismatch summary log line
+_LOGGED_CLIENTS = 10
+
+
+def _client_filter(column, clients):
+    if clients is None:
+        return "TRUE"
+    client_list = ", ".join(f"'{c}'" for c in clients)
+    return f"{column} IN ({client_list})"
+
+
+def mismatch_sql(clients=None):
+    """Latest service types with no merged_service_type row of the same client, TYPE_ID and description.
+
+    One anti-join over all (or the given) clients. DESCRIPTION_MERGED is a
+    merged description of the type, NULL when the type is missing there.
+    """
+    return f"""
+        WITH service_types AS (
+            SELECT CLIENT AS clientId, CAST(TYPE_ID AS INT64) AS TYPE_ID, DESCRIPTION
+            FROM {service_types_source(_client_filter("CLIENT", clients))}
+        ),
+        merged AS (
+            SELECT clientID AS clientId, CAST(typeID AS INT64) AS TYPE_ID, description AS DESCRIPTION
+            FROM `{MERGED_SERVICE_TYPE_TABLE}`
+            WHERE {_client_filter("clientID", clients)}
+        )
+        SELECT
+            s.clientId,
+            s.TYPE_ID,
+            s.DESCRIPTION,
+            ANY_VALUE(m.DESCRIPTION) AS DESCRIPTION_MERGED,
+            IF(COUNT(m.TYPE_ID) = 0, 'missing', 'description') AS mismatch
+        FROM service_types s
+        LEFT JOIN merged m
+            ON m.clientId = s.clientId AND m.TYPE_ID = s.TYPE_ID
+        WHERE NOT EXISTS (
+            SELECT 1 FROM merged e
+            WHERE e.clientId = s.clientId AND e.TYPE_ID = s.TYPE_ID
+                AND e.DESCRIPTION IS NOT DISTINCT FROM s.DESCRIPTION
+        )
+        GROUP BY s.clientId, s.TYPE_ID, s.DESCRIPTION
+    """
+
+
+def reconcile_merged_service_types(bq_client, clients=None, table_id=MERGED_MISMATCH_TABLE):
+    """Write service types that disagree with merged_service_type to `table_id`.
+
+    Replaces the per-client merged_service_type fetch of the pipeline: the
+    check runs once per run inside BigQuery and only counts come back.
+
+    Returns:
+        dict: {client_id: {"missing": n, "description": n}} for clients with mismatches
+    """
+    run_statement(bq_client, f"CREATE OR REPLACE TABLE `{table_id}` AS {mismatch_sql(clients)}")
+    counts_df = run_query(bq_client, f"""
+        SELECT
+            clientId,
+            COUNTIF(mismatch = 'missing') AS missing,
+            COUNTIF(mismatch = 'description') AS description
+        FROM `{table_id}`
+        GROUP BY clientId
+        ORDER BY COUNT(*) DESC
+    """)
+    counts = {
+        str(r.clientId): {"missing": int(r.missing), "description": int(r.description)}
+        for r in counts_df.itertuples(index=False)
+    }
+    if counts:
+        total = sum(c["missing"] + c["description"] for c in counts.values())
+        top = ", ".join(
+            f"{client_id}: {c['missing']} missing, {c['description']} description"
+            for client_id, c in list(counts.items())[:_LOGGED_CLIENTS]
+        )
+        more = f" (+{len(counts) - _LOGGED_CLIENTS} more)" if len(counts) > _LOGGED_CLIENTS else ""
+        logger.warning(
+            f"merged_service_type mismatches: {total} service types across {len(counts)} clients, "
+            f"written to {table_id} — {top}{more}"
+        )
+    else:
+        logger.info(f"No merged_service_type mismatches; {table_id} is empty")
+    return counts
@@ -1,11 +1,13 @@
 from config import LKP_RECURRING_TABLE
+from bq_client import run_query
+from data_fetching.schemas import cast_frame
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
 
-def get_recurring_lookup_for_client(bq_client, client_id):
-    query = f"""
+def recurring_lookup_query(client_id):
+    return f"""
         SELECT
             clientId,
             serviceType,
@@ -13,5 +15,8 @@ def get_recurring_lookup_for_client(bq_client, client_id):
         FROM `{LKP_RECURRING_TABLE}`
         WHERE clientId = '{client_id}'
     """
+
+
+def get_recurring_lookup_for_client(bq_client, client_id):
     logger.info(f"Fetching recurring lookup for client: {client_id}")
-    return bq_client.query(query).to_dataframe()
+    return cast_frame(run_query(bq_client, recurring_lookup_query(client_id)), "recurring_lookup")
@@ -0,0 +1,172 @@
+import logging
+import numpy as np
+import pandas as pd
+from config import CAST_MAX_INVALID_FRACTION
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+# Column kinds per fetched table. Frames are cast on arrival so that the
+# analyzer can compare IDs as integers and dates without re-parsing:
+#   id        nullable integer (Int32, or Int64 if values do not fit)
+#   category  pandas categorical (client IDs, descriptions)
+#   datetime  datetime64[ns], timezone-naive
+#   bool      nullable boolean (also "true"/"false" and 1/0 as numbers or strings)
+#   float     float64
+# Columns not listed are left untouched: annualRecurringServices is parsed
+# downstream, and recurring_lookup.isRecurring is read as SalesMapping only
+# when it says TRUE or FALSE, other values being ignored rather than fatal. Values a cast turns into NA are counted and
+# logged, and raise above CAST_MAX_INVALID_FRACTION (see cast_frame).
+TABLE_SCHEMAS = {
+    "service_types": {
+        "TYPE_ID": "id",
+        "DESCRIPTION": "category",
+        "API_RESERVICE": "id",
+        "API_REGULAR_SERVICE": "id",
+        "API_FREQUENCY": "id",
+        "API_DEFAULT_LENGTH": "id",
+        "API_INITIAL_ID": "id",
+        "API_INITIAL": "id",
+        "clientId": "category",
+    },
+    "recurring_lookup": {
+        "clientId": "category",
+        "serviceType": "category",
+    },
+    "appointments": {
+        "individualAccountID": "id",
+        "type": "id",
+        "appointmentDate": "datetime",
+        "clientID": "category",
+        "productionValue": "float",
+    },
+    "appointment_stats": {
+        "type": "id",
+        "individualAccountID": "id",
+        "appointmentCount": "id",
+        "visits": "id",
+        "last_date": "datetime",
+        "years_count": "id",
+        "has_consecutive_years": "bool",
+        "median_delta_days": "float",
+    },
+    "subscriptions": {
+        "subscriptionID": "id",
+        "serviceID": "id",
+        "serviceType": "category",
+        "active": "bool",
+        "dateCancelled": "datetime",
+        "clientID": "category",
+        "dateAdded": "datetime",
+    },
+    "type_totals": {
+        "measure": "category",
+        "TYPE_ID": "id",
+        "value": "float",
+    },
+}
+
+_INT32_MIN = np.iinfo(np.int32).min
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def _to_id(series: pd.Series) -> pd.Series:
+    numeric = pd.to_numeric(series, errors="coerce")
+    non_null = numeric.dropna()
+    if non_null.empty or (non_null.min() >= _INT32_MIN and non_null.max() <= _INT32_MAX):
+        return numeric.astype("Int32")
+    return numeric.astype("Int64")
+
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    converted = pd.to_datetime(series, errors="coerce")
+    if getattr(converted.dt, "tz", None) is not None:
+        converted = converted.dt.tz_convert(None)
+    return converted
+
+
+_BOOL_VALUES = {
+    True: True, False: False,
+    "true": True, "false": False,
+    "1": True, "0": False,
+    "1.0": True, "0.0": False,
+}
+
+
+def true_flag_sql(column: str) -> str:
+    """BigQuery condition that holds where `column` is a flag _to_bool reads as True."""
+    values = ", ".join(f"'{v}'" for v, flag in _BOOL_VALUES.items() if isinstance(v, str) and flag)
+    return f"LOWER(TRIM(CAST({column} AS STRING))) IN ({values})"
+
+
+def _to_bool(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype("boolean")
+    normalized = series.map(
+        lambda v: v if isinstance(v, (bool, np.bool_)) else (
+            str(v).strip().lower() if v is not None and not pd.isna(v) else None
+        )
+    )
+    return normalized.map(_BOOL_VALUES).astype("boolean")
+
+
+_CASTERS = {
+    "id": _to_id,
+    "category": lambda s: s.astype("category"),
+    "datetime": _to_datetime,
+    "bool": _to_bool,
+    "float": lambda s: pd.to_numeric(s, errors="coerce").astype("float64"),
+}
+
+
+_STRICT_KINDS = ("id", "bool")
+
+
+def _check_coercion(table: str, column: str, kind: str, original: pd.Series, cast: pd.Series) -> None:
+    """Log values that became NA in the cast; raise if too many IDs or flags did."""
+    non_null = int(original.notna().sum())
+    invalid = non_null - int(cast.notna().sum())
+    if invalid <= 0:
+        return
+    examples = original[original.notna() & cast.isna()].astype(str).unique()[:3].tolist()
+    message = f"{table}.{column}: {invalid} of {non_null} values are not a valid {kind} and became NA (e.g. {examples})"
+    # Invalid dates and amounts are expected (the analyzer reports "No valid
+    # appointment dates"); invalid IDs and flags mean the column has changed type
+    if kind in _STRICT_KINDS and invalid / non_null > CAST_MAX_INVALID_FRACTION:
+        raise ValueError(f"{message}; more than CAST_MAX_INVALID_FRACTION={CAST_MAX_INVALID_FRACTION}")
+    logger.warning(message)
+
+
+def cast_frame(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Cast the columns of a freshly fetched frame to the registered dtypes."""
+    schema = TABLE_SCHEMAS[table]
+    before = df.memory_usage(deep=True).sum() if logger.is_enabled_for(logging.DEBUG) else None
+    for column, kind in schema.items():
+        if column in df.columns:
+            cast = _CASTERS[kind](df[column])
+            _check_coercion(table, column, kind, df[column], cast)
+            df[column] = cast
+    if before is not None:
+        logger.debug(
+            "Cast %s frame: %d rows, %.1f MiB -> %.1f MiB",
+            table, len(df), before / 2**20, df.memory_usage(deep=True).sum() / 2**20,
+        )
+    return df
+
+
+def concat_cast_frames(chunks):
+    """Concatenate frames cast by `cast_frame`, keeping categoricals categorical.
+
+    Chunks cast independently get different category sets, which a plain
+    pd.concat would fall back to object dtype for; union them first.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals(
+                [chunk[column] for chunk in chunks], ignore_order=True
+            ).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
@@ -1,23 +1,41 @@
-import os
-from config import RAW_DATASET_ID, MERGED_SERVICE_TYPE_TABLE
+from bq_client import run_query
+from data_fetching.schemas import cast_frame
+from data_fetching.snapshot import service_types_source
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
-SERVICE_TYPES_TABLE = os.getenv(
-    "SERVICE_TYPES_TABLE", f"{RAW_DATASET_ID}.FR_SERVICE_TYPE"
-)
+# Row order within a client's service types. The pipeline keeps the first
+# row per TYPE_ID (pipeline.prepare_service_types) and the compiled analysis
+# the first per (CLIENT, TYPE_ID) (processing.sql_compiler), so both pick the
+# same row: the latest load, then the lowest raw TYPE_ID and DESCRIPTION.
+SERVICE_TYPE_ORDER = "DATE_LOADED DESC, CAST(TYPE_ID AS STRING), DESCRIPTION"
 
 
-def get_service_types_for_client(bq_client, client_id):
+def type_id_filter(column, type_ids=None):
+    """Return the SQL predicate (with leading AND) keeping rows whose `column` is one of `type_ids`.
+
+    Empty when type_ids is None. Used by `--type-ids` runs to push the
+    TYPE_ID selection down into every per-client query.
+    """
+    if type_ids is None:
+        return ""
+    id_list = ", ".join(str(int(t)) for t in sorted(type_ids))
+    return f"AND SAFE_CAST({column} AS INT64) IN ({id_list})"
+
+
+def service_types_where(client_id):
+    """Filter on the service type table's CLIENT column for `client_id`."""
     # Special handling for ACCEL: expand to all ACCEL_OFFICE_* and normalize clientId
     if client_id == "ACCEL":
         offices = ("ACCEL_OFFICE_1", "ACCEL_OFFICE_2", "ACCEL_OFFICE_3", "ACCEL_OFFICE_4")
         office_list = ", ".join([f"'{o}'" for o in offices])
-        where_clause = f"CLIENT IN ({office_list})"
-    else:
-        where_clause = f"CLIENT = '{client_id}'"
+        return f"CLIENT IN ({office_list})"
+    return f"CLIENT = '{client_id}'"
+
 
+def service_types_query(client_id, type_ids=None):
+    where_clause = f"{service_types_where(client_id)} {type_id_filter('TYPE_ID', type_ids)}".strip()
     query = f"""
         SELECT
             CAST(TYPE_ID AS INT64) AS TYPE_ID,
@@ -29,33 +47,16 @@ def get_service_types_for_client(bq_client, client_id):
             SAFE_CAST(INITIAL_ID AS INT64) AS API_INITIAL_ID,
             SAFE_CAST(INITIAL AS INT64) AS API_INITIAL,
             CLIENT AS clientId
-        FROM (
-            SELECT * ,
-                ROW_NUMBER() OVER (
-                    PARTITION BY CLIENT, TYPE_ID
-                    ORDER BY DATE_LOADED DESC
-                ) AS rn
-            FROM `{SERVICE_TYPES_TABLE}`
-            WHERE {where_clause}
-        )
-        WHERE rn = 1
+        FROM {service_types_source(where_clause)}
+        ORDER BY {SERVICE_TYPE_ORDER}
     """
+    return query
+
+
+def get_service_types_for_client(bq_client, client_id, type_ids=None):
     logger.info(f"Fetching service types for client: {client_id}")
-    df = bq_client.query(query).to_dataframe()
+    df = run_query(bq_client, service_types_query(client_id, type_ids))
     if client_id == "ACCEL" and not df.empty:
         # Normalize merged set under single client name
         df["clientId"] = "ACCEL"
-    return df
-
-
-def get_merged_service_types_for_client(bq_client, client_id):
-    query = f"""
-        SELECT
-            CAST(typeID as INT64) as TYPE_ID,
-            description as DESCRIPTION,
-            clientID as clientId
-        FROM `{MERGED_SERVICE_TYPE_TABLE}`
-        WHERE clientID = '{client_id}'
-    """
-    logger.info(f"Fetching merged service types for client: {client_id}")
-    return bq_client.query(query).to_dataframe()
+    return cast_frame(df, "service_types")
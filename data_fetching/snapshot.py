@@ -0,0 +1,127 @@
+from config import (
+    SERVICE_TYPES_TABLE,
+    SERVICE_TYPES_SNAPSHOT_TABLE,
+    USE_SERVICE_TYPE_SNAPSHOT,
+)
+from bq_client import run_query, run_statement
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+# FR_SERVICE_TYPE is a load history: every load appends a full copy of each
+# client's catalog. The snapshot keeps only the latest row per (CLIENT, TYPE_ID)
+# and is refreshed from rows loaded after its own MAX(DATE_LOADED), so service
+# type reads no longer re-scan and re-sort the whole history.
+KEY_COLUMNS = ("CLIENT", "TYPE_ID")
+
+# Set when a refresh fails, so this process falls back to the history table
+# instead of reading a snapshot that may be missing or stale.
+_snapshot_failed = False
+
+
+def snapshot_enabled():
+    return USE_SERVICE_TYPE_SNAPSHOT and not _snapshot_failed
+
+
+def latest_rows_sql(where_clause="TRUE"):
+    """Latest load of each (CLIENT, TYPE_ID) in the history table, restricted by `where_clause`."""
+    return f"""
+        SELECT * EXCEPT(rn)
+        FROM (
+            SELECT * ,
+                ROW_NUMBER() OVER (
+                    PARTITION BY CLIENT, TYPE_ID
+                    ORDER BY DATE_LOADED DESC
+                ) AS rn
+            FROM `{SERVICE_TYPES_TABLE}`
+            WHERE {where_clause}
+        )
+        WHERE rn = 1
+    """
+
+
+def service_types_source(where_clause):
+    """FROM-clause source yielding the latest row per service type for `where_clause`.
+
+    Reads the snapshot table when it is enabled, otherwise deduplicates the
+    history table on the fly.
+    """
+    if snapshot_enabled():
+        return f"(SELECT * FROM `{SERVICE_TYPES_SNAPSHOT_TABLE}` WHERE {where_clause})"
+    return f"({latest_rows_sql(where_clause)})"
+
+
+def clients_source():
+    return SERVICE_TYPES_SNAPSHOT_TABLE if snapshot_enabled() else SERVICE_TYPES_TABLE
+
+
+def _create_snapshot(bq_client):
+    run_statement(bq_client, f"""
+        CREATE TABLE `{SERVICE_TYPES_SNAPSHOT_TABLE}`
+        CLUSTER BY CLIENT, TYPE_ID
+        AS {latest_rows_sql()}
+    """)
+    logger.info(f"Created service type snapshot {SERVICE_TYPES_SNAPSHOT_TABLE} from {SERVICE_TYPES_TABLE}")
+
+
+def _merge_new_loads(bq_client, columns):
+    watermark_df = run_query(
+        bq_client, f"SELECT CAST(MAX(DATE_LOADED) AS STRING) AS watermark FROM `{SERVICE_TYPES_SNAPSHOT_TABLE}`"
+    )
+    watermark = watermark_df["watermark"].iloc[0] if not watermark_df.empty else None
+    if watermark is None:
+        # Empty snapshot: a merge of everything is equivalent to a rebuild
+        new_rows_filter = "TRUE"
+    else:
+        # A literal (not a subquery) so BigQuery can prune DATE_LOADED partitions
+        new_rows_filter = f"DATE_LOADED > '{watermark}'"
+
+    update_columns = [c for c in columns if c not in KEY_COLUMNS]
+    update_set = ",\n                ".join(f"{c} = S.{c}" for c in update_columns)
+    job = run_statement(bq_client, f"""
+        MERGE `{SERVICE_TYPES_SNAPSHOT_TABLE}` T
+        USING ({latest_rows_sql(new_rows_filter)}) S
+        ON T.CLIENT = S.CLIENT AND T.TYPE_ID = S.TYPE_ID
+        WHEN MATCHED AND S.DATE_LOADED >= T.DATE_LOADED THEN
+            UPDATE SET
+                {update_set}
+        WHEN NOT MATCHED THEN
+            INSERT ROW
+    """)
+    logger.info(
+        f"Refreshed service type snapshot from loads after {watermark}: "
+        f"{job.num_dml_affected_rows or 0} rows inserted or updated"
+    )
+
+
+def refresh_service_type_snapshot(bq_client):
+    """Create or incrementally refresh SERVICE_TYPES_SNAPSHOT_TABLE.
+
+    Returns True if the snapshot is usable. On failure the rest of the run
+    reads the history table directly.
+    """
+    from google.api_core.exceptions import NotFound
+
+    global _snapshot_failed
+    if not USE_SERVICE_TYPE_SNAPSHOT:
+        return False
+    try:
+        try:
+            table = bq_client.get_table(SERVICE_TYPES_SNAPSHOT_TABLE)
+        except NotFound:
+            _create_snapshot(bq_client)
+        else:
+            _merge_new_loads(bq_client, [field.name for field in table.schema])
+    except Exception as e:
+        _snapshot_failed = True
+        logger.warning(f"Service type snapshot refresh failed, reading {SERVICE_TYPES_TABLE} directly: {e}")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    from bq_client import get_bq_client
+
+    # Run once before starting the shards of a sharded run (see README, Sharding)
+    if not refresh_service_type_snapshot(get_bq_client()):
+        raise SystemExit(1)
@@ -1,11 +1,14 @@
 from config import MERGED_SUBSCRIPTION_TABLE
+from bq_client import run_query
+from data_fetching.schemas import cast_frame
+from data_fetching.service_types import type_id_filter
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
 
-def get_subscriptions_for_client(bq_client, client_id):
-    query = f"""
+def subscriptions_query(client_id, type_ids=None):
+    return f"""
         SELECT
             subscriptionID,
             serviceID,
@@ -17,6 +20,10 @@ def get_subscriptions_for_client(bq_client, client_id):
             dateAdded
         FROM `{MERGED_SUBSCRIPTION_TABLE}`
         WHERE clientID = '{client_id}'
+        {type_id_filter("serviceID", type_ids)}
     """
+
+
+def get_subscriptions_for_client(bq_client, client_id, type_ids=None):
     logger.info(f"Fetching subscriptions for client: {client_id}")
-    return bq_client.query(query).to_dataframe()
+    return cast_frame(run_query(bq_client, subscriptions_query(client_id, type_ids)), "subscriptions")
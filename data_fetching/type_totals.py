@@ -0,0 +1,69 @@
+from config import MERGED_APPOINTMENT_TABLE, MERGED_SUBSCRIPTION_TABLE, APPOINTMENT_LOOKBACK_YEARS
+from bq_client import run_query
+from data_fetching.appointments import appointment_lookback_filter
+from data_fetching.schemas import cast_frame, true_flag_sql
+from data_fetching.service_types import service_types_where, type_id_filter
+from data_fetching.snapshot import service_types_source
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+
+def type_totals_query(client_id, type_ids, lookback_years=APPOINTMENT_LOOKBACK_YEARS, now=None):
+    """Client-wide figures that a `--type-ids` fetch cannot derive from its filtered rows.
+
+    One row per (measure, TYPE_ID):
+        appointments   appointment rows per type over the whole client (TYPE_ID
+                       NULL for rows without a valid type)
+        revenue        annualRecurringServices of active subscriptions per serviceID,
+                       parsed like pipeline.compute_share_maps
+        repeated_name  selected types whose description is shared with another
+                       type of the client; value is the number of such types
+    Only aggregates leave BigQuery, one row per type of the client at most.
+    """
+    return f"""
+        WITH service_types AS (
+            SELECT DISTINCT SAFE_CAST(TYPE_ID AS INT64) AS TYPE_ID, DESCRIPTION
+            FROM {service_types_source(service_types_where(client_id))}
+            WHERE TYPE_ID IS NOT NULL
+        ),
+        description_counts AS (
+            SELECT DESCRIPTION, COUNT(DISTINCT TYPE_ID) AS types
+            FROM service_types
+            WHERE DESCRIPTION IS NOT NULL
+            GROUP BY DESCRIPTION
+        ),
+        active_subscriptions AS (
+            SELECT
+                SAFE_CAST(serviceID AS INT64) AS TYPE_ID,
+                REGEXP_REPLACE(TRIM(CAST(annualRecurringServices AS STRING)), r'[,$]', '') AS ars
+            FROM `{MERGED_SUBSCRIPTION_TABLE}`
+            WHERE clientID = '{client_id}'
+                AND {true_flag_sql("active")}
+                AND SAFE_CAST(dateCancelled AS TIMESTAMP) IS NULL
+        )
+        SELECT 'appointments' AS measure, SAFE_CAST(type AS INT64) AS TYPE_ID, CAST(COUNT(*) AS FLOAT64) AS value
+        FROM `{MERGED_APPOINTMENT_TABLE}`
+        WHERE clientID = '{client_id}'
+        {appointment_lookback_filter(lookback_years, today=now)}
+        GROUP BY TYPE_ID
+        UNION ALL
+        SELECT 'revenue', TYPE_ID, SUM(IF(REGEXP_CONTAINS(ars, r'^\\(.*\\)$'), -ABS(ars_num), ars_num))
+        FROM (
+            SELECT *, SAFE_CAST(REGEXP_REPLACE(ars, r'[()]', '') AS FLOAT64) AS ars_num
+            FROM active_subscriptions
+        )
+        WHERE TYPE_ID IS NOT NULL AND ars_num IS NOT NULL AND NOT IS_NAN(ars_num)
+        GROUP BY TYPE_ID
+        UNION ALL
+        SELECT 'repeated_name', s.TYPE_ID, CAST(d.types AS FLOAT64)
+        FROM service_types s
+        JOIN description_counts d ON d.DESCRIPTION = s.DESCRIPTION
+        WHERE d.types > 1
+        {type_id_filter("s.TYPE_ID", type_ids)}
+    """
+
+
+def get_type_totals_for_client(bq_client, client_id, type_ids, lookback_years=APPOINTMENT_LOOKBACK_YEARS, now=None):
+    logger.info(f"Fetching client-wide type totals for client: {client_id}")
+    return cast_frame(run_query(bq_client, type_totals_query(client_id, type_ids, lookback_years, now)), "type_totals")
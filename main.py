@@ -1,174 +1,375 @@
-from bq_client import get_bq_client
-from data_fetching.clients import get_distinct_clients
-from data_fetching.service_types import (
-    get_service_types_for_client,
-    get_merged_service_types_for_client,
+from bq_client import get_bq_client, run_query, run_statement
+from output.sinks import build_sinks
+from pipeline import parse_type_ids, process_client, reconcile_sources, refresh_sources, resolve_clients, run_pipeline
+from data_fetching.planner import STRATEGIES, plan_clients, format_plan
+from config import (
+    OUTPUT_SINKS,
+    TARGETED_OUTPUT_SINKS,
+    RUN_DIR,
+    CHECKPOINT_FETCH_CACHE,
+    FETCH_PLANNING,
+    RUN_REPORT_JSON_PATH,
+    RUN_REPORT_PROM_PATH,
+    PROFILE_DIR,
+    PROFILE_TOP_N,
+    CLIENT_WORKERS,
+    CLIENT_PRIORITY_PATH,
+    PREFETCH_DEPTH,
+    FEATURE_STORE,
+    FEATURE_STORE_DIR,
+    FEATURE_STORE_KEEP_RUNS,
+    REEVALUATE_DIFF_PATH,
+    BQ_OUTPUT_TABLE,
+    BQ_OUTPUT_SCHEMA,
+    WAREHOUSE_CROSS_CHECK_CLIENTS,
+    WAREHOUSE_CROSS_CHECK_PATH,
+    RECONCILE_MERGED_SERVICE_TYPES,
+    SERVICE_HOST,
+    SERVICE_PORT,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_ASYNC,
+    LOG_SUMMARY,
 )
-from data_fetching.appointments import get_appointments_for_client
-from data_fetching.subscriptions import get_subscriptions_for_client
-from data_fetching.recurring_lookup import get_recurring_lookup_for_client
-from processing.analyzer import analyze_service_type
-from processing.builder import build_final_dataframe
-from processing.filters import filter_active_subscription
-from output.exporter import export_askclient_table, export_excel_with_sheets
-from output.uploader import upload_to_bigquery
-from output.google_sheets import export_to_google_sheets
-from config import BQ_OUTPUT_TABLE, BQ_OUTPUT_SCHEMA, GOOGLE_SHEETS_FOLDER_ID
 import argparse
 import os
+import random
 import pandas as pd
-from utils.logger import Logger
+from processing.feature_store import FeatureStore, diff_results, format_diff_summary, reevaluate
+from processing.sql_compiler import CROSS_CHECK_COLUMNS, compile_analysis_sql, compile_output_table_sql
+from processing.signal_cache import get_text_signal_cache
+from utils.checkpoint import RunCheckpoint, load_deferred_runs
+from utils.logger import Logger, configure_logging
+from utils.metrics import start_run
+from utils.profiling import ClientProfiler
+from utils.sharding import Shard
+from utils.scheduler import ClientScheduler, estimate_client_costs, load_previous_timings, load_priorities
 
 logger = Logger(__name__)
 
 
+def reevaluate_run(run_id):
+    """Resolve a stored run's features with the current config and report changed flags."""
+    if run_id == "latest":
+        store = FeatureStore.latest(FEATURE_STORE_DIR)
+        if store is None:
+            raise SystemExit(f"No stored features in {FEATURE_STORE_DIR}; run the pipeline with FEATURE_STORE=1 first")
+    else:
+        store = FeatureStore(FEATURE_STORE_DIR, run_id)
+    results, diff = reevaluate(store)
+    print(format_diff_summary(diff, len(results)))
+    diff_dir = os.path.dirname(REEVALUATE_DIFF_PATH)
+    if diff_dir:
+        os.makedirs(diff_dir, exist_ok=True)
+    diff.to_csv(REEVALUATE_DIFF_PATH, index=False)
+    logger.info(f"Wrote {len(diff)} flag changes against run {store.run_id} to {REEVALUATE_DIFF_PATH}")
+
+
+def run_in_warehouse(bq_client, clients, metrics, now, restrict=True, cross_check_clients=WAREHOUSE_CROSS_CHECK_CLIENTS):
+    """Write BQ_OUTPUT_TABLE with the compiled analysis query, then cross-check a sample of clients in Python.
+
+    Without `restrict` the query covers every client and `clients` is only
+    the population the cross-check sample is drawn from.
+    """
+    with metrics.stage(None, "warehouse_analysis"):
+        run_statement(bq_client, compile_output_table_sql(BQ_OUTPUT_TABLE, clients if restrict else None, now))
+    logger.info(f"Wrote in-warehouse analysis of {len(clients)} clients to {BQ_OUTPUT_TABLE}")
+
+    sample = random.sample(clients, min(cross_check_clients, len(clients)))
+    if not sample:
+        return
+    with metrics.stage(None, "warehouse_cross_check"):
+        warehouse_df = run_query(bq_client, compile_analysis_sql(sample, now))
+    python_rows = [row for client_id in sample for row in process_client(bq_client, client_id, now, metrics)]
+    python_df = pd.DataFrame(python_rows, columns=[name for name, _ in BQ_OUTPUT_SCHEMA])
+    diff = diff_results(python_df, warehouse_df, CROSS_CHECK_COLUMNS)
+    diff_dir = os.path.dirname(WAREHOUSE_CROSS_CHECK_PATH)
+    if diff_dir:
+        os.makedirs(diff_dir, exist_ok=True)
+    diff.to_csv(WAREHOUSE_CROSS_CHECK_PATH, index=False)
+    message = (
+        f"Cross-check of {len(sample)} clients ({', '.join(sample)}): {len(diff)} differences "
+        f"between {len(python_df)} Python and {len(warehouse_df)} warehouse rows, written to {WAREHOUSE_CROSS_CHECK_PATH}"
+    )
+    if diff.empty:
+        logger.info(message)
+    else:
+        logger.warning(message)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--clients",
         help="Comma-separated list of client IDs to process. Overrides CLIENT_IDS env var",
     )
+    parser.add_argument(
+        "--type-ids",
+        help="Comma-separated TYPE_IDs: fetch and analyze only these service types of each client",
+    )
+    parser.add_argument(
+        "--sinks",
+        help=(
+            "Comma-separated output sinks fed by this run: askclient,bigquery,excel,unfiltered,sheets "
+            f"(default: {OUTPUT_SINKS}; with --type-ids: {TARGETED_OUTPUT_SINKS})"
+        ),
+    )
+    parser.add_argument(
+        "--run-id",
+        help="Name of this run's checkpoint directory under RUN_DIR (default: timestamp)",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        help="Resume a checkpointed run: skip completed clients and finished sinks",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        help="This task's shard, 0-based (default: SHARD_INDEX or CLOUD_RUN_TASK_INDEX)",
+    )
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        help="Number of shards the clients are hashed into (default: SHARD_COUNT or CLOUD_RUN_TASK_COUNT)",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        default=FETCH_PLANNING,
+        help="Dry-run each client's queries and pick a fetch strategy per client (raw, chunked, stream, aggregate)",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        help="Fetch every client with this appointment strategy instead of planning",
+    )
+    parser.add_argument(
+        "--plan-only",
+        action="store_true",
+        help="Print the fetch plan and its predicted cost, then exit without fetching",
+    )
+    parser.add_argument(
+        "--reevaluate",
+        nargs="?",
+        const="latest",
+        metavar="RUN_ID",
+        help="Re-apply the current rules to the stored features of a run (default: latest) and report changed flags",
+    )
+    parser.add_argument(
+        "--in-warehouse",
+        action="store_true",
+        help="Run the analysis as one BigQuery query into BQ_OUTPUT_TABLE instead of fetching clients",
+    )
+    parser.add_argument(
+        "--cross-check",
+        type=int,
+        default=WAREHOUSE_CROSS_CHECK_CLIENTS,
+        metavar="N",
+        help="With --in-warehouse: also analyze N random clients in Python and report differing flags",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        type=int,
+        const=SERVICE_PORT,
+        metavar="PORT",
+        help=f"Serve single-client analysis over HTTP on SERVICE_HOST ({SERVICE_HOST}), port PORT (default: {SERVICE_PORT})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=CLIENT_WORKERS,
+        help="Number of clients processed concurrently, started largest first",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=PREFETCH_DEPTH,
+        metavar="K",
+        help="Pipelined mode: fetch up to K clients ahead of analysis, write per-client sinks on a separate thread",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        metavar="SECONDS",
+        help="Defer clients predicted to finish after this many seconds (priority clients always run)",
+    )
+    parser.add_argument(
+        "--priority-file",
+        default=CLIENT_PRIORITY_PATH,
+        help="JSON object {client_id: weight}; clients with a positive weight are never deferred",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=["cpu", "mem"],
+        help="Profile each client's processing: cpu (cProfile) or mem (tracemalloc)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=PROFILE_DIR,
+        help="Directory for per-client profile files and the hotspot summary",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=PROFILE_TOP_N,
+        help="Number of hotspots/allocation sites listed per client in the summary",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "json"],
+        default=LOG_FORMAT,
+        help="Log line format",
+    )
+    parser.add_argument(
+        "--log-async",
+        action="store_true",
+        default=LOG_ASYNC,
+        help="Write log records from a background thread (QueueHandler)",
+    )
+    parser.add_argument(
+        "--log-summary",
+        action="store_true",
+        default=LOG_SUMMARY,
+        help="Aggregate per-service-type log events into one summary line per client",
+    )
     args = parser.parse_args()
 
+    configure_logging(
+        LOG_LEVEL,
+        json_output=args.log_format == "json",
+        async_output=args.log_async,
+        summary=args.log_summary,
+    )
+    type_ids = None
+    if args.type_ids:
+        if args.in_warehouse or args.serve or args.reevaluate:
+            parser.error("--type-ids cannot be combined with --in-warehouse, --serve or --reevaluate")
+        if args.plan_only:
+            parser.error("--plan-only estimates full-client fetches; it cannot be combined with --type-ids")
+        try:
+            type_ids = parse_type_ids(args.type_ids)
+        except ValueError as e:
+            parser.error(f"--type-ids: {e}")
+    if args.reevaluate:
+        reevaluate_run(args.reevaluate)
+        return
+    if args.serve:
+        # Imported here so batch runs do not pay for http.server
+        from service import serve
+        serve(get_bq_client(), SERVICE_HOST, args.serve)
+        return
+    if args.profile and args.workers > 1:
+        # cProfile and tracemalloc are per process, not per client thread
+        logger.warning("Profiling runs clients one at a time; ignoring --workers")
+        args.workers = 1
+    if args.profile and args.prefetch:
+        logger.warning("Profiling runs fetch and analysis in one thread; ignoring --prefetch")
+        args.prefetch = 0
+    if args.workers > 1 and args.prefetch:
+        logger.warning("--workers already overlaps fetching and analysis; ignoring --prefetch")
+        args.prefetch = 0
+    # Read before this run overwrites the report
+    previous_timings = load_previous_timings(RUN_REPORT_JSON_PATH)
+    # Clients the last run deferred, read before this run's checkpoint is created
+    deferred_runs = load_deferred_runs(RUN_DIR)
+    metrics = start_run(args.resume or args.run_id)
+    profiler = ClientProfiler(args.profile, args.profile_dir, top_n=args.profile_top)
+    profiler.attach(metrics)
+    # A resumed shard must write to the staging tables of the run it resumes
+    shard = Shard.from_env(args.shard_index, args.shard_count, run_id=args.resume or args.run_id)
+    if shard:
+        logger.info(f"Running as {shard}")
     bq_client = get_bq_client()
+    # Once per run: the first shard refreshes the snapshot, the others read it
+    # as it is, so concurrent tasks never race its CREATE / MERGE
+    if not args.plan_only and not (shard and shard.index):
+        refresh_sources(bq_client, metrics)
 
-    if args.clients:
-        clients = [c.strip() for c in args.clients.split(",") if c.strip()]
-    else:
-        env_clients = os.getenv("CLIENT_IDS")
-        if env_clients:
-            clients = [c.strip() for c in env_clients.split(",") if c.strip()]
-        else:
-            clients = get_distinct_clients(bq_client)
-    all_rows = []
-    now = pd.to_datetime("today")
-
-    for client_id in clients:
-        logger.info(f"Processing client: {client_id}")
-        service_types_df = get_service_types_for_client(bq_client, client_id)
-        merged_service_types_df = get_merged_service_types_for_client(bq_client, client_id)
-        recurring_lookup_df = get_recurring_lookup_for_client(bq_client, client_id)
-        logger.info(
-            f"Rows fetched for {client_id} — service_types: {len(service_types_df)}, merged_service_types: {len(merged_service_types_df)}, recurring_lookup: {len(recurring_lookup_df)}"
+    # Clients named on the command line or in CLIENT_IDS, rather than every client
+    explicit_clients = bool(args.clients or os.getenv("CLIENT_IDS"))
+    if args.in_warehouse:
+        run_in_warehouse(
+            bq_client, resolve_clients(bq_client, args.clients, metrics), metrics, pd.to_datetime("today"),
+            restrict=explicit_clients, cross_check_clients=args.cross_check,
         )
+        metrics.write_json(RUN_REPORT_JSON_PATH)
+        metrics.write_prometheus(RUN_REPORT_PROM_PATH)
+        logger.info("Done.")
+        return
 
-        # Merge lookup on description/serviceType to attach isRecurring info
-        service_types_df = service_types_df.merge(
-            recurring_lookup_df[["serviceType", "isRecurring"]],
-            left_on="DESCRIPTION",
-            right_on="serviceType",
-            how="left",
-        )
-        if "serviceType" in service_types_df.columns:
-            service_types_df.drop(columns=["serviceType"], inplace=True)
-
-        # De-duplicate service types per client by TYPE_ID before analysis
-        before_dedup = len(service_types_df)
-        service_types_df = service_types_df.drop_duplicates(subset=["TYPE_ID"])  # safe no-op if already unique
-        after_dedup = len(service_types_df)
-        if after_dedup < before_dedup:
-            logger.info(f"De-duplicated service types for {client_id}: {before_dedup} -> {after_dedup}")
-
-        merged_check = service_types_df.merge(
-            merged_service_types_df[["TYPE_ID", "DESCRIPTION"]],
-            on="TYPE_ID",
-            how="left",
-            suffixes=("", "_MERGED"),
+    text_signal_cache = get_text_signal_cache()
+    text_signal_cache.load()
+
+    appointment_rows = {}
+    if args.resume:
+        # The resumed run keeps its original client list, sinks and analysis date
+        checkpoint = RunCheckpoint.load(RUN_DIR, args.resume, cache_fetches=CHECKPOINT_FETCH_CACHE)
+        clients = checkpoint.clients
+        sinks = build_sinks(checkpoint.sinks, shard=shard)
+        if type_ids is not None:
+            logger.warning(f"Ignoring --type-ids: run {args.resume} keeps its original selection")
+    else:
+        sinks = build_sinks(args.sinks or (TARGETED_OUTPUT_SINKS if type_ids else OUTPUT_SINKS), shard=shard)
+        if type_ids:
+            replaced = [sink.name for sink in sinks if getattr(sink, "table_id", None)]
+            if replaced:
+                parser.error(f"--type-ids results cover only the selected types; they cannot replace the tables of sinks {replaced}")
+            if args.plan:
+                logger.info("Fetch planning estimates full-client fetches; fetching the selected types raw")
+                args.plan = False
+        clients = resolve_clients(bq_client, args.clients, metrics)
+        # Once per run: in a sharded run the first shard checks every client
+        if (
+            RECONCILE_MERGED_SERVICE_TYPES and not args.plan_only and not type_ids
+            and not (shard and shard.index)
+        ):
+            reconcile_sources(bq_client, clients if explicit_clients else None, metrics)
+        if shard:
+            clients = shard.select(clients)
+        # The analysis date of the run, also ending the lookback window of planning queries
+        now = pd.to_datetime("today")
+        strategies = {}
+        if args.strategy and not args.plan_only:
+            strategies = {client_id: args.strategy for client_id in clients}
+        elif args.plan or args.plan_only:
+            plans = plan_clients(bq_client, clients, metrics, now=now)
+            print(format_plan(plans))
+            if args.plan_only:
+                return
+            strategies = {plan["client_id"]: plan["strategy"] for plan in plans}
+            appointment_rows = {plan["client_id"]: plan["appointment_rows"] for plan in plans}
+        checkpoint = RunCheckpoint.create(
+            RUN_DIR, metrics.run_id, clients, [sink.name for sink in sinks],
+            now, cache_fetches=CHECKPOINT_FETCH_CACHE, strategies=strategies,
+            type_ids=type_ids,
         )
-        mismatched = merged_check[
-            merged_check["DESCRIPTION_MERGED"].isna()
-            | (merged_check["DESCRIPTION_MERGED"] != merged_check["DESCRIPTION"])
-        ]
-        if not mismatched.empty:
-            logger.warning(
-                f"merged_service_type mismatches for client {client_id}"
-            )
-            logger.warning(
-                mismatched[["TYPE_ID", "DESCRIPTION", "DESCRIPTION_MERGED"]].to_dict(orient="records")
-            )
-        appointments_df = get_appointments_for_client(bq_client, client_id)
-        subscriptions_df = get_subscriptions_for_client(bq_client, client_id)
-        logger.info(
-            f"Rows fetched for {client_id} — appointments: {len(appointments_df)}, subscriptions: {len(subscriptions_df)}"
+    scheduler = None
+    if args.workers > 1 or args.time_budget is not None:
+        scheduler = ClientScheduler(
+            estimate_client_costs(clients, previous_timings, appointment_rows),
+            workers=args.workers,
+            time_budget=args.time_budget,
+            priorities=load_priorities(args.priority_file),
+            deferred_runs=deferred_runs,
         )
+    run_pipeline(
+        bq_client, clients, sinks, metrics, profiler=profiler, now=checkpoint.now,
+        checkpoint=checkpoint, strategies=checkpoint.strategies,
+        workers=args.workers, scheduler=scheduler, prefetch=args.prefetch,
+        feature_store=FeatureStore(FEATURE_STORE_DIR, checkpoint.run_id) if FEATURE_STORE else None,
+        type_ids=checkpoint.type_ids,
+    )
+    if FEATURE_STORE:
+        FeatureStore.prune(FEATURE_STORE_DIR, FEATURE_STORE_KEEP_RUNS)
 
-        # Compute appointment share per service type for prioritization
-        appt_share_pct_by_type = {}
-        top20_type_ids = set()
-        try:
-            if not appointments_df.empty:
-                ap = appointments_df.copy()
-                ap['type_int'] = pd.to_numeric(ap['type'], errors='coerce')
-                counts = ap.dropna(subset=['type_int']).groupby('type_int').size().reset_index(name='appointmentCount')
-                total = counts['appointmentCount'].sum()
-                if total and total > 0:
-                    counts['appointmentSharePct'] = (counts['appointmentCount'] / total * 100).round(2)
-                    appt_share_pct_by_type = {int(row.type_int): float(row.appointmentSharePct) for _, row in counts.iterrows()}
-                    top20 = counts.sort_values('appointmentCount', ascending=False).head(20)
-                    top20_type_ids = set(top20['type_int'].astype(int).tolist())
-        except Exception as e:
-            logger.warning(f"Failed computing appointment share for client {client_id}: {e}")
-
-        # Compute revenue share per service type from subscriptions (annualRecurringServices)
-        revenue_share_pct_by_type = {}
-        top10_revenue_type_ids = set()
-        try:
-            subs = subscriptions_df.copy()
-            if not subs.empty:
-                # Active subscriptions only
-                subs_active = subs[(subs['active'] == True) & (subs['dateCancelled'].isnull())]
-                # Normalize serviceID type and annualRecurringServices numeric
-                subs_active['service_int'] = pd.to_numeric(subs_active['serviceID'], errors='coerce')
-                ars = subs_active.get('annualRecurringServices')
-                if ars is None:
-                    logger.warning(f"annualRecurringServices column not found in subscriptions for {client_id}. Available columns: {list(subs_active.columns)}")
-                else:
-                    ars_str = ars.astype(str).str.strip()
-                    ars_str = ars_str.str.replace(r'[,$]', '', regex=True)
-                    neg_mask = ars_str.str.match(r'^\(.*\)$', na=False)
-                    ars_str = ars_str.str.replace(r'[()]', '', regex=True)
-                    subs_active['ars_num'] = pd.to_numeric(ars_str, errors='coerce')
-                    subs_active.loc[neg_mask, 'ars_num'] = -subs_active.loc[neg_mask, 'ars_num'].abs()
-                    subs_active = subs_active.dropna(subset=['service_int', 'ars_num'])
-                    if not subs_active.empty:
-                        sums = subs_active.groupby('service_int')['ars_num'].sum().reset_index(name='ars_total')
-                        total_ars = float(sums['ars_total'].sum())
-                        logger.info(f"Total annualRecurringServices for {client_id}: {total_ars:.2f} across {len(sums)} service types")
-                        if total_ars and total_ars > 0:
-                            sums['revenueSharePct'] = (sums['ars_total'] / total_ars * 100).round(2)
-                            revenue_share_pct_by_type = {int(row.service_int): float(row.revenueSharePct) for _, row in sums.iterrows()}
-                            top10 = sums.sort_values('ars_total', ascending=False).head(10)
-                            top10_revenue_type_ids = set(top10['service_int'].astype(int).tolist())
-        except Exception as e:
-            logger.warning(f"Failed computing revenue share (subscriptions) for client {client_id}: {e}")
-
-        client_rows = []
-        for _, row in service_types_df.iterrows():
-            result_row = analyze_service_type(
-                row, appointments_df, subscriptions_df, service_types_df, now, client_id,
-                appt_share_pct_by_type=appt_share_pct_by_type, top20_type_ids=top20_type_ids,
-                revenue_share_pct_by_type=revenue_share_pct_by_type, top10_revenue_type_ids=top10_revenue_type_ids
-            )
-            all_rows.append(result_row)
-            client_rows.append(result_row)
-
-        # After finishing this client, export its results to Google Sheets to avoid rate limits later
-        client_final_df = build_final_dataframe(client_rows)
-        client_final_df = filter_active_subscription(client_final_df)
-        if GOOGLE_SHEETS_FOLDER_ID:
-            try:
-                export_to_google_sheets(client_final_df, GOOGLE_SHEETS_FOLDER_ID)
-            except Exception as e:
-                logger.warning(f"Google Sheets export failed for client {client_id}: {e}")
-
-    final_df = build_final_dataframe(all_rows)
-    # Filter to rows with an active subscription before exporting
-    final_df = filter_active_subscription(final_df)
-
-    export_askclient_table(final_df)
-    upload_to_bigquery(final_df, BQ_OUTPUT_TABLE, BQ_OUTPUT_SCHEMA)
-    # Skip Google Sheets bulk export; already exported per-client above to reduce rate limits
-    export_excel_with_sheets(final_df, "final_df.xlsx")
+    text_signal_cache.save()
+    logger.info("Text signal cache: %(hits)d hits, %(misses)d misses, %(size)d entries", text_signal_cache.stats())
+
+    metrics.write_json(RUN_REPORT_JSON_PATH)
+    metrics.write_prometheus(RUN_REPORT_PROM_PATH)
+    profiler.write_summary()
     logger.info("Done.")
 
 
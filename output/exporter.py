@@ -1,16 +1,11 @@
-from google.cloud import bigquery
 import pandas as pd
-import os
-from config import DATASET_ID
+from config import ASK_CLIENT_TABLE
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
-ASK_CLIENT_TABLE = os.getenv(
-    "ASK_CLIENT_TABLE", f"{DATASET_ID}.ask_client_flags"
-)
 
-def export_askclient_table(final_df):
+def export_askclient_table(final_df, table_id=ASK_CLIENT_TABLE):
     logger.info("Exporting AskClient rows to BigQuery...")
 
     askclient_df = final_df[(final_df["AskClient"] == True) & (final_df["Expired Code"] == False)].copy()
@@ -39,9 +34,10 @@ def export_askclient_table(final_df):
     # Save to Excel
     askclient_final.to_excel("askclient_final.xlsx", index=False)
 
-    # Upload to BQ
+    # Upload to BQ; imported here so Excel-only runs never load the client library
+    from google.cloud import bigquery
+
     bq_client = bigquery.Client()
-    table_id = ASK_CLIENT_TABLE
 
     job_config = bigquery.LoadJobConfig(
         write_disposition="WRITE_TRUNCATE",
@@ -67,6 +63,33 @@ def export_askclient_table(final_df):
     logger.info(f"AskClient data uploaded to BigQuery table: {table_id}")
 
 
+def export_askclient_unfiltered(final_df):
+    """Export AskClient rows without applying the Expired Code filter (Excel only)."""
+
+    askclient_df = final_df[final_df["AskClient"] == True].copy()
+
+    askclient_df["Recurrence"] = askclient_df["API FREQUENCY FLAG"]
+    askclient_df["hasReservice"] = askclient_df["Final Has Reservice"]
+    askclient_df["isRervice"] = askclient_df["Final Reservice"]
+    askclient_df["zeroVisitTime"] = askclient_df["Final Zero Time"]
+
+    output_cols = [
+        "TYPE_ID",
+        "DESCRIPTION",
+        "Recurrence",
+        "hasReservice",
+        "isRervice",
+        "zeroVisitTime",
+        "Client",
+    ]
+    askclient_final = askclient_df[output_cols].copy()
+    askclient_final.rename(columns={"Client": "clientId"}, inplace=True)
+
+    # Save a separate Excel output to avoid overwriting the default
+    askclient_final.to_excel("askclient_final_unfiltered.xlsx", index=False)
+    logger.info("AskClient (unfiltered) Excel written: askclient_final_unfiltered.xlsx")
+
+
 def export_excel_with_sheets(final_df, filename="final_df.xlsx"):
     """Create an Excel workbook with 3 sheets as specified."""
     logger.info(f"Writing Excel report to {filename}...")
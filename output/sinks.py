@@ -0,0 +1,140 @@
+from config import BQ_OUTPUT_TABLE, BQ_OUTPUT_SCHEMA, ASK_CLIENT_TABLE, GOOGLE_SHEETS_FOLDER_ID
+from processing.filters import filter_active_subscription
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+
+class OutputSink:
+    """Destination for analysis results.
+
+    Sinks receive unfiltered frames and apply their own filtering, so one
+    pipeline run can feed filtered and unfiltered outputs alike. Backends
+    (BigQuery loads, gspread, openpyxl) are imported inside the hooks, so a
+    run only pays the import time of the sinks it enables.
+    """
+
+    name = ""
+    stage = ""
+    # Whether on_final replaces a whole BigQuery table (WRITE_TRUNCATE), so a
+    # frame missing clients would drop their rows from it
+    replaces_table = False
+
+    def on_client(self, client_id, client_df):
+        """Called once per client right after it has been analyzed."""
+
+    def on_final(self, final_df):
+        """Called once with the rows of every client."""
+
+    def write_client(self, client_id, client_df, metrics):
+        if type(self).on_client is not OutputSink.on_client:
+            with metrics.stage(client_id, self.stage):
+                self.on_client(client_id, client_df)
+
+    def write_final(self, final_df, metrics):
+        if type(self).on_final is not OutputSink.on_final:
+            with metrics.stage(None, self.stage):
+                self.on_final(final_df)
+
+
+class BigQuerySink(OutputSink):
+    """Full results, active-subscription filter applied, to BQ_OUTPUT_TABLE."""
+
+    name = "bigquery"
+    stage = "upload"
+    replaces_table = True
+
+    def __init__(self, table_id=BQ_OUTPUT_TABLE):
+        self.table_id = table_id
+
+    def on_final(self, final_df):
+        from output.uploader import upload_to_bigquery
+
+        upload_to_bigquery(filter_active_subscription(final_df), self.table_id, BQ_OUTPUT_SCHEMA)
+
+
+class AskClientSink(OutputSink):
+    """Non-expired AskClient rows to ASK_CLIENT_TABLE and askclient_final.xlsx."""
+
+    name = "askclient"
+    stage = "askclient_upload"
+    replaces_table = True
+
+    def __init__(self, table_id=ASK_CLIENT_TABLE):
+        self.table_id = table_id
+
+    def on_final(self, final_df):
+        from output.exporter import export_askclient_table
+
+        export_askclient_table(filter_active_subscription(final_df), self.table_id)
+
+
+class ExcelSink(OutputSink):
+    """Filtered three-sheet workbook final_df.xlsx."""
+
+    name = "excel"
+    stage = "excel_export"
+
+    def on_final(self, final_df):
+        from output.exporter import export_excel_with_sheets
+
+        export_excel_with_sheets(filter_active_subscription(final_df), "final_df.xlsx")
+
+
+class UnfilteredExcelSink(OutputSink):
+    """Unfiltered workbooks, formerly produced by utils/unfiltered_main.py."""
+
+    name = "unfiltered"
+    stage = "unfiltered_excel_export"
+
+    def on_final(self, final_df):
+        from output.exporter import export_askclient_unfiltered, export_excel_with_sheets
+
+        export_askclient_unfiltered(final_df)
+        export_excel_with_sheets(final_df, "final_df_unfiltered.xlsx")
+
+
+class GoogleSheetsSink(OutputSink):
+    """Per-client spreadsheets in GOOGLE_SHEETS_FOLDER_ID, exported as each client finishes."""
+
+    name = "sheets"
+    stage = "sheets_export"
+
+    def __init__(self, folder_id=GOOGLE_SHEETS_FOLDER_ID):
+        self.folder_id = folder_id
+
+    def on_client(self, client_id, client_df):
+        if not self.folder_id:
+            return
+        try:
+            from output.google_sheets import export_to_google_sheets
+
+            export_to_google_sheets(filter_active_subscription(client_df), self.folder_id)
+        except Exception as e:
+            logger.warning(f"Google Sheets export failed for client {client_id}: {e}")
+
+
+SINKS = {
+    sink.name: sink
+    for sink in (BigQuerySink, AskClientSink, ExcelSink, UnfilteredExcelSink, GoogleSheetsSink)
+}
+
+
+def build_sinks(names, shard=None):
+    """Instantiate sinks from a list or comma-separated string of names.
+
+    With a shard (utils.sharding.Shard), sinks that load a BigQuery table
+    write to that shard's staging table instead; `utils/merge_shards.py`
+    publishes the combined table.
+    """
+    if isinstance(names, str):
+        names = [n.strip() for n in names.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SINKS]
+    if unknown:
+        raise ValueError(f"Unknown output sinks: {unknown}. Available: {sorted(SINKS)}")
+    sinks = [SINKS[n]() for n in names]
+    if shard:
+        for sink in sinks:
+            if getattr(sink, "table_id", None):
+                sink.table_id = shard.staging_table(sink.table_id)
+    return sinks
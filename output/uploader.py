@@ -1,16 +1,26 @@
-from google.cloud import bigquery
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
+
+def schema_fields(schema):
+    """Build SchemaFields from declarative (name, type[, mode]) tuples as in config.BQ_OUTPUT_SCHEMA."""
+    from google.cloud import bigquery
+
+    return [bigquery.SchemaField(*field) for field in schema]
+
+
 def upload_to_bigquery(df, table_id, schema):
+    # Imported on first upload so runs without the bigquery sink skip it
+    from google.cloud import bigquery
+
     logger.info(f"Uploading full results to {table_id}...")
 
     bq_client = bigquery.Client()
 
     job_config = bigquery.LoadJobConfig(
         write_disposition="WRITE_TRUNCATE",
-        schema=schema
+        schema=schema_fields(schema)
     )
 
     load_job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
@@ -0,0 +1,432 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from data_fetching.clients import get_distinct_clients
+from data_fetching.service_types import get_service_types_for_client
+from data_fetching.appointments import (
+    get_appointments_for_client,
+    get_appointment_stats_for_client,
+)
+from data_fetching.snapshot import refresh_service_type_snapshot
+from data_fetching.reconciliation import reconcile_merged_service_types
+from data_fetching.appointment_stats import stream_appointment_stats_for_client
+from data_fetching.planner import STRATEGY_RAW, STRATEGY_CHUNKED, STRATEGY_STREAM, STRATEGY_AGGREGATE
+from data_fetching.subscriptions import get_subscriptions_for_client
+from data_fetching.recurring_lookup import get_recurring_lookup_for_client
+from data_fetching.type_totals import get_type_totals_for_client
+from processing.analyzer import extract_type_features, resolve_service_type
+from processing.context import ClientContext
+from processing.builder import build_final_dataframe
+from utils.logger import Logger, summary_scope
+from utils.prefetch import run_prefetched
+from utils.profiling import ClientProfiler
+
+logger = Logger(__name__)
+
+
+def refresh_sources(bq_client, metrics):
+    """Bring derived source tables up to date before any client is fetched."""
+    with metrics.stage(None, "snapshot_refresh"):
+        refresh_service_type_snapshot(bq_client)
+
+
+def reconcile_sources(bq_client, clients, metrics):
+    """Check service types against merged_service_type for `clients` (None: all) in one query.
+
+    Mismatches go to MERGED_MISMATCH_TABLE and their counts per client to
+    the run report; a failure only logs a warning.
+    """
+    with metrics.stage(None, "merged_reconciliation"):
+        try:
+            counts = reconcile_merged_service_types(bq_client, clients)
+        except Exception as e:
+            logger.warning(f"merged_service_type reconciliation failed: {e}")
+            return
+    metrics.record_counts("merged_mismatches", counts)
+
+
+def resolve_clients(bq_client, clients_arg, metrics):
+    """Clients from --clients, else CLIENT_IDS, else every client in the service type table."""
+    if clients_arg:
+        return [c.strip() for c in clients_arg.split(",") if c.strip()]
+    env_clients = os.getenv("CLIENT_IDS")
+    if env_clients:
+        return [c.strip() for c in env_clients.split(",") if c.strip()]
+    with metrics.stage(None, "fetch_clients"):
+        return get_distinct_clients(bq_client)
+
+
+def parse_type_ids(value):
+    """Comma-separated TYPE_IDs as a set of ints; raises ValueError if one is not an integer or none is given."""
+    type_ids = {int(part) for part in value.split(",") if part.strip()}
+    if not type_ids:
+        raise ValueError(f"No TYPE_IDs in {value!r}")
+    return type_ids
+
+
+def fetch_client_data(bq_client, client_id, metrics, strategy=STRATEGY_RAW, type_ids=None, now=None):
+    """Fetch every frame the analysis needs for one client.
+
+    `strategy` (see data_fetching.planner) decides how appointments arrive:
+    as raw rows, raw rows downloaded page by page, or per-(type, account)
+    statistics (computed in BigQuery or accumulated while streaming) under
+    "appointment_stats" with "appointments" left as None.
+
+    With `type_ids` the service type, appointment and subscription queries
+    only return those types, and the client-wide shares and repeated names
+    arrive as aggregates under "type_totals" (data_fetching.type_totals).
+
+    The appointment lookback window ends at `now`, the run's analysis date
+    (default: today), so a resumed run fetches the same window.
+    """
+    with metrics.stage(client_id, "fetch_service_types"):
+        service_types_df = get_service_types_for_client(bq_client, client_id, type_ids)
+    with metrics.stage(client_id, "fetch_recurring_lookup"):
+        recurring_lookup_df = get_recurring_lookup_for_client(bq_client, client_id)
+    logger.info(
+        f"Rows fetched for {client_id} — service_types: {len(service_types_df)}, recurring_lookup: {len(recurring_lookup_df)}"
+    )
+    appointments_df = None
+    appointment_stats_df = None
+    if strategy == STRATEGY_AGGREGATE:
+        with metrics.stage(client_id, "fetch_appointment_stats"):
+            appointment_stats_df = get_appointment_stats_for_client(bq_client, client_id, type_ids=type_ids, now=now)
+    elif strategy == STRATEGY_STREAM:
+        with metrics.stage(client_id, "stream_appointments"):
+            appointment_stats_df = stream_appointment_stats_for_client(bq_client, client_id, type_ids=type_ids, now=now)
+    else:
+        with metrics.stage(client_id, "fetch_appointments"):
+            appointments_df = get_appointments_for_client(
+                bq_client, client_id, chunked=strategy == STRATEGY_CHUNKED, type_ids=type_ids, now=now
+            )
+    with metrics.stage(client_id, "fetch_subscriptions"):
+        subscriptions_df = get_subscriptions_for_client(bq_client, client_id, type_ids)
+    if appointment_stats_df is not None:
+        appointment_summary = f"appointment_stats: {len(appointment_stats_df)}"
+    else:
+        appointment_summary = f"appointments: {len(appointments_df)}"
+    logger.info(
+        f"Rows fetched for {client_id} ({strategy}) — {appointment_summary}, subscriptions: {len(subscriptions_df)}"
+    )
+    data = {
+        "service_types": service_types_df,
+        "recurring_lookup": recurring_lookup_df,
+        "appointments": appointments_df,
+        "subscriptions": subscriptions_df,
+    }
+    if appointment_stats_df is not None:
+        data["appointment_stats"] = appointment_stats_df
+    if type_ids is not None:
+        with metrics.stage(client_id, "fetch_type_totals"):
+            data["type_totals"] = get_type_totals_for_client(bq_client, client_id, type_ids, now=now)
+    return data
+
+
+def prepare_service_types(service_types_df, recurring_lookup_df, client_id):
+    """Attach the recurring lookup to service types and de-duplicate by TYPE_ID."""
+    # Merge lookup on description/serviceType to attach isRecurring info
+    service_types_df = service_types_df.merge(
+        recurring_lookup_df[["serviceType", "isRecurring"]],
+        left_on="DESCRIPTION",
+        right_on="serviceType",
+        how="left",
+    )
+    if "serviceType" in service_types_df.columns:
+        service_types_df.drop(columns=["serviceType"], inplace=True)
+
+    # De-duplicate service types per client by TYPE_ID before analysis
+    before_dedup = len(service_types_df)
+    service_types_df = service_types_df.drop_duplicates(subset=["TYPE_ID"])  # safe no-op if already unique
+    after_dedup = len(service_types_df)
+    if after_dedup < before_dedup:
+        logger.info(f"De-duplicated service types for {client_id}: {before_dedup} -> {after_dedup}")
+    return service_types_df
+
+
+def compute_share_maps(appointments_df, subscriptions_df, client_id, appointment_stats_df=None, type_totals_df=None):
+    """Appointment and revenue share per service type, plus the top-20/top-10 type sets.
+
+    With appointment_stats_df (aggregate/stream strategies) appointment counts are
+    summed from the per-account statistics instead of counting raw rows. With
+    type_totals_df (`--type-ids` fetches) both counts and revenue come from its
+    client-wide aggregates, since the fetched frames only hold the selected types.
+    """
+    # Compute appointment share per service type for prioritization
+    appt_share_pct_by_type = {}
+    top20_type_ids = set()
+    try:
+        if type_totals_df is not None:
+            counts = type_totals_df[type_totals_df['measure'] == 'appointments'].dropna(subset=['TYPE_ID'])
+            counts = counts.rename(columns={'TYPE_ID': 'type', 'value': 'appointmentCount'})[['type', 'appointmentCount']]
+        elif appointment_stats_df is not None:
+            counts = appointment_stats_df.groupby('type')['appointmentCount'].sum().reset_index(name='appointmentCount')
+        elif not appointments_df.empty:
+            # `type` is already a nullable integer (data_fetching.schemas); groupby drops NULLs
+            counts = appointments_df.groupby('type').size().reset_index(name='appointmentCount')
+        else:
+            counts = None
+        if counts is not None and not counts.empty:
+            counts = counts.rename(columns={'type': 'type_int'})
+            total = counts['appointmentCount'].sum()
+            if total and total > 0:
+                counts['appointmentSharePct'] = (counts['appointmentCount'] / total * 100).round(2)
+                appt_share_pct_by_type = {int(row.type_int): float(row.appointmentSharePct) for _, row in counts.iterrows()}
+                top20 = counts.sort_values('appointmentCount', ascending=False).head(20)
+                top20_type_ids = set(top20['type_int'].astype(int).tolist())
+    except Exception as e:
+        logger.warning(f"Failed computing appointment share for client {client_id}: {e}")
+
+    # Compute revenue share per service type from subscriptions (annualRecurringServices)
+    revenue_share_pct_by_type = {}
+    top10_revenue_type_ids = set()
+    try:
+        if type_totals_df is not None:
+            sums = type_totals_df[type_totals_df['measure'] == 'revenue']
+            sums = sums.rename(columns={'TYPE_ID': 'service_int', 'value': 'ars_total'})[['service_int', 'ars_total']]
+        else:
+            sums = _revenue_by_type(subscriptions_df, client_id)
+        if sums is not None and not sums.empty:
+            total_ars = float(sums['ars_total'].sum())
+            logger.info(f"Total annualRecurringServices for {client_id}: {total_ars:.2f} across {len(sums)} service types")
+            if total_ars and total_ars > 0:
+                sums['revenueSharePct'] = (sums['ars_total'] / total_ars * 100).round(2)
+                revenue_share_pct_by_type = {int(row.service_int): float(row.revenueSharePct) for _, row in sums.iterrows()}
+                top10 = sums.sort_values('ars_total', ascending=False).head(10)
+                top10_revenue_type_ids = set(top10['service_int'].astype(int).tolist())
+    except Exception as e:
+        logger.warning(f"Failed computing revenue share (subscriptions) for client {client_id}: {e}")
+
+    return {
+        "appt_share_pct_by_type": appt_share_pct_by_type,
+        "top20_type_ids": top20_type_ids,
+        "revenue_share_pct_by_type": revenue_share_pct_by_type,
+        "top10_revenue_type_ids": top10_revenue_type_ids,
+    }
+
+
+def _revenue_by_type(subscriptions_df, client_id):
+    """annualRecurringServices of active subscriptions summed per serviceID, or None if there is nothing to sum."""
+    subs = subscriptions_df.copy()
+    if subs.empty:
+        return None
+    # Active subscriptions only
+    subs_active = subs[(subs['active'] == True) & (subs['dateCancelled'].isnull())]
+    # Normalize serviceID type and annualRecurringServices numeric
+    subs_active['service_int'] = pd.to_numeric(subs_active['serviceID'], errors='coerce')
+    ars = subs_active.get('annualRecurringServices')
+    if ars is None:
+        logger.warning(f"annualRecurringServices column not found in subscriptions for {client_id}. Available columns: {list(subs_active.columns)}")
+        return None
+    ars_str = ars.astype(str).str.strip()
+    ars_str = ars_str.str.replace(r'[,$]', '', regex=True)
+    neg_mask = ars_str.str.match(r'^\(.*\)$', na=False)
+    ars_str = ars_str.str.replace(r'[()]', '', regex=True)
+    subs_active['ars_num'] = pd.to_numeric(ars_str, errors='coerce')
+    subs_active.loc[neg_mask, 'ars_num'] = -subs_active.loc[neg_mask, 'ars_num'].abs()
+    subs_active = subs_active.dropna(subset=['service_int', 'ars_num'])
+    if subs_active.empty:
+        return None
+    return subs_active.groupby('service_int')['ars_num'].sum().reset_index(name='ars_total')
+
+
+def analyze_client(data, client_id, now, metrics, feature_store=None):
+    """Run the analyzer over fetched client data; return one row per service type.
+
+    Data fetched for selected TYPE_IDs carries "type_totals", from which
+    the client-wide shares and repeated names are taken.
+    With a feature store (processing.feature_store), each type's features and
+    the resulting flags are saved for `main.py --reevaluate`.
+    """
+    with metrics.stage(client_id, "recurring_lookup_merge"):
+        service_types_df = prepare_service_types(data["service_types"], data["recurring_lookup"], client_id)
+
+    appointments_df = data["appointments"]
+    appointment_stats_df = data.get("appointment_stats")
+    subscriptions_df = data["subscriptions"]
+    type_totals_df = data.get("type_totals")
+    with metrics.stage(client_id, "share_computation"):
+        shares = compute_share_maps(appointments_df, subscriptions_df, client_id, appointment_stats_df, type_totals_df)
+
+    features = []
+    client_rows = []
+    with metrics.stage(client_id, "analysis"):
+        context = ClientContext.build(
+            client_id, appointments_df, subscriptions_df, service_types_df, now, appointment_stats_df,
+            type_totals_df=type_totals_df,
+        )
+        for _, row in service_types_df.iterrows():
+            type_features = extract_type_features(
+                row, appointments_df, client_id, context,
+                appointment_stats_df=appointment_stats_df, **shares
+            )
+            features.append(type_features)
+            client_rows.append(resolve_service_type(type_features))
+    if feature_store:
+        with metrics.stage(client_id, "feature_store"):
+            try:
+                feature_store.save_client(client_id, features, client_rows)
+            except Exception as e:
+                logger.warning(f"Could not store features for client {client_id}: {e}")
+    return client_rows
+
+
+def load_client_data(bq_client, client_id, metrics, checkpoint=None, strategy=STRATEGY_RAW, type_ids=None, now=None):
+    """Fetch one client's frames, only those of `type_ids` if given.
+
+    With a checkpoint, fetched frames are cached in the run directory and
+    reused if the client is retried after a crash.
+    """
+    data = checkpoint.load_fetch(client_id) if checkpoint else None
+    if data is None:
+        data = fetch_client_data(bq_client, client_id, metrics, strategy=strategy, type_ids=type_ids, now=now)
+        if checkpoint:
+            checkpoint.save_fetch(client_id, data)
+    return data
+
+
+def process_client(
+    bq_client, client_id, now, metrics, checkpoint=None, strategy=STRATEGY_RAW, feature_store=None, type_ids=None
+):
+    """Fetch and analyze one client (only `type_ids` if given); return its analysis rows."""
+    logger.info(f"Processing client: {client_id}")
+    data = load_client_data(
+        bq_client, client_id, metrics, checkpoint=checkpoint, strategy=strategy, type_ids=type_ids, now=now
+    )
+    return analyze_client(data, client_id, now, metrics, feature_store=feature_store)
+
+
+def run_pipeline(
+    bq_client,
+    clients,
+    sinks,
+    metrics,
+    profiler=None,
+    now=None,
+    checkpoint=None,
+    strategies=None,
+    workers=1,
+    scheduler=None,
+    prefetch=0,
+    feature_store=None,
+    type_ids=None,
+):
+    """Fetch and analyze every client once and feed the results to all sinks.
+
+    Per-client sink hooks run right after each client (e.g. Sheets, to spread
+    out API calls); run-level hooks receive the combined, unfiltered frame.
+    With a checkpoint, completed clients and finished run-level sinks are
+    recorded and skipped when the run is resumed. `strategies` maps client IDs
+    to fetch strategies from the planner; unplanned clients fetch raw rows.
+
+    With `workers` > 1 clients are processed on a thread pool. A scheduler
+    (utils.scheduler.ClientScheduler) sets the start order and may defer
+    clients to honour a time budget; run-level sinks then still receive the
+    finished clients but are not marked done, so `--resume` completes them.
+    Sinks that replace a BigQuery table are not written at all while clients
+    are deferred, so a partial run never truncates the production tables.
+
+    With `prefetch` K > 0 (and a single worker) fetching, analysis and
+    per-client sink writes run as overlapping stages: up to K clients are
+    fetched ahead of the one being analyzed, and sink writes run on their own
+    thread (see utils.prefetch.run_prefetched).
+    With a feature store, per-type features are saved for `--reevaluate`.
+    With `type_ids` only those service types are fetched and analyzed.
+    Returns the combined frame.
+    """
+    strategies = strategies or {}
+    profiler = profiler or ClientProfiler(None, "")
+    now = pd.to_datetime("today") if now is None else now
+    rows_by_client = {}
+    deferred = []
+
+    pending = []
+    for client_id in clients:
+        if checkpoint and checkpoint.is_complete(client_id):
+            rows_by_client[client_id] = checkpoint.load_rows(client_id)
+        else:
+            pending.append(client_id)
+    if scheduler:
+        pending, deferred = scheduler.schedule(pending)
+
+    started = time.monotonic()
+    sink_lock = threading.Lock()
+
+    def write_client(client_id, client_df):
+        # Per-client sinks stay sequential (e.g. Sheets API quotas)
+        with sink_lock:
+            for sink in sinks:
+                sink.write_client(client_id, client_df, metrics)
+
+    def finish_client(client_id, client_rows):
+        if checkpoint:
+            checkpoint.save_client(client_id, client_rows)
+        rows_by_client[client_id] = client_rows
+
+    def run_client(client_id):
+        if scheduler and not scheduler.should_start(client_id, time.monotonic() - started):
+            return
+        with profiler.profile_client(client_id), summary_scope(client_id):
+            client_rows = process_client(
+                bq_client, client_id, now, metrics, checkpoint=checkpoint,
+                strategy=strategies.get(client_id, STRATEGY_RAW), feature_store=feature_store,
+                type_ids=type_ids,
+            )
+            write_client(client_id, build_final_dataframe(client_rows))
+        finish_client(client_id, client_rows)
+
+    def prefetch_client(client_id):
+        if scheduler and not scheduler.should_start(client_id, time.monotonic() - started):
+            return None
+        logger.info(f"Fetching client: {client_id}")
+        return load_client_data(
+            bq_client, client_id, metrics, checkpoint=checkpoint,
+            strategy=strategies.get(client_id, STRATEGY_RAW), type_ids=type_ids, now=now,
+        )
+
+    def analyze_prefetched(client_id, data):
+        logger.info(f"Processing client: {client_id}")
+        with profiler.profile_client(client_id), summary_scope(client_id):
+            client_rows = analyze_client(data, client_id, now, metrics, feature_store=feature_store)
+            return client_rows, build_final_dataframe(client_rows)
+
+    def export_prefetched(client_id, analyzed):
+        client_rows, client_df = analyzed
+        write_client(client_id, client_df)
+        finish_client(client_id, client_rows)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Tasks start in submission order, so the scheduler's order holds
+            for future in [pool.submit(run_client, client_id) for client_id in pending]:
+                future.result()
+    elif prefetch > 0:
+        run_prefetched(pending, prefetch_client, analyze_prefetched, export_prefetched, depth=prefetch)
+    else:
+        for client_id in pending:
+            run_client(client_id)
+
+    if scheduler:
+        deferred = scheduler.deferred
+    if deferred:
+        logger.warning(f"Deferred {len(deferred)} clients to a later run: {', '.join(deferred)}")
+        if checkpoint:
+            checkpoint.set_deferred(deferred, scheduler.deferred_runs if scheduler else None)
+
+    # Keep the input order regardless of the order clients finished in
+    all_rows = [row for client_id in clients for row in rows_by_client.get(client_id, [])]
+    final_df = build_final_dataframe(all_rows)
+    for sink in sinks:
+        if checkpoint and checkpoint.sink_done(sink.name):
+            logger.info(f"Skipping sink {sink.name}: already written in run {checkpoint.run_id}")
+            continue
+        if deferred and sink.replaces_table:
+            logger.warning(f"Skipping sink {sink.name}: it would replace its table without the {len(deferred)} deferred clients")
+            continue
+        sink.write_final(final_df, metrics)
+        if checkpoint and not deferred:
+            checkpoint.mark_sink_done(sink.name)
+    return final_df
@@ -1,10 +1,38 @@
+import logging
 import pandas as pd
-from config import WORD_SIGNALS, API_SIGNAL_RULES, BUSINESS_CONSTRAINTS, BQ_APPOINTMENT_RULES
+from config import (
+    WORD_SIGNALS,
+    BUSINESS_CONSTRAINTS,
+    BQ_APPOINTMENT_RULES,
+    APPT_SAMPLING,
+    APPT_SAMPLE_MIN_ACCOUNTS,
+    APPT_SAMPLE_INITIAL,
+    APPT_SAMPLE_CONFIDENCE,
+    APPT_SAMPLE_SEED,
+)
+from processing.context import ClientContext
+from processing.rules import API_RULE_ORDER, API_SIGNAL_DEFAULTS, API_SIGNAL_RULES
+from processing.sampling import sample_strong_ratio
+from processing.signal_cache import SIGNAL_NAMES, get_text_signal_cache, normalize_description
 from utils.logger import Logger
 
 logger = Logger(__name__)
 
 
+# Source priorities of the resolved signals, highest first
+RECURRING_PRIORITIES = ['SalesMapping', 'Appointments', 'API', 'Word']
+RESERVICE_PRIORITIES = ['API', 'Word']
+ZERO_TIME_PRIORITIES = ['Word', 'API']
+
+
+def _api_flag(row, name):
+    """Return an API flag as int, treating missing/NULL values as 0."""
+    value = row.get(name, 0)
+    if value is None or pd.isna(value):
+        return 0
+    return int(value)
+
+
 def analyze_api_signals(row):
     """
     Analyze API flags and determine boolean signals based on business rules.
@@ -15,93 +43,31 @@ def analyze_api_signals(row):
     Returns:
         dict: API signal analysis results
     """
-    logger.debug(f"Analyzing API signals for TYPE_ID: {row['TYPE_ID']}")
+    logger.debug("Analyzing API signals for TYPE_ID: %s", row['TYPE_ID'])
     
     # Extract API flags with defaults
-    api_frequency = row.get("API_FREQUENCY", 0) or 0
-    api_reservice = row.get("API_RESERVICE", 0) or 0
-    api_default_length = row.get("API_DEFAULT_LENGTH", 0) or 0
-    api_regular_service = row.get("API_REGULAR_SERVICE", 0) or 0
-    api_initial_id = row.get("API_INITIAL_ID", 0) or 0
-    api_initial = row.get("API_INITIAL", 0) or 0
-    
-    # Apply business rules from config
-    api_signals = {
-        "isRecurring": False,
-        "has_reservice": False,
-        "isRervice": False,
-        "zeroVisitTime": False
-    }
+    flags = {name: _api_flag(row, f"API_{name}") for name in API_RULE_ORDER}
+    
+    # Apply business rules from config: flags in API_RULE_ORDER, a later
+    # non-None result overriding an earlier one
+    api_signals = dict(API_SIGNAL_DEFAULTS)
+    for name in API_RULE_ORDER:
+        for signal, rule in API_SIGNAL_RULES.get(name, {}).items():
+            if rule is None:
+                continue
+            result = rule(flags[name])
+            if result is not None:
+                api_signals[signal] = result
     
-    # FREQUENCY rules
-    if API_SIGNAL_RULES["FREQUENCY"]["isRecurring"] is not None:
-        result = API_SIGNAL_RULES["FREQUENCY"]["isRecurring"](api_frequency)
-        if result is not None:
-            api_signals["isRecurring"] = result
-    if API_SIGNAL_RULES["FREQUENCY"]["isRervice"] is not None:
-        result = API_SIGNAL_RULES["FREQUENCY"]["isRervice"](api_frequency)
-        if result is not None:
-            api_signals["isRervice"] = result
-    
-    # RESERVICE rules
-    if API_SIGNAL_RULES["RESERVICE"]["isRecurring"] is not None:
-        result = API_SIGNAL_RULES["RESERVICE"]["isRecurring"](api_reservice)
-        if result is not None:
-            api_signals["isRecurring"] = result
-    if API_SIGNAL_RULES["RESERVICE"]["has_reservice"] is not None:
-        result = API_SIGNAL_RULES["RESERVICE"]["has_reservice"](api_reservice)
-        if result is not None:
-            api_signals["has_reservice"] = result
-    if API_SIGNAL_RULES["RESERVICE"]["isRervice"] is not None:
-        result = API_SIGNAL_RULES["RESERVICE"]["isRervice"](api_reservice)
-        if result is not None:
-            api_signals["isRervice"] = result
-    
-    # DEFAULT_LENGTH rules
-    if API_SIGNAL_RULES["DEFAULT_LENGTH"]["zeroVisitTime"] is not None:
-        result = API_SIGNAL_RULES["DEFAULT_LENGTH"]["zeroVisitTime"](api_default_length)
-        if result is not None:
-            api_signals["zeroVisitTime"] = result
-    
-    # REGULAR_SERVICE rules
-    if API_SIGNAL_RULES["REGULAR_SERVICE"]["isRecurring"] is not None:
-        result = API_SIGNAL_RULES["REGULAR_SERVICE"]["isRecurring"](api_regular_service)
-        if result is not None:
-            api_signals["isRecurring"] = result
-    if API_SIGNAL_RULES["REGULAR_SERVICE"]["has_reservice"] is not None:
-        result = API_SIGNAL_RULES["REGULAR_SERVICE"]["has_reservice"](api_regular_service)
-        if result is not None:
-            api_signals["has_reservice"] = result
-    
-    # INITIAL_ID rules
-    if API_SIGNAL_RULES["INITIAL_ID"]["isRecurring"] is not None:
-        result = API_SIGNAL_RULES["INITIAL_ID"]["isRecurring"](api_initial_id)
-        if result is not None:
-            api_signals["isRecurring"] = result
-    
-    # INITIAL rules
-    if API_SIGNAL_RULES["INITIAL"]["isRecurring"] is not None:
-        result = API_SIGNAL_RULES["INITIAL"]["isRecurring"](api_initial)
-        if result is not None:
-            api_signals["isRecurring"] = result
-    if API_SIGNAL_RULES["INITIAL"]["isRervice"] is not None:
-        result = API_SIGNAL_RULES["INITIAL"]["isRervice"](api_initial)
-        if result is not None:
-            api_signals["isRervice"] = result
-    if API_SIGNAL_RULES["INITIAL"]["zeroVisitTime"] is not None:
-        result = API_SIGNAL_RULES["INITIAL"]["zeroVisitTime"](api_initial)
-        if result is not None:
-            api_signals["zeroVisitTime"] = result
-    
-    logger.debug(f"API signals for TYPE_ID {row['TYPE_ID']}: {api_signals}")
+    logger.debug("API signals for TYPE_ID %s: %s", row['TYPE_ID'], api_signals)
     
     return {
-        "api_frequency": api_frequency,
-        "api_reservice": api_reservice,
-        "api_default_length": api_default_length,
-        "api_regular_service": api_regular_service,
-        "api_initial_id": api_initial_id,
-        "api_initial": api_initial,
+        "api_frequency": flags["FREQUENCY"],
+        "api_reservice": flags["RESERVICE"],
+        "api_default_length": flags["DEFAULT_LENGTH"],
+        "api_regular_service": flags["REGULAR_SERVICE"],
+        "api_initial_id": flags["INITIAL_ID"],
+        "api_initial": flags["INITIAL"],
         **api_signals
     }
 
@@ -119,21 +85,26 @@ def analyze_text_signals(description, lookup_recurring=None):
         dict: Text signal analysis results (True or None for each signal)
     """
     desc = description or ""
-    desc_lower = desc.lower()
-    
-    logger.debug(f"Analyzing text signals for description: '{desc[:50]}...'")
-    
-    # Apply keyword-based detection - only True if keyword found, otherwise None
-    word_signals = {
-        "reservice": True if any(kw in desc_lower for kw in WORD_SIGNALS["reservice"]) else None,
-        "recurring": True if any(kw in desc_lower for kw in WORD_SIGNALS["recurring"]) else None,
-        "zero_time": True if any(kw in desc_lower for kw in WORD_SIGNALS["zero_time"]) else None,
-        "has_reservice": True if any(kw in desc_lower for kw in WORD_SIGNALS["has_reservice"]) else None
-    }
+    desc_key = normalize_description(desc)
+    
+    logger.debug("Analyzing text signals for description: '%.50s...'", desc)
+    
+    # Descriptions repeat across types and clients; results are memoized per
+    # normalized description for the whole run (processing.signal_cache)
+    cache = get_text_signal_cache()
+    cached = cache.get(desc_key)
+    if cached is None:
+        # Apply keyword-based detection - only True if keyword found, otherwise None
+        cached = tuple(
+            True if any(kw in desc_key for kw in WORD_SIGNALS[name]) else None
+            for name in SIGNAL_NAMES
+        )
+        cache.put(desc_key, cached)
+    word_signals = dict(zip(SIGNAL_NAMES, cached))
     
     # Do not override with lookup here; handled separately as SalesMapping source
     
-    logger.debug(f"Text signals: {word_signals}")
+    logger.debug("Text signals: %s", word_signals)
     
     return word_signals
 
@@ -183,67 +154,170 @@ def resolve_with_priorities(metric_name, sources_dict, priorities):
     return chosen_val, chosen_source, chosen_reason, dissent
 
 
-def analyze_usage_patterns(type_id, appointments_df, subscriptions_df, service_types_df, client_id, cutoff_date):
+def analyze_usage_patterns(type_id, context):
     """
     Analyze usage patterns for a service type.
     
     Args:
         type_id: Service type ID
-        appointments_df: Appointments dataframe
-        subscriptions_df: Subscriptions dataframe
-        service_types_df: Service types dataframe
-        client_id: Client ID
-        cutoff_date: Cutoff date for recent activity
+        context: ClientContext of the type's client
         
     Returns:
         dict: Usage pattern analysis results
     """
-    logger.debug(f"Analyzing usage patterns for TYPE_ID: {type_id}, Client: {client_id}")
-    
-    # Check recent appointments (past 2 years)
-    relevant_appts = appointments_df[
-        (appointments_df['clientID'] == client_id) &
-        (appointments_df['type'] == type_id)
-    ]
-    recent_appts = relevant_appts[relevant_appts['appointmentDate'] >= cutoff_date]
-    has_visits_past_2yrs = len(recent_appts) > 0
-    
-    # Check active subscriptions
-    relevant_subs = subscriptions_df[subscriptions_df['clientID'] == client_id]
-    relevant_subs = relevant_subs[
-        (relevant_subs['serviceID'] == type_id) |
-        (relevant_subs['serviceID'] == str(type_id))
-    ]
-    active_subs = relevant_subs[
-        (relevant_subs['active'] == True) &
-        (relevant_subs['dateCancelled'].isnull())
-    ]
-    has_active_subscription = len(active_subs) > 0
-    
-    # Check for repeated names
-    try:
-        current_description = service_types_df.loc[service_types_df['TYPE_ID'] == type_id, 'DESCRIPTION'].iloc[0]
-        repeated_name = (service_types_df['DESCRIPTION'] == current_description).sum() > 1
-    except (IndexError, KeyError):
-        # If TYPE_ID not found or no description, assume not repeated
-        repeated_name = False
-    
-    logger.debug(f"Usage patterns for TYPE_ID {type_id}: visits_past_2yrs={has_visits_past_2yrs}, active_subscription={has_active_subscription}, repeated_name={repeated_name}")
+    logger.debug("Analyzing usage patterns for TYPE_ID: %s", type_id)
+    
+    # Recent appointments (past 2 years), active subscriptions and repeated
+    # names are precomputed per client, so each flag is a set lookup
+    has_visits_past_2yrs = context.has_recent_visits(type_id)
+    has_active_subscription = context.has_active_subscription(type_id)
+    repeated_name = context.has_repeated_name(type_id)
+    
+    logger.debug(
+        "Usage patterns for TYPE_ID %s: visits_past_2yrs=%s, active_subscription=%s, repeated_name=%s",
+        type_id, has_visits_past_2yrs, has_active_subscription, repeated_name,
+    )
     
     return {
         "has_visits_past_2yrs": has_visits_past_2yrs,
         "has_active_subscription": has_active_subscription,
         "repeated_name": repeated_name,
-        # Original logic: expired if NO visits in past 2 yrs OR NO active subscription
-        "expired_code": (not has_visits_past_2yrs) or (not has_active_subscription)
+        "expired_code": is_expired_code(has_visits_past_2yrs, has_active_subscription),
     }
 
 
-def analyze_appointment_recurring(type_id, appointments_df, subscriptions_df, client_id):
+def is_expired_code(has_visits_past_2yrs, has_active_subscription):
+    # Original logic: expired if NO visits in past 2 yrs OR NO active subscription
+    return (not has_visits_past_2yrs) or (not has_active_subscription)
+
+
+def _account_evidence_from_rows(g):
+    """(visits, years_count, has_consecutive_years, median_delta_days) for one account's appointments."""
+    g = g.sort_values('appointmentDate')
+    years_set = set(g['appointmentDate'].dt.year.dropna().unique().tolist())
+    # Consecutive years evidence
+    has_consecutive_years = any(((y + 1) in years_set) for y in years_set)
+    deltas = g['appointmentDate'].diff().dt.days.dropna()
+    median_delta = float(deltas.median()) if not deltas.empty else None
+    return len(g), len(years_set), bool(has_consecutive_years), median_delta
+
+
+class _GroupedAccountEvidence:
+    """Per-account evidence of one type's appointments, computed on first access.
+
+    Used in sampling mode so that only sampled accounts are sorted and
+    diffed; `visits` (appointments per account) is known up front for
+    stratification. Iterating yields every account's evidence; `computed`
+    only the accounts evaluated so far.
     """
-    Derive appointment-based recurring signal for a service type within a client.
 
-    Evidence considered (per individual account for this type):
+    def __init__(self, appts_type):
+        self._grouped = appts_type.groupby('individualAccountID')
+        self._keys = list(self._grouped.groups)
+        sizes = self._grouped.size()
+        self.visits = [int(sizes[key]) for key in self._keys]
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, index):
+        if index not in self._cache:
+            self._cache[index] = _account_evidence_from_rows(self._grouped.get_group(self._keys[index]))
+        return self._cache[index]
+
+    def __iter__(self):
+        for index in range(len(self._keys)):
+            yield self[index]
+
+    def computed(self):
+        """Evidence of the accounts evaluated so far, in sample order."""
+        return list(self._cache.values())
+
+
+def appointment_evidence(type_id, appointments_df, client_id, account_stats_df=None, client_has_appointments=None):
+    """
+    Per-account appointment evidence for a service type within a client.
+
+    account_stats_df, when given, replaces appointments_df with per-(type,
+    account) statistics, aggregated in BigQuery (see
+    data_fetching.appointments.appointment_stats_query) or while streaming
+    (see data_fetching.appointment_stats).
+
+    client_has_appointments, when given, replaces the check of the frames for
+    any appointment of the client; a `--type-ids` fetch only holds the rows of
+    the selected types (see processing.context.ClientContext.has_appointments).
+
+    Returns:
+        tuple: (evidence, reason). evidence is a list of (visits, years_count,
+            has_consecutive_years, median_delta_days) per account, or None with
+            the reason when there is nothing to score.
+    """
+    if account_stats_df is not None:
+        # Aggregated fetch: one row per (type, account) computed in BigQuery
+        if client_has_appointments is None:
+            client_has_appointments = not account_stats_df.empty
+        if not client_has_appointments:
+            return None, "No appointments for client"
+        stats_type = account_stats_df[account_stats_df['type'] == type_id]
+        if stats_type.empty:
+            return None, "No appointments for this service type"
+        stats_type = stats_type[stats_type['visits'] > 0]
+        if stats_type.empty:
+            return None, "No valid appointment dates"
+        # Rows without an account only feed appointment counts, as groupby drops them in the raw path
+        stats_type = stats_type.dropna(subset=['individualAccountID'])
+        evidence = [
+            (int(r.visits), int(r.years_count), bool(r.has_consecutive_years),
+             None if pd.isna(r.median_delta_days) else float(r.median_delta_days))
+            for r in stats_type.itertuples(index=False)
+        ]
+    else:
+        # Filter appointments for client and type; IDs and dates are already typed
+        # by data_fetching.schemas, so no string or date conversion is needed here
+        appts_client = appointments_df[appointments_df['clientID'] == client_id]
+        if client_has_appointments is None:
+            client_has_appointments = not appts_client.empty
+        if not client_has_appointments:
+            return None, "No appointments for client"
+
+        appts_type = appts_client[appts_client['type'] == type_id]
+        if appts_type.empty:
+            return None, "No appointments for this service type"
+
+        appts_type = appts_type.dropna(subset=['appointmentDate'])
+        if appts_type.empty:
+            return None, "No valid appointment dates"
+        if APPT_SAMPLING:
+            evidence = _GroupedAccountEvidence(appts_type)
+        else:
+            evidence = [
+                _account_evidence_from_rows(g)
+                for _, g in appts_type.groupby('individualAccountID')
+            ]
+    return evidence, None
+
+
+def _is_strong_account(evidence, min_visits, cadence_bands):
+    """Consecutive years, or enough visits at a median cadence inside a configured band."""
+    visits, years_count, has_consecutive_years, median_delta = evidence
+    # Stable cadence evidence via median inter-visit delta
+    within_band = False
+    if median_delta is not None:
+        for low, high in cadence_bands.values():
+            if median_delta >= low and median_delta < high:
+                within_band = True
+                break
+
+    stable_cadence_strong = visits >= min_visits and within_band
+    return bool(has_consecutive_years or stable_cadence_strong)
+
+
+def score_appointment_recurring(evidence, has_active_subscription):
+    """
+    Score per-account evidence against BQ_APPOINTMENT_RULES.
+
+    Evidence considered per individual account:
     - Year-over-year presence (consecutive years)
     - Stable cadence based on median inter-visit days falling into configured bands
 
@@ -251,83 +325,44 @@ def analyze_appointment_recurring(type_id, appointments_df, subscriptions_df, cl
     - Compute ratio of accounts with strong evidence
     - Optionally boost with active subscription presence
 
+    With APPT_SAMPLING, types with at least APPT_SAMPLE_MIN_ACCOUNTS accounts
+    estimate the ratio from a growing stratified sample instead, stopping
+    once its confidence interval clears POP_RATIO_STRONG on either side
+    (processing.sampling); the sample and interval are part of the reason.
+
     Returns:
         dict with keys:
             appt_recurring_bool: True | None
             appt_recurring_score: float in [0,1]
             appt_recurring_reason: str
     """
-    logger.debug(f"Analyzing appointment-based recurring for TYPE_ID: {type_id}, Client: {client_id}")
-
-    # Filter appointments for client and type, being tolerant of dtype mismatches
-    appts_client = appointments_df[appointments_df['clientID'] == client_id].copy()
-    if appts_client.empty:
-        return {"appt_recurring_bool": None, "appt_recurring_score": 0.0, "appt_recurring_reason": "No appointments for client"}
-
-    type_id_str = str(type_id)
-    # Prefer fast string comparison to avoid dtype pitfalls
-    appts_client['type_str'] = appts_client['type'].astype(str)
-    appts_type = appts_client[appts_client['type_str'] == type_id_str].copy()
-    if appts_type.empty:
-        return {"appt_recurring_bool": None, "appt_recurring_score": 0.0, "appt_recurring_reason": "No appointments for this service type"}
-
-    # Ensure dates are datetime
-    appts_type['appointmentDate'] = pd.to_datetime(appts_type['appointmentDate'], errors='coerce')
-    appts_type = appts_type.dropna(subset=['appointmentDate'])
-    if appts_type.empty:
-        return {"appt_recurring_bool": None, "appt_recurring_score": 0.0, "appt_recurring_reason": "No valid appointment dates"}
-
     min_visits = BQ_APPOINTMENT_RULES.get("APPT_MIN_VISITS_STRONG", 3)
     cadence_bands = BQ_APPOINTMENT_RULES.get("CADENCE_BANDS", {})
     pop_ratio_strong = BQ_APPOINTMENT_RULES.get("POP_RATIO_STRONG", 0.6)
 
-    # Active subscription presence for this type
-    subs_type = subscriptions_df[subscriptions_df['clientID'] == client_id]
-    subs_type = subs_type[(subs_type['serviceID'] == type_id) | (subs_type['serviceID'] == type_id_str)]
-    subs_active = subs_type[(subs_type['active'] == True) & (subs_type['dateCancelled'].isnull())]
-    has_active_subscription = len(subs_active) > 0
-
-    # Compute per-account evidence
-    strong_flags = []
-    account_stats = []
-    for account_id, g in appts_type.groupby('individualAccountID'):
-        g = g.sort_values('appointmentDate')
-        visits = len(g)
-        years = g['appointmentDate'].dt.year.dropna().unique()
-        years_set = set(years.tolist())
-        # Consecutive years evidence
-        has_consecutive_years = any(((y + 1) in years_set) for y in years_set)
-
-        # Stable cadence evidence via median inter-visit delta
-        deltas = g['appointmentDate'].diff().dt.days.dropna()
-        median_delta = None
-        within_band = False
-        if not deltas.empty:
-            median_delta = float(deltas.median())
-            for low, high in cadence_bands.values():
-                if median_delta >= low and median_delta < high:
-                    within_band = True
-                    break
-
-        stable_cadence_strong = visits >= min_visits and within_band
-        account_strong = bool(has_consecutive_years or stable_cadence_strong)
-        strong_flags.append(account_strong)
-        account_stats.append({
-            'account_id': account_id,
-            'visits': visits,
-            'years_count': len(years_set),
-            'has_consecutive_years': bool(has_consecutive_years),
-            'median_delta_days': median_delta,
-            'within_band': bool(within_band),
-            'strong': account_strong,
-        })
-
-    total_accounts = len(strong_flags)
-    strong_accounts = sum(1 for f in strong_flags if f)
-    strong_ratio = (strong_accounts / total_accounts) if total_accounts > 0 else 0.0
+    if APPT_SAMPLING and len(evidence) >= APPT_SAMPLE_MIN_ACCOUNTS:
+        visits = getattr(evidence, "visits", None) or [e[0] for e in evidence]
+        estimate = sample_strong_ratio(
+            len(evidence), visits,
+            lambda i: _is_strong_account(evidence[i], min_visits, cadence_bands),
+            pop_ratio_strong, APPT_SAMPLE_INITIAL, APPT_SAMPLE_CONFIDENCE, APPT_SAMPLE_SEED,
+        )
+        strong_accounts = estimate["strong"]
+        strong_ratio = estimate["ratio"]
+        reason_parts = [
+            f"{strong_accounts}/{estimate['sampled']} sampled accounts strong ({strong_ratio:.0%}, "
+            f"{estimate['confidence']:.0%} CI {estimate['low']:.0%}-{estimate['high']:.0%}, "
+            f"sample {estimate['sampled']} of {estimate['total']} accounts)"
+        ]
+    else:
+        # Compute per-account evidence
+        strong_flags = [_is_strong_account(e, min_visits, cadence_bands) for e in evidence]
+        total_accounts = len(strong_flags)
+        strong_accounts = sum(1 for f in strong_flags if f)
+        strong_ratio = (strong_accounts / total_accounts) if total_accounts > 0 else 0.0
+        reason_parts = [f"{strong_accounts}/{total_accounts} accounts strong ({strong_ratio:.0%})"]
 
     # Decide score and boolean
-    reason_parts = [f"{strong_accounts}/{total_accounts} accounts strong ({strong_ratio:.0%})"]
     if has_active_subscription:
         reason_parts.append("active subscription present")
 
@@ -348,15 +383,41 @@ def analyze_appointment_recurring(type_id, appointments_df, subscriptions_df, cl
         appt_bool = None
         reason_parts.append("no recurring evidence")
 
-    reason = "; ".join(reason_parts)
-    logger.debug(f"Appointment recurring analysis for TYPE_ID {type_id}: bool={appt_bool}, score={score}, reason={reason}")
     return {
         "appt_recurring_bool": appt_bool,
         "appt_recurring_score": score,
-        "appt_recurring_reason": reason,
+        "appt_recurring_reason": "; ".join(reason_parts),
     }
 
 
+def analyze_appointment_recurring(type_id, appointments_df, context, client_id, account_stats_df=None):
+    """
+    Derive appointment-based recurring signal for a service type within a client.
+
+    Combines `appointment_evidence` (per-account evidence from raw rows or
+    per-(type, account) statistics) with `score_appointment_recurring`.
+
+    Returns:
+        dict with keys:
+            appt_recurring_bool: True | None
+            appt_recurring_score: float in [0,1]
+            appt_recurring_reason: str
+    """
+    logger.debug("Analyzing appointment-based recurring for TYPE_ID: %s, Client: %s", type_id, client_id)
+
+    evidence, reason = appointment_evidence(type_id, appointments_df, client_id, account_stats_df)
+    if evidence is None:
+        return {"appt_recurring_bool": None, "appt_recurring_score": 0.0, "appt_recurring_reason": reason}
+
+    # Active subscription presence for this type
+    result = score_appointment_recurring(evidence, context.has_active_subscription(type_id))
+    logger.debug(
+        "Appointment recurring analysis for TYPE_ID %s: bool=%s, score=%s, reason=%s",
+        type_id, result["appt_recurring_bool"], result["appt_recurring_score"], result["appt_recurring_reason"],
+    )
+    return result
+
+
 def check_business_constraints(final_signals):
     """
     Check business logic constraints on final resolved signals and apply corrections.
@@ -403,13 +464,68 @@ def check_business_constraints(final_signals):
             violations.append(BUSINESS_CONSTRAINTS["isRervice_hasReservice"])
     
     if violations:
-        logger.warning(f"Business constraint violations detected and corrected: {violations}")
-        logger.info(f"Corrections applied: {corrections_applied}")
+        logger.tally(
+            "constraint_violations",
+            "Business constraint violations detected and corrected: %s", violations,
+            level=logging.WARNING,
+        )
+        logger.tally("constraint_corrections", "Corrections applied: %s", corrections_applied)
     
     return corrected_signals, violations, corrections_applied
 
 
-def analyze_service_type(row, appointments_df, subscriptions_df, service_types_df, now, client_id, appt_share_pct_by_type=None, top20_type_ids=None, revenue_share_pct_by_type=None, top10_revenue_type_ids=None):
+API_FLAG_COLUMNS = (
+    "API_FREQUENCY",
+    "API_RESERVICE",
+    "API_DEFAULT_LENGTH",
+    "API_REGULAR_SERVICE",
+    "API_INITIAL_ID",
+    "API_INITIAL",
+)
+
+
+def extract_type_features(row, appointments_df, client_id, context, appt_share_pct_by_type=None, top20_type_ids=None, revenue_share_pct_by_type=None, top10_revenue_type_ids=None, appointment_stats_df=None):
+    """
+    Collect everything `resolve_service_type` needs for one service type.
+
+    The features depend only on fetched data, not on the rules in config.py
+    (WORD_SIGNALS, API_SIGNAL_RULES, BQ_APPOINTMENT_RULES), so they can be
+    stored and re-resolved after a rule change (processing.feature_store).
+
+    Returns:
+        dict: raw API flags, description and SalesMapping value, usage flags,
+            share percentages and top-N membership, and the per-account
+            appointment evidence ("evidence", None with "appt_evidence_reason"
+            when there is nothing to score)
+    """
+    type_id = row["TYPE_ID"]
+    desc = row["DESCRIPTION"]
+    if desc is None or pd.isna(desc):
+        desc = ""
+    lookup_recurring = row.get("isRecurring")
+    usage_analysis = analyze_usage_patterns(type_id, context)
+    evidence, evidence_reason = appointment_evidence(
+        type_id, appointments_df, client_id, appointment_stats_df, client_has_appointments=context.has_appointments
+    )
+    return {
+        "Client": client_id,
+        "TYPE_ID": type_id,
+        "DESCRIPTION": desc,
+        **{name: _api_flag(row, name) for name in API_FLAG_COLUMNS},
+        "lookup_recurring": None if lookup_recurring is None else str(lookup_recurring),
+        "has_visits_past_2yrs": usage_analysis["has_visits_past_2yrs"],
+        "has_active_subscription": usage_analysis["has_active_subscription"],
+        "repeated_name": usage_analysis["repeated_name"],
+        "appt_share_pct": appt_share_pct_by_type.get(int(type_id), None) if appt_share_pct_by_type is not None else None,
+        "top20_appointments": top20_type_ids is not None and int(type_id) in top20_type_ids,
+        "revenue_share_pct": revenue_share_pct_by_type.get(int(type_id), None) if revenue_share_pct_by_type is not None else None,
+        "top10_revenue": top10_revenue_type_ids is not None and int(type_id) in top10_revenue_type_ids,
+        "evidence": evidence,
+        "appt_evidence_reason": evidence_reason,
+    }
+
+
+def analyze_service_type(row, appointments_df, subscriptions_df, service_types_df, now, client_id, appt_share_pct_by_type=None, top20_type_ids=None, revenue_share_pct_by_type=None, top10_revenue_type_ids=None, appointment_stats_df=None, context=None):
     """
     Main analysis function that orchestrates all analysis components.
     
@@ -420,18 +536,45 @@ def analyze_service_type(row, appointments_df, subscriptions_df, service_types_d
         service_types_df: Service types dataframe
         now: Current datetime
         client_id: Client ID
+        appointment_stats_df: Aggregated appointment statistics, set when the
+            client was fetched with the "aggregate" or "stream" strategy (appointments_df is then None)
+        context: ClientContext shared by the client's types; built here if not given
         
     Returns:
         dict: Complete analysis results
     """
-    type_id = row["TYPE_ID"]
-    desc = row["DESCRIPTION"] or ""
-    lookup_recurring = row.get("isRecurring")
+    if context is None:
+        context = ClientContext.build(client_id, appointments_df, subscriptions_df, service_types_df, now, appointment_stats_df)
+    features = extract_type_features(
+        row, appointments_df, client_id, context,
+        appt_share_pct_by_type=appt_share_pct_by_type,
+        top20_type_ids=top20_type_ids,
+        revenue_share_pct_by_type=revenue_share_pct_by_type,
+        top10_revenue_type_ids=top10_revenue_type_ids,
+        appointment_stats_df=appointment_stats_df,
+    )
+    return resolve_service_type(features)
+
+
+def resolve_service_type(features):
+    """
+    Apply the configured rules to the features of one service type.
+
+    Args:
+        features: dict from `extract_type_features`
+        
+    Returns:
+        dict: Complete analysis results
+    """
+    type_id = features["TYPE_ID"]
+    desc = features["DESCRIPTION"]
+    client_id = features["Client"]
+    lookup_recurring = features["lookup_recurring"]
     
-    logger.info(f"Starting analysis for TYPE_ID: {type_id}, Description: '{desc[:50]}...'")
+    logger.tally("types_started", "Starting analysis for TYPE_ID: %s, Description: '%.50s...'", type_id, desc)
     
     # Step 1: Analyze API signals
-    api_analysis = analyze_api_signals(row)
+    api_analysis = analyze_api_signals(features)
     
     # Step 2: Analyze text signals (True or None only)
     word_analysis = analyze_text_signals(desc, lookup_recurring)
@@ -446,7 +589,10 @@ def analyze_service_type(row, appointments_df, subscriptions_df, service_types_d
             sales_mapping_val = True if normalized == "TRUE" else False
             sales_mapping_reason = f"SalesMapping={normalized}"
 
-    appt_analysis = analyze_appointment_recurring(type_id, appointments_df, subscriptions_df, client_id)
+    if features["evidence"] is None:
+        appt_analysis = {"appt_recurring_bool": None, "appt_recurring_score": 0.0, "appt_recurring_reason": features["appt_evidence_reason"]}
+    else:
+        appt_analysis = score_appointment_recurring(features["evidence"], features["has_active_subscription"])
 
     # Prepare per-metric sources
     sources_isRecurring = {
@@ -470,9 +616,9 @@ def analyze_service_type(row, appointments_df, subscriptions_df, service_types_d
     # We'll compute after applying business rules.
 
     # Priority lists
-    pr_isRecurring = ['SalesMapping', 'Appointments', 'API', 'Word']
-    pr_isRervice = ['API', 'Word']
-    pr_zeroTime = ['Word', 'API']
+    pr_isRecurring = RECURRING_PRIORITIES
+    pr_isRervice = RESERVICE_PRIORITIES
+    pr_zeroTime = ZERO_TIME_PRIORITIES
 
     chosen_recurring, src_recurring, why_recurring, dissent_recurring = resolve_with_priorities('isRecurring', sources_isRecurring, pr_isRecurring)
     chosen_reservice, src_reservice, why_reservice, dissent_reservice = resolve_with_priorities('isRervice', sources_isRervice, pr_isRervice)
@@ -548,30 +694,36 @@ def analyze_service_type(row, appointments_df, subscriptions_df, service_types_d
         askclient_reasons.append(f"zeroVisitTime: {top_name}={top_val} vs others={[f'{n}={v}' for n, v in rest]}")
     
     # High priority service: top 20 by appointment share per client
-    appt_share_pct = None
-    if appt_share_pct_by_type is not None:
-        appt_share_pct = appt_share_pct_by_type.get(int(type_id), None)
+    appt_share_pct = features["appt_share_pct"]
     high_priority_reason = ""
-    if top20_type_ids is not None and int(type_id) in top20_type_ids:
+    if features["top20_appointments"]:
         high_priority_reason = "high priority service"
         askclient_reasons.append(high_priority_reason)
 
     # High revenue service: top 10 by revenue share per client (last 2 years)
-    revenue_share_pct = None
-    if revenue_share_pct_by_type is not None:
-        revenue_share_pct = revenue_share_pct_by_type.get(int(type_id), None)
+    revenue_share_pct = features["revenue_share_pct"]
     high_revenue_reason = ""
-    if top10_revenue_type_ids is not None and int(type_id) in top10_revenue_type_ids:
+    if features["top10_revenue"]:
         high_revenue_reason = "high revenue service"
         askclient_reasons.append(high_revenue_reason)
     
-    # Step 4: Analyze usage patterns
-    cutoff_date = now - pd.DateOffset(years=2)
-    usage_analysis = analyze_usage_patterns(type_id, appointments_df, subscriptions_df, service_types_df, client_id, cutoff_date)
+    # Step 4: Usage patterns (precomputed per client in extract_type_features)
+    usage_analysis = {
+        "has_visits_past_2yrs": features["has_visits_past_2yrs"],
+        "has_active_subscription": features["has_active_subscription"],
+        "repeated_name": features["repeated_name"],
+        "expired_code": is_expired_code(features["has_visits_past_2yrs"], features["has_active_subscription"]),
+    }
     # Determine if client review is needed (only the two general rules)
     askclient = len(askclient_reasons) > 0
     
-    logger.info(f"Analysis complete for TYPE_ID {type_id}: AskClient={askclient}, AskClient reasons={len(askclient_reasons)}, Constraint violations={len(constraint_violations)}")
+    logger.tally(
+        "types_analyzed",
+        "Analysis complete for TYPE_ID %s: AskClient=%s, AskClient reasons=%s, Constraint violations=%s",
+        type_id, askclient, len(askclient_reasons), len(constraint_violations),
+    )
+    if askclient:
+        logger.tally("askclient")
     
     # Compile final results
     return {
@@ -0,0 +1,94 @@
+import pandas as pd
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+
+def _type_id_set(series):
+    return set(int(v) for v in series.dropna().unique().tolist())
+
+
+class ClientContext:
+    """Per-client lookups shared by every service type of that client.
+
+    Built once per client so that the usage flags of each type are set
+    lookups instead of scans over the client's appointments, subscriptions
+    and service types.
+
+    Attributes:
+        cutoff_date: start of the recent-visit window (now - 2 years)
+        active_subscription_type_ids: types with an active, uncancelled subscription
+        recent_visit_type_ids: types with an appointment on or after cutoff_date
+        repeated_name_type_ids: types whose description is shared with another type
+        has_appointments: whether the client has any appointment, of any type (None: unknown)
+    """
+
+    def __init__(self, cutoff_date, active_subscription_type_ids, recent_visit_type_ids, repeated_name_type_ids,
+                 has_appointments=None):
+        self.cutoff_date = cutoff_date
+        self.active_subscription_type_ids = active_subscription_type_ids
+        self.recent_visit_type_ids = recent_visit_type_ids
+        self.repeated_name_type_ids = repeated_name_type_ids
+        self.has_appointments = has_appointments
+
+    @classmethod
+    def build(cls, client_id, appointments_df, subscriptions_df, service_types_df, now, appointment_stats_df=None,
+              type_totals_df=None):
+        """
+        Args:
+            client_id: Client ID
+            appointments_df: Appointments dataframe (None with the aggregate fetch strategy)
+            subscriptions_df: Subscriptions dataframe
+            service_types_df: Service types dataframe
+            now: Analysis date
+            appointment_stats_df: Aggregated appointment statistics, used instead of appointments_df
+            type_totals_df: Client-wide aggregates of a `--type-ids` fetch
+                (data_fetching.type_totals); the other frames then only hold the
+                selected types, so repeated names and has_appointments come from it
+        """
+        cutoff_date = now - pd.DateOffset(years=2)
+
+        # Active subscriptions
+        subs = subscriptions_df[subscriptions_df['clientID'] == client_id]
+        active_subs = subs[(subs['active'] == True) & (subs['dateCancelled'].isnull())]
+        active_subscription_type_ids = _type_id_set(active_subs['serviceID'])
+
+        # Recent appointments (past 2 years)
+        if appointment_stats_df is not None:
+            has_appointments = not appointment_stats_df.empty
+            recent = appointment_stats_df[appointment_stats_df['last_date'] >= cutoff_date]
+        else:
+            appts = appointments_df[appointments_df['clientID'] == client_id]
+            has_appointments = not appts.empty
+            recent = appts[appts['appointmentDate'] >= cutoff_date]
+        recent_visit_type_ids = _type_id_set(recent['type'])
+
+        if type_totals_df is not None:
+            has_appointments = bool((type_totals_df['measure'] == 'appointments').any())
+            repeated_name_type_ids = _type_id_set(type_totals_df.loc[type_totals_df['measure'] == 'repeated_name', 'TYPE_ID'])
+        else:
+            # Repeated names: description of each type (first row per TYPE_ID) shared by more than one row
+            description_counts = service_types_df['DESCRIPTION'].astype(object).value_counts().to_dict()
+            first_rows = service_types_df.drop_duplicates(subset=['TYPE_ID']).dropna(subset=['TYPE_ID'])
+            repeated_name_type_ids = {
+                int(type_id)
+                for type_id, description in zip(first_rows['TYPE_ID'], first_rows['DESCRIPTION'].astype(object))
+                if description_counts.get(description, 0) > 1
+            }
+
+        logger.debug(
+            "Client context for %s: %d active-subscription types, %d recently visited types, %d repeated names",
+            client_id, len(active_subscription_type_ids), len(recent_visit_type_ids), len(repeated_name_type_ids),
+        )
+        return cls(
+            cutoff_date, active_subscription_type_ids, recent_visit_type_ids, repeated_name_type_ids, has_appointments
+        )
+
+    def has_active_subscription(self, type_id):
+        return int(type_id) in self.active_subscription_type_ids
+
+    def has_recent_visits(self, type_id):
+        return int(type_id) in self.recent_visit_type_ids
+
+    def has_repeated_name(self, type_id):
+        return int(type_id) in self.repeated_name_type_ids
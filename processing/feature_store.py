@@ -0,0 +1,194 @@
+import glob
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from processing.analyzer import resolve_service_type
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+TYPES_DIR = "types"
+ACCOUNTS_DIR = "accounts"
+RESULTS_DIR = "results"
+
+EVIDENCE_COLUMNS = ["visits", "years_count", "has_consecutive_years", "median_delta_days"]
+
+# Result columns compared by `diff_results`
+DIFF_COLUMNS = [
+    "AskClient",
+    "Final Reservice",
+    "Final Recurring",
+    "Final Zero Time",
+    "Final Has Reservice",
+    "Expired Code",
+]
+
+
+def _safe_name(client_id):
+    return "".join(c if c.isalnum() or c in "_.-" else "_" for c in str(client_id))
+
+
+def _stored_evidence(evidence):
+    """Account evidence to persist: of a sampled type only the accounts the sample evaluated."""
+    if evidence is None:
+        return ()
+    if hasattr(evidence, "computed"):
+        return evidence.computed()
+    return evidence
+
+
+class FeatureStore:
+    """Per-type analysis features of one run, as Parquet under `<root>/<run_id>/`.
+
+    Layout:
+        types/<client>.parquet     one row per service type (extract_type_features without evidence)
+        accounts/<client>.parquet  per-(type, account) appointment evidence (sampled accounts only
+                                   for types scored with APPT_SAMPLING, flagged `sampled_evidence`)
+        results/<client>.parquet   AskClient and Final flags the run produced, the baseline for diffs
+
+    Files are written per client, so a resumed run keeps the clients stored
+    before the crash.
+    """
+
+    def __init__(self, root, run_id):
+        self.root = root
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+
+    @staticmethod
+    def runs(root):
+        """Run directories under `root`, oldest first."""
+        runs = [d for d in glob.glob(os.path.join(root, "*")) if os.path.isdir(os.path.join(d, TYPES_DIR))]
+        return sorted(runs, key=os.path.getmtime)
+
+    @classmethod
+    def prune(cls, root, keep):
+        """Delete all but the `keep` most recently written runs under `root`."""
+        runs = cls.runs(root)
+        for path in runs[:max(len(runs) - keep, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Removed stored features of run {os.path.basename(path)}")
+
+    @classmethod
+    def latest(cls, root):
+        """Store of the most recently written run under `root`, or None."""
+        runs = cls.runs(root)
+        if not runs:
+            return None
+        return cls(root, os.path.basename(runs[-1]))
+
+    def save_client(self, client_id, features: List[Dict], rows: List[Dict]) -> None:
+        name = f"{_safe_name(client_id)}.parquet"
+        types = pd.DataFrame([{k: v for k, v in f.items() if k != "evidence"} for f in features])
+        accounts = pd.DataFrame(
+            [
+                (f["Client"], f["TYPE_ID"], *evidence)
+                for f in features
+                for evidence in _stored_evidence(f["evidence"])
+            ],
+            columns=["Client", "TYPE_ID", *EVIDENCE_COLUMNS],
+        )
+        results = pd.DataFrame(rows, columns=["Client", "TYPE_ID", "DESCRIPTION", *DIFF_COLUMNS])
+        # Types whose appointments could be scored, even if no account survived the filters
+        types["has_evidence"] = [f["evidence"] is not None for f in features]
+        types["sampled_evidence"] = [hasattr(f["evidence"], "computed") for f in features]
+        for directory, frame in ((TYPES_DIR, types), (ACCOUNTS_DIR, accounts), (RESULTS_DIR, results)):
+            os.makedirs(os.path.join(self.path, directory), exist_ok=True)
+            path = os.path.join(self.path, directory, name)
+            frame.to_parquet(f"{path}.tmp", index=False)
+            os.replace(f"{path}.tmp", path)
+
+    def _read(self, directory):
+        paths = sorted(glob.glob(os.path.join(self.path, directory, "*.parquet")))
+        if not paths:
+            return pd.DataFrame()
+        return pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+
+    def load(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """(types, accounts, results) of every stored client."""
+        return self._read(TYPES_DIR), self._read(ACCOUNTS_DIR), self._read(RESULTS_DIR)
+
+
+def _none_if_na(value):
+    return None if value is None or pd.isna(value) else value
+
+
+def features_from_store(types: pd.DataFrame, accounts: pd.DataFrame) -> List[Dict]:
+    """Rebuild `extract_type_features` dicts from stored frames."""
+    evidence: Dict[Tuple, List[Tuple]] = {}
+    for r in accounts.itertuples(index=False):
+        evidence.setdefault((r.Client, r.TYPE_ID), []).append(
+            (int(r.visits), int(r.years_count), bool(r.has_consecutive_years), _none_if_na(r.median_delta_days))
+        )
+    features = []
+    for record in types.to_dict("records"):
+        has_evidence = record.pop("has_evidence")
+        record.pop("sampled_evidence", None)
+        for key in ("lookup_recurring", "appt_share_pct", "revenue_share_pct", "appt_evidence_reason"):
+            record[key] = _none_if_na(record[key])
+        record["evidence"] = evidence.get((record["Client"], record["TYPE_ID"]), []) if has_evidence else None
+        features.append(record)
+    return features
+
+
+def _same(a, b):
+    return (_none_if_na(a) is None and _none_if_na(b) is None) or a == b
+
+
+def diff_results(before: pd.DataFrame, after: pd.DataFrame, columns=DIFF_COLUMNS) -> pd.DataFrame:
+    """One row per (Client, TYPE_ID, column) whose value changed between two result frames."""
+    merged = before[["Client", "TYPE_ID", "DESCRIPTION", *columns]].merge(
+        after[["Client", "TYPE_ID", *columns]], on=["Client", "TYPE_ID"], how="outer", suffixes=(" before", " after"),
+    )
+    changes = []
+    for r in merged.to_dict("records"):
+        for column in columns:
+            old, new = r[f"{column} before"], r[f"{column} after"]
+            if not _same(old, new):
+                changes.append({
+                    "Client": r["Client"],
+                    "TYPE_ID": r["TYPE_ID"],
+                    "DESCRIPTION": r.get("DESCRIPTION"),
+                    "column": column,
+                    "before": _none_if_na(old),
+                    "after": _none_if_na(new),
+                })
+    return pd.DataFrame(changes, columns=["Client", "TYPE_ID", "DESCRIPTION", "column", "before", "after"])
+
+
+def reevaluate(store: FeatureStore) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Resolve the stored features with the current config.
+
+    Returns (results, diff): the re-resolved rows and their changes against
+    the results the stored run produced.
+    """
+    types, accounts, baseline = store.load()
+    if types.empty:
+        raise ValueError(f"No features stored for run {store.run_id} in {store.path}")
+    rows = [resolve_service_type(f) for f in features_from_store(types, accounts)]
+    if "sampled_evidence" in types and types["sampled_evidence"].any():
+        logger.warning(
+            f"{int(types['sampled_evidence'].sum())} service types of run {store.run_id} were scored on an "
+            f"appointment sample; their stored evidence only covers the sampled accounts"
+        )
+    results = pd.DataFrame(rows)
+    diff = diff_results(baseline, results)
+    logger.info(f"Re-evaluated {len(results)} service types of run {store.run_id}: {len(diff)} flag changes")
+    return results, diff
+
+
+def format_diff_summary(diff: pd.DataFrame, total_types: int) -> str:
+    """Changed types per flag, split by direction."""
+    lines = [f"{'flag':<22} {'changed':>8}  transitions", "-" * 60]
+    for column in DIFF_COLUMNS:
+        changed = diff[diff["column"] == column]
+        transitions = changed.groupby(["before", "after"], dropna=False).size()
+        detail = ", ".join(f"{before}->{after}: {n}" for (before, after), n in transitions.items())
+        lines.append(f"{column:<22} {len(changed):>8}  {detail}")
+    changed_types = diff[["Client", "TYPE_ID"]].drop_duplicates().shape[0] if not diff.empty else 0
+    lines.append("-" * 60)
+    lines.append(f"{changed_types} of {total_types} service types changed")
+    return "\n".join(lines)
@@ -0,0 +1,81 @@
+import operator
+
+from config import API_SIGNAL_RULES as API_SIGNAL_RULE_SPECS
+
+# Order in which the API flag rules are applied. For each signal, the result
+# of a later flag overrides an earlier one unless it is None.
+API_RULE_ORDER = ("FREQUENCY", "RESERVICE", "DEFAULT_LENGTH", "REGULAR_SERVICE", "INITIAL_ID", "INITIAL")
+
+# Value of each API signal when no rule yields one
+API_SIGNAL_DEFAULTS = {
+    "isRecurring": False,
+    "has_reservice": False,
+    "isRervice": False,
+    "zeroVisitTime": False,
+}
+
+_OPERATORS = {
+    "==": (operator.eq, "="),
+    "!=": (operator.ne, "!="),
+    ">": (operator.gt, ">"),
+    ">=": (operator.ge, ">="),
+    "<": (operator.lt, "<"),
+    "<=": (operator.le, "<="),
+}
+
+
+def sql_literal(value):
+    """Render None, a bool, a number or a string as a BigQuery literal."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    escaped = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+class ApiRule:
+    """Maps an API flag value to a signal: `then` if `value <op> operand`, else `otherwise`.
+
+    Built from the plain tuples of config.API_SIGNAL_RULES (see
+    build_api_rules) so that the same rule can be called by the Python
+    analyzer and compiled to SQL (processing.sql_compiler). A missing flag
+    never matches.
+    """
+
+    def __init__(self, op, operand, then, otherwise=None):
+        if op not in _OPERATORS:
+            raise ValueError(f"Unsupported operator {op!r}. Available: {sorted(_OPERATORS)}")
+        self.op = op
+        self.operand = operand
+        self.then = then
+        self.otherwise = otherwise
+
+    def __call__(self, value):
+        if value is not None and _OPERATORS[self.op][0](value, self.operand):
+            return self.then
+        return self.otherwise
+
+    def to_sql(self, column):
+        """CASE expression over `column` returning the same value as calling the rule."""
+        return (
+            f"CASE WHEN {column} {_OPERATORS[self.op][1]} {sql_literal(self.operand)} "
+            f"THEN {sql_literal(self.then)} ELSE {sql_literal(self.otherwise)} END"
+        )
+
+    def __repr__(self):
+        return f"ApiRule({self.op!r}, {self.operand!r}, then={self.then!r}, otherwise={self.otherwise!r})"
+
+
+def build_api_rules(specs):
+    """{flag: {signal: ApiRule | None}} from {flag: {signal: (op, operand, then[, otherwise]) | None}}."""
+    return {
+        flag: {signal: None if spec is None else ApiRule(*spec) for signal, spec in signals.items()}
+        for flag, signals in specs.items()
+    }
+
+
+# config.API_SIGNAL_RULES as ApiRules, shared by the analyzer and the SQL compiler
+API_SIGNAL_RULES = build_api_rules(API_SIGNAL_RULE_SPECS)
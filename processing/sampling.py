@@ -0,0 +1,90 @@
+import math
+import random
+from statistics import NormalDist
+
+# Upper bounds of the visit-count strata accounts are sampled from
+VISIT_STRATA = (1, 2, 5, 11)
+
+
+def _visit_stratum(visits):
+    for index, upper in enumerate(VISIT_STRATA):
+        if visits <= upper:
+            return index
+    return len(VISIT_STRATA)
+
+
+def stratified_order(visits, seed=0):
+    """Order account indices so that every prefix is a stratified random sample.
+
+    Accounts are stratified by visit count (few-visit accounts can never show
+    a stable cadence, so strata differ a lot in their strong-account rate).
+    Each stratum is shuffled and its k-th account gets the key
+    (k + offset) / stratum size, so sorting by key interleaves the strata in
+    proportion to their size and any prefix is proportionally allocated.
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for index, count in enumerate(visits):
+        strata.setdefault(_visit_stratum(count), []).append(index)
+    keyed = []
+    for members in strata.values():
+        rng.shuffle(members)
+        offset = rng.random()
+        size = len(members)
+        keyed.extend(((k + offset) / size, index) for k, index in enumerate(members))
+    keyed.sort()
+    return [index for _, index in keyed]
+
+
+def wilson_interval(successes, n, confidence=0.95, population=None):
+    """Wilson score interval for a proportion, with finite population correction.
+
+    With `population` N, n is inflated to n (N - 1) / (N - n), so the interval
+    shrinks to the point estimate once the whole population is sampled.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    if population is not None and n >= population:
+        return p, p
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    if population is not None and population > 1:
+        n = n * (population - 1) / (population - n)
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def sample_strong_ratio(total, visits, is_strong, threshold, initial, confidence=0.95, seed=0):
+    """Estimate the share of strong accounts by growing a stratified sample.
+
+    `is_strong(i)` is only called for sampled accounts. The sample doubles,
+    starting at `initial`, until the confidence interval of the ratio lies
+    entirely on one side of `threshold` or every account has been evaluated.
+
+    Returns:
+        dict: strong (strong accounts in the sample), sampled, total, ratio,
+            low and high (interval bounds), confidence
+    """
+    order = stratified_order(visits, seed)
+    strong = 0
+    sampled = 0
+    size = min(max(initial, 1), total)
+    while True:
+        for index in order[sampled:size]:
+            strong += bool(is_strong(index))
+        sampled = size
+        low, high = wilson_interval(strong, sampled, confidence, population=total)
+        if sampled >= total or high < threshold or low >= threshold:
+            break
+        size = min(size * 2, total)
+    return {
+        "strong": strong,
+        "sampled": sampled,
+        "total": total,
+        "ratio": strong / sampled if sampled else 0.0,
+        "low": low,
+        "high": high,
+        "confidence": confidence,
+    }
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import WORD_SIGNALS, TEXT_SIGNAL_CACHE_SIZE, TEXT_SIGNAL_CACHE_PATH
+from utils.logger import Logger
+
+logger = Logger(__name__)
+
+SIGNAL_NAMES = ("reservice", "recurring", "zero_time", "has_reservice")
+
+SignalTuple = Tuple[Optional[bool], ...]
+
+
+def word_signals_hash(word_signals=WORD_SIGNALS) -> str:
+    """Stable hash of the keyword lists; cached results are only valid for the same hash."""
+    payload = json.dumps(word_signals, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize_description(description: str) -> str:
+    # Keywords are matched as substrings of the lower-cased description, and no
+    # keyword starts or ends with whitespace, so stripping cannot change a result.
+    return description.lower().strip()
+
+
+class TextSignalCache:
+    """Bounded LRU of normalized description -> word signal tuple.
+
+    Shared by every row and client of a run. With a path, entries are loaded
+    at start and saved at the end of the run; a file written for different
+    WORD_SIGNALS is ignored.
+    """
+
+    def __init__(self, max_size: int = TEXT_SIGNAL_CACHE_SIZE, path: Optional[str] = None):
+        self.max_size = max_size
+        self.path = path
+        self.signals_hash = word_signals_hash()
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, SignalTuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[SignalTuple]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: SignalTuple) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable text signal cache {self.path}: {e}")
+            return
+        if payload.get("signals_hash") != self.signals_hash:
+            logger.info(f"WORD_SIGNALS changed since {self.path} was written; starting with an empty text signal cache")
+            return
+        for key, value in payload.get("entries", {}).items():
+            self.put(key, tuple(value))
+        logger.info(f"Loaded {len(self._entries)} cached text signal results from {self.path}")
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            payload = {"signals_hash": self.signals_hash, "entries": dict(self._entries)}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+_cache = TextSignalCache(path=TEXT_SIGNAL_CACHE_PATH)
+
+
+def get_text_signal_cache() -> TextSignalCache:
+    return _cache
@@ -0,0 +1,413 @@
+from typing import Optional, Sequence
+
+import pandas as pd
+
+from config import (
+    WORD_SIGNALS,
+    BQ_APPOINTMENT_RULES,
+    BQ_OUTPUT_SCHEMA,
+    LKP_RECURRING_TABLE,
+    MERGED_SUBSCRIPTION_TABLE,
+    APPOINTMENT_LOOKBACK_YEARS,
+)
+from data_fetching.appointments import account_stats_sql
+from data_fetching.schemas import true_flag_sql
+from data_fetching.service_types import SERVICE_TYPE_ORDER
+from data_fetching.snapshot import service_types_source
+from processing.analyzer import RECURRING_PRIORITIES, RESERVICE_PRIORITIES, ZERO_TIME_PRIORITIES
+from processing.feature_store import DIFF_COLUMNS
+from processing.rules import API_RULE_ORDER, API_SIGNAL_DEFAULTS, API_SIGNAL_RULES, sql_literal
+from processing.signal_cache import SIGNAL_NAMES
+
+# Column of each signal source per resolved signal, in the analyzer's priority order
+_SOURCE_COLUMNS = {
+    "isRecurring": {"SalesMapping": "sales_mapping", "Appointments": "appt_recurring", "API": "api_isRecurring", "Word": "word_recurring"},
+    "isRervice": {"API": "api_isRervice", "Word": "word_reservice"},
+    "zeroVisitTime": {"Word": "word_zero_time", "API": "api_zeroVisitTime"},
+}
+_PRIORITIES = {
+    "isRecurring": RECURRING_PRIORITIES,
+    "isRervice": RESERVICE_PRIORITIES,
+    "zeroVisitTime": ZERO_TIME_PRIORITIES,
+}
+
+
+def _client_filter(column, clients):
+    if clients is None:
+        return "TRUE"
+    return f"{column} IN ({', '.join(sql_literal(str(c)) for c in clients)})"
+
+
+def api_signal_sql(signal):
+    """Expression for one API signal: the last non-NULL rule result in API_RULE_ORDER, else the default."""
+    results = [
+        API_SIGNAL_RULES[name][signal].to_sql(f"API_{name}")
+        for name in API_RULE_ORDER
+        if API_SIGNAL_RULES.get(name, {}).get(signal) is not None
+    ]
+    return f"COALESCE({', '.join([*reversed(results), sql_literal(API_SIGNAL_DEFAULTS[signal])])})"
+
+
+def word_signal_sql(name, description="description_key"):
+    """TRUE if `description` contains one of the signal's keywords, else NULL (analyze_text_signals)."""
+    keywords = WORD_SIGNALS.get(name, [])
+    if not keywords:
+        return "CAST(NULL AS BOOL)"
+    matches = " OR ".join(f"STRPOS({description}, {sql_literal(kw)}) > 0" for kw in dict.fromkeys(keywords))
+    return f"IF({matches}, TRUE, NULL)"
+
+
+def _strong_account_sql():
+    """Per-account strength as in analyzer._is_strong_account."""
+    min_visits = BQ_APPOINTMENT_RULES.get("APPT_MIN_VISITS_STRONG", 3)
+    bands = BQ_APPOINTMENT_RULES.get("CADENCE_BANDS", {}).values()
+    within_band = " OR ".join(
+        f"(median_delta_days >= {low} AND median_delta_days < {high})" for low, high in bands
+    ) or "FALSE"
+    return f"COALESCE(has_consecutive_years OR (visits >= {min_visits} AND ({within_band})), FALSE)"
+
+
+def _py_bool(expr):
+    return f"IF({expr}, 'True', 'False')"
+
+
+def _askclient_reason_sql(signal):
+    """The two AskClient rules of resolve_service_type for one signal, joined by '; '."""
+    sources = f"{signal}_sources"
+    top, second = f"{sources}[OFFSET(0)]", f"{sources}[OFFSET(1)]"
+    top_two = (
+        f"IF(ARRAY_LENGTH({sources}) >= 2 AND {top}.value != {second}.value, "
+        f"CONCAT('{signal}: ', {top}.name, '=', {_py_bool(f'{top}.value')}, ' vs ', "
+        f"{second}.name, '=', {_py_bool(f'{second}.value')}), NULL)"
+    )
+    top_vs_rest = (
+        f"IF(ARRAY_LENGTH({sources}) >= 2 AND NOT EXISTS("
+        f"SELECT 1 FROM UNNEST({sources}) s WITH OFFSET pos WHERE pos > 0 AND s.value = {top}.value), "
+        f"CONCAT('{signal}: ', {top}.name, '=', {_py_bool(f'{top}.value')}, ' vs others=[', ARRAY_TO_STRING(ARRAY("
+        f"SELECT CONCAT(\"'\", s.name, '=', {_py_bool('s.value')}, \"'\") "
+        f"FROM UNNEST({sources}) s WITH OFFSET pos WHERE pos > 0 ORDER BY pos), ', '), ']'), NULL)"
+    )
+    return f"ARRAY_TO_STRING([{top_two}, {top_vs_rest}], '; ')"
+
+
+def _sources_sql(signal):
+    """Non-NULL sources of a signal in priority order, as ARRAY<STRUCT<name, value>>."""
+    entries = ", ".join(
+        f"STRUCT({sql_literal(name)} AS name, {_SOURCE_COLUMNS[signal][name]} AS value)"
+        for name in _PRIORITIES[signal]
+    )
+    return (
+        f"ARRAY(SELECT AS STRUCT name, value FROM UNNEST([{entries}]) WITH OFFSET pos "
+        f"WHERE value IS NOT NULL ORDER BY pos)"
+    )
+
+
+def _chosen_sql(signal):
+    return f"COALESCE({', '.join(_SOURCE_COLUMNS[signal][name] for name in _PRIORITIES[signal])})"
+
+
+# Expression of each BQ_OUTPUT_SCHEMA column over the `resolved` CTE
+_OUTPUT_COLUMNS = {
+    "TYPE_ID": "TYPE_ID",
+    "DESCRIPTION": "COALESCE(DESCRIPTION, '')",
+    "API RESERVICE FLAG": "API_RESERVICE",
+    "API REGULAR_SERVICE FLAG": "API_REGULAR_SERVICE",
+    "API FREQUENCY FLAG": "API_FREQUENCY",
+    "API DEFAULT_LENGTH FLAG": "API_DEFAULT_LENGTH",
+    "API INITIAL ID FLAG": "API_INITIAL_ID",
+    "API INITIAL FLAG": "API_INITIAL",
+    "hasVisitsInPast2Years": "has_visits_past_2yrs",
+    "hasActiveSubscription": "has_active_subscription",
+    "Repeated Name": "repeated_name",
+    "API Reservice": "api_isRervice",
+    "API Recurring": "api_isRecurring",
+    "API Zero Time": "api_zeroVisitTime",
+    "API Has Reservice": "api_has_reservice",
+    "Word Signal Reservice": "word_reservice",
+    "Word Signal Recurring": "word_recurring",
+    "Word Signal Zero Time": "word_zero_time",
+    "Word Signal Has Reservice": "word_has_reservice",
+    "Appt Recurring": "appt_recurring",
+    "Appt Recurring Score": "appt_recurring_score",
+    "Appt Recurring - Reason": "appt_recurring_reason",
+    "Final Reservice": "final_reservice",
+    "Final Recurring": "chosen_recurring",
+    "Final Zero Time": "chosen_zero",
+    "Final Has Reservice": "COALESCE(has_reservice_3, FALSE)",
+    "Expired Code": "NOT has_visits_past_2yrs OR NOT has_active_subscription",
+    "AskClient Reservice - Reason": "isRervice_reason",
+    "AskClient Recurring - Reason": "isRecurring_reason",
+    "AskClient Zero Time - Reason": "zeroVisitTime_reason",
+    "AskClient Has Reservice - Reason": "''",
+    "AskClient": (
+        "isRecurring_reason != '' OR isRervice_reason != '' OR zeroVisitTime_reason != '' "
+        "OR top20_appointments OR top10_revenue"
+    ),
+    "Appointment Share Pct": "appt_share_pct",
+    "Revenue Share Pct": "revenue_share_pct",
+    "AskClient High Priority - Reason": "IF(top20_appointments, 'high priority service', '')",
+    "AskClient High Revenue - Reason": "IF(top10_revenue, 'high revenue service', '')",
+    "Client": "Client",
+}
+
+_BQ_CASTS = {"INT64": "INT64", "FLOAT": "FLOAT64", "BOOL": "BOOL", "STRING": "STRING"}
+
+
+def compile_analysis_sql(clients: Optional[Sequence[str]] = None, now=None, lookback_years=APPOINTMENT_LOOKBACK_YEARS) -> str:
+    """One BigQuery query producing the BQ_OUTPUT_SCHEMA rows of every client.
+
+    The rules in config.py (API_SIGNAL_RULES, WORD_SIGNALS,
+    BQ_APPOINTMENT_RULES) and the analyzer's source priorities, business
+    constraints and AskClient rules are rendered into CTEs, so the analysis
+    runs where the data is and no appointment or subscription row leaves
+    BigQuery. Each CLIENT value is analyzed on its own, as in a fleet run.
+
+    Args:
+        clients: restrict the query to these clients (default: all)
+        now: analysis date for hasVisitsInPast2Years (default: today)
+        lookback_years: appointment lookback, as for the Python fetches
+    """
+    now = pd.Timestamp.today() if now is None else pd.Timestamp(now)
+    cutoff = now - pd.DateOffset(years=2)
+    missing = [name for name, _ in BQ_OUTPUT_SCHEMA if name not in _OUTPUT_COLUMNS]
+    if missing:
+        raise ValueError(f"No SQL expression for output columns {missing}")
+    pop_ratio_strong = BQ_APPOINTMENT_RULES.get("POP_RATIO_STRONG", 0.6)
+    api_columns = ",\n            ".join(f"{api_signal_sql(s)} AS api_{s}" for s in API_SIGNAL_DEFAULTS)
+    word_columns = ",\n            ".join(f"{word_signal_sql(s)} AS word_{s}" for s in SIGNAL_NAMES)
+    source_columns = ",\n            ".join(f"{_sources_sql(s)} AS {s}_sources" for s in _PRIORITIES)
+    reason_columns = ",\n            ".join(f"{_askclient_reason_sql(s)} AS {s}_reason" for s in _PRIORITIES)
+    output_columns = ",\n        ".join(
+        f"CAST({_OUTPUT_COLUMNS[name]} AS {_BQ_CASTS.get(kind, kind)}) AS `{name}`"
+        for name, kind in BQ_OUTPUT_SCHEMA
+    )
+    return f"""
+    WITH service_types AS (
+        SELECT
+            CLIENT AS Client,
+            CAST(TYPE_ID AS INT64) AS TYPE_ID,
+            DESCRIPTION,
+            COALESCE(SAFE_CAST(RESERVICE AS INT64), 0) AS API_RESERVICE,
+            COALESCE(SAFE_CAST(REGULAR_SERVICE AS INT64), 0) AS API_REGULAR_SERVICE,
+            COALESCE(SAFE_CAST(FREQUENCY AS INT64), 0) AS API_FREQUENCY,
+            COALESCE(SAFE_CAST(DEFAULT_LENGTH AS INT64), 0) AS API_DEFAULT_LENGTH,
+            COALESCE(SAFE_CAST(INITIAL_ID AS INT64), 0) AS API_INITIAL_ID,
+            COALESCE(SAFE_CAST(INITIAL AS INT64), 0) AS API_INITIAL
+        FROM {service_types_source(_client_filter("CLIENT", clients))}
+        WHERE TYPE_ID IS NOT NULL
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY CLIENT, CAST(TYPE_ID AS INT64) ORDER BY {SERVICE_TYPE_ORDER}) = 1
+    ),
+    recurring_lookup AS (
+        SELECT
+            clientId AS Client,
+            serviceType,
+            ANY_VALUE(UPPER(TRIM(CAST(isRecurring AS STRING)))) AS lookup_recurring
+        FROM `{LKP_RECURRING_TABLE}`
+        WHERE {_client_filter("clientId", clients)}
+        GROUP BY clientId, serviceType
+    ),
+    account_stats AS ({account_stats_sql(_client_filter("clientID", clients), lookback_years, now)}),
+    accounts AS (
+        SELECT
+            clientID AS Client,
+            SAFE_CAST(type AS INT64) AS TYPE_ID,
+            individualAccountID,
+            appointmentCount,
+            visits,
+            last_date,
+            {_strong_account_sql()} AS strong
+        FROM account_stats
+    ),
+    clients_with_appointments AS (
+        SELECT DISTINCT Client FROM accounts
+    ),
+    type_evidence AS (
+        SELECT
+            Client,
+            TYPE_ID,
+            SUM(appointmentCount) AS appointment_count,
+            SUM(visits) AS visits,
+            MAX(last_date) AS last_date,
+            COUNTIF(individualAccountID IS NOT NULL AND visits > 0) AS total_accounts,
+            COUNTIF(individualAccountID IS NOT NULL AND visits > 0 AND strong) AS strong_accounts
+        FROM accounts
+        WHERE TYPE_ID IS NOT NULL
+        GROUP BY Client, TYPE_ID
+    ),
+    appointment_shares AS (
+        SELECT
+            Client,
+            TYPE_ID,
+            ROUND(appointment_count / SUM(appointment_count) OVER (PARTITION BY Client) * 100, 2) AS appt_share_pct,
+            ROW_NUMBER() OVER (PARTITION BY Client ORDER BY appointment_count DESC, TYPE_ID) <= 20 AS top20
+        FROM type_evidence
+    ),
+    active_subscriptions AS (
+        SELECT
+            clientID AS Client,
+            SAFE_CAST(serviceID AS INT64) AS TYPE_ID,
+            REGEXP_REPLACE(TRIM(CAST(annualRecurringServices AS STRING)), r'[,$]', '') AS ars
+        FROM `{MERGED_SUBSCRIPTION_TABLE}`
+        WHERE {_client_filter("clientID", clients)}
+            AND {true_flag_sql("active")}
+            AND SAFE_CAST(dateCancelled AS TIMESTAMP) IS NULL
+    ),
+    active_types AS (
+        SELECT DISTINCT Client, TYPE_ID
+        FROM active_subscriptions
+        WHERE TYPE_ID IS NOT NULL
+    ),
+    revenue AS (
+        SELECT
+            Client,
+            TYPE_ID,
+            SUM(IF(REGEXP_CONTAINS(ars, r'^\\(.*\\)$'), -ABS(ars_num), ars_num)) AS ars_total
+        FROM (
+            SELECT *, SAFE_CAST(REGEXP_REPLACE(ars, r'[()]', '') AS FLOAT64) AS ars_num
+            FROM active_subscriptions
+        )
+        WHERE TYPE_ID IS NOT NULL AND ars_num IS NOT NULL AND NOT IS_NAN(ars_num)
+        GROUP BY Client, TYPE_ID
+    ),
+    revenue_shares AS (
+        SELECT
+            Client,
+            TYPE_ID,
+            ROUND(ars_total / client_total * 100, 2) AS revenue_share_pct,
+            ROW_NUMBER() OVER (PARTITION BY Client ORDER BY ars_total DESC, TYPE_ID) <= 10 AS top10
+        FROM (
+            SELECT *, SUM(ars_total) OVER (PARTITION BY Client) AS client_total
+            FROM revenue
+        )
+        WHERE client_total > 0
+    ),
+    features AS (
+        SELECT
+            t.*,
+            LOWER(COALESCE(t.DESCRIPTION, '')) AS description_key,
+            CASE l.lookup_recurring WHEN 'TRUE' THEN TRUE WHEN 'FALSE' THEN FALSE END AS sales_mapping,
+            t.DESCRIPTION IS NOT NULL
+                AND COUNT(t.DESCRIPTION) OVER (PARTITION BY t.Client, t.DESCRIPTION) > 1 AS repeated_name,
+            COALESCE(e.last_date >= TIMESTAMP '{cutoff.isoformat(sep=" ")}', FALSE) AS has_visits_past_2yrs,
+            a.TYPE_ID IS NOT NULL AS has_active_subscription,
+            s.appt_share_pct,
+            COALESCE(s.top20, FALSE) AS top20_appointments,
+            r.revenue_share_pct,
+            COALESCE(r.top10, FALSE) AS top10_revenue,
+            CASE
+                WHEN c.Client IS NULL THEN 'No appointments for client'
+                WHEN e.TYPE_ID IS NULL THEN 'No appointments for this service type'
+                WHEN e.visits = 0 THEN 'No valid appointment dates'
+            END AS appt_evidence_reason,
+            COALESCE(e.total_accounts, 0) AS total_accounts,
+            COALESCE(e.strong_accounts, 0) AS strong_accounts
+        FROM service_types t
+        LEFT JOIN recurring_lookup l ON l.Client = t.Client AND l.serviceType = t.DESCRIPTION
+        LEFT JOIN active_types a ON a.Client = t.Client AND a.TYPE_ID = t.TYPE_ID
+        LEFT JOIN clients_with_appointments c ON c.Client = t.Client
+        LEFT JOIN type_evidence e ON e.Client = t.Client AND e.TYPE_ID = t.TYPE_ID
+        LEFT JOIN appointment_shares s ON s.Client = t.Client AND s.TYPE_ID = t.TYPE_ID
+        LEFT JOIN revenue_shares r ON r.Client = t.Client AND r.TYPE_ID = t.TYPE_ID
+    ),
+    scored AS (
+        SELECT
+            *,
+            {api_columns},
+            {word_columns},
+            IF(appt_evidence_reason IS NULL AND strong_ratio >= {pop_ratio_strong}, TRUE, NULL) AS appt_recurring,
+            CASE
+                WHEN appt_evidence_reason IS NOT NULL THEN 0.0
+                WHEN strong_ratio >= {pop_ratio_strong} AND has_active_subscription THEN 1.0
+                WHEN strong_ratio >= {pop_ratio_strong} THEN 0.7
+                WHEN strong_accounts > 0 THEN 0.5
+                ELSE 0.0
+            END AS appt_recurring_score,
+            IFNULL(appt_evidence_reason, CONCAT(
+                FORMAT('%d/%d accounts strong (%.0f%%)', strong_accounts, total_accounts, strong_ratio * 100),
+                IF(has_active_subscription, '; active subscription present', ''),
+                CASE
+                    WHEN strong_ratio >= {pop_ratio_strong} AND has_active_subscription
+                        THEN '; meets strong ratio threshold with active subscription'
+                    WHEN strong_ratio >= {pop_ratio_strong} THEN '; meets strong ratio threshold'
+                    WHEN strong_accounts > 0 THEN '; some accounts show recurring, below threshold'
+                    ELSE '; no recurring evidence'
+                END
+            )) AS appt_recurring_reason
+        FROM (
+            SELECT *, IF(total_accounts > 0, strong_accounts / total_accounts, 0.0) AS strong_ratio
+            FROM features
+        )
+    ),
+    chosen AS (
+        SELECT
+            *,
+            {_chosen_sql("isRecurring")} AS chosen_recurring,
+            {_chosen_sql("isRervice")} AS chosen_reservice,
+            {_chosen_sql("zeroVisitTime")} AS chosen_zero,
+            {source_columns}
+        FROM scored
+    ),
+    -- Business constraints of check_business_constraints, applied in order
+    constrained AS (
+        SELECT
+            *,
+            IF(chosen_recurring IS TRUE AND chosen_reservice IS TRUE, FALSE, chosen_reservice) AS final_reservice,
+            IF(chosen_zero IS TRUE AND has_reservice_1 IS TRUE, FALSE, has_reservice_1) AS has_reservice_2
+        FROM (
+            SELECT
+                *,
+                IF(chosen_recurring IS TRUE, TRUE, IF(chosen_recurring IS NULL, api_has_reservice, NULL)) AS has_reservice_1
+            FROM chosen
+        )
+    ),
+    resolved AS (
+        SELECT
+            *,
+            IF(final_reservice IS TRUE AND has_reservice_2 IS TRUE, FALSE, has_reservice_2) AS has_reservice_3,
+            {reason_columns}
+        FROM constrained
+    )
+    SELECT
+        {output_columns}
+    FROM resolved
+    """
+
+
+def compile_output_table_sql(table_id: str, clients: Optional[Sequence[str]] = None, now=None) -> str:
+    """CREATE OR REPLACE statement loading `table_id` like the bigquery sink.
+
+    Rows are filtered like processing.filters.filter_active_subscription.
+    """
+    return f"""
+    CREATE OR REPLACE TABLE `{table_id}` AS
+    SELECT *
+    FROM ({compile_analysis_sql(clients, now)})
+    WHERE hasActiveSubscription OR hasVisitsInPast2Years
+    """
+
+
+# Columns compared between warehouse and Python results for the same clients
+CROSS_CHECK_COLUMNS = [
+    *DIFF_COLUMNS,
+    "API Reservice",
+    "API Recurring",
+    "API Zero Time",
+    "API Has Reservice",
+    "hasVisitsInPast2Years",
+    "hasActiveSubscription",
+    "Repeated Name",
+    "Appt Recurring",
+    "Appt Recurring Score",
+]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the analysis compiled to BigQuery SQL")
+    parser.add_argument("--clients", help="Comma-separated client IDs to restrict the query to")
+    parser.add_argument("--table", help="Print the CREATE OR REPLACE statement loading this table instead")
+    args = parser.parse_args()
+
+    selected = [c.strip() for c in args.clients.split(",") if c.strip()] if args.clients else None
+    print(compile_output_table_sql(args.table, selected) if args.table else compile_analysis_sql(selected))
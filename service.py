@@ -0,0 +1,232 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from config import SERVICE_CACHE_TTL_SECONDS, SERVICE_CACHE_CLIENTS
+from data_fetching.clients import get_distinct_clients, is_valid_client_id
+from data_fetching.planner import plan_clients
+from pipeline import analyze_client, fetch_client_data, parse_type_ids, refresh_sources
+from processing.builder import build_final_dataframe
+from processing.signal_cache import get_text_signal_cache
+from utils.logger import Logger, summary_scope
+from utils.metrics import start_run
+
+logger = Logger(__name__)
+
+
+class AnalysisService:
+    """Analyzes single clients on request and keeps the results warm.
+
+    The BigQuery client, the text signal cache and the compiled rules live
+    as long as the process. Each client's analysis rows are cached for
+    `cache_ttl` seconds (at most `max_clients` clients, least recently used
+    evicted first), so a repeated request only filters cached rows. Fetches
+    run one at a time; each one is a small run with its own metrics, planned
+    like `main.py --plan` and analyzed by pipeline.analyze_client.
+
+    Only clients of the service type table (plus ACCEL, the merged office
+    client) are analyzed; the list is reloaded at most once per `cache_ttl`
+    when an unknown ID is requested.
+    """
+
+    def __init__(self, bq_client, cache_ttl=SERVICE_CACHE_TTL_SECONDS, max_clients=SERVICE_CACHE_CLIENTS):
+        self.bq_client = bq_client
+        self.cache_ttl = cache_ttl
+        self.max_clients = max_clients
+        self.requests = 0
+        self.fetches = 0
+        self._cache = OrderedDict()  # client_id -> (fetched_at, analyzed_at, rows)
+        self._cache_lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._snapshot_refreshed_at = None
+        self._known_clients = set()
+        self._known_clients_at = None
+        self._clients_lock = threading.Lock()
+
+    def is_known_client(self, client_id):
+        """Whether `client_id` is a well-formed ID of a client in the service type table."""
+        if not is_valid_client_id(client_id):
+            return False
+        with self._clients_lock:
+            stale = self._known_clients_at is None or time.monotonic() - self._known_clients_at > self.cache_ttl
+            if client_id not in self._known_clients and stale:
+                clients = set(get_distinct_clients(self.bq_client))
+                if any(c.startswith("ACCEL_OFFICE_") for c in clients):
+                    clients.add("ACCEL")
+                self._known_clients = clients
+                self._known_clients_at = time.monotonic()
+            return client_id in self._known_clients
+
+    def _cached(self, client_id):
+        with self._cache_lock:
+            entry = self._cache.get(client_id)
+            if entry is None or time.monotonic() - entry[0] > self.cache_ttl:
+                return None
+            self._cache.move_to_end(client_id)
+            return entry
+
+    def _store(self, client_id, entry):
+        with self._cache_lock:
+            self._cache[client_id] = entry
+            self._cache.move_to_end(client_id)
+            while len(self._cache) > self.max_clients:
+                self._cache.popitem(last=False)
+
+    def _fetch(self, client_id, refresh):
+        """Fetch and analyze `client_id` as a one-client run; return the cache entry and its report."""
+        metrics = start_run(f"service-{client_id}")
+        # A refresh must see the client's latest service type loads
+        if refresh or self._snapshot_refreshed_at is None or time.monotonic() - self._snapshot_refreshed_at > self.cache_ttl:
+            refresh_sources(self.bq_client, metrics)
+            self._snapshot_refreshed_at = time.monotonic()
+        now = pd.to_datetime("today")
+        with summary_scope(client_id):
+            strategy = plan_clients(self.bq_client, [client_id], metrics, now=now)[0]["strategy"]
+            data = fetch_client_data(self.bq_client, client_id, metrics, strategy=strategy, now=now)
+            rows = analyze_client(data, client_id, now, metrics)
+        self.fetches += 1
+        entry = (time.monotonic(), now, rows)
+        self._store(client_id, entry)
+        return entry, metrics.report()["clients"].get(client_id, {})
+
+    def analyze(self, client_id, type_ids=None, refresh=False):
+        """Analysis rows of `client_id`, restricted to `type_ids` if given, plus request details."""
+        started = time.perf_counter()
+        with self._cache_lock:
+            self.requests += 1
+        entry = None if refresh else self._cached(client_id)
+        report = None
+        if entry is None:
+            with self._fetch_lock:
+                # Another request may have fetched the client while this one waited
+                entry = None if refresh else self._cached(client_id)
+                if entry is None:
+                    entry, report = self._fetch(client_id, refresh)
+        fetched_at, analyzed_at, rows = entry
+        if type_ids is not None:
+            rows = [row for row in rows if pd.notna(row["TYPE_ID"]) and int(row["TYPE_ID"]) in type_ids]
+        details = {
+            "client": client_id,
+            "cached": report is None,
+            "analyzed_at": analyzed_at.isoformat(),
+            "age_seconds": round(time.monotonic() - fetched_at, 3),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        if report is not None:
+            details["fetch"] = report
+        return rows, details
+
+    def invalidate(self, client_id=None):
+        """Drop one client's cached rows, or every client's."""
+        with self._cache_lock:
+            if client_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(client_id, None)
+
+    def stats(self):
+        with self._cache_lock:
+            cached_clients = list(self._cache)
+        return {
+            "requests": self.requests,
+            "fetches": self.fetches,
+            "cached_clients": cached_clients,
+            "text_signal_cache": get_text_signal_cache().stats(),
+        }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP front end of an AnalysisService (`server.service`).
+
+    GET /analyze?client=ID[&type_ids=1,2][&refresh=1] returns the client's
+    analysis rows as JSON; GET /health returns cache statistics and
+    POST /invalidate[?client=ID] drops cached rows.
+    """
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self):
+        url = urlparse(self.path)
+        return url.path, {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+    def do_GET(self):
+        path, params = self._params()
+        if path == "/health":
+            self._send_json(200, {"status": "ok", **self.server.service.stats()})
+            return
+        if path != "/analyze":
+            self._send_json(404, {"error": f"Unknown path {path}"})
+            return
+        client_id = params.get("client", "").strip()
+        if not client_id:
+            self._send_json(400, {"error": "Missing client parameter"})
+            return
+        try:
+            known = self.server.service.is_known_client(client_id)
+        except Exception as e:
+            logger.error(f"Could not load the client list: {e}")
+            self._send_json(500, {"error": f"Could not load the client list: {e}"})
+            return
+        if not known:
+            self._send_json(400, {"error": f"Unknown client {client_id!r}"})
+            return
+        type_ids = None
+        if params.get("type_ids"):
+            try:
+                type_ids = parse_type_ids(params["type_ids"])
+            except ValueError:
+                self._send_json(400, {"error": f"Invalid type_ids {params['type_ids']!r}; expected integers"})
+                return
+        refresh = params.get("refresh", "").lower() in ("1", "true", "yes")
+        try:
+            rows, details = self.server.service.analyze(client_id, type_ids=type_ids, refresh=refresh)
+        except Exception as e:
+            logger.error(f"Analysis of client {client_id} failed: {e}")
+            self._send_json(500, {"error": str(e), "client": client_id})
+            return
+        # to_json turns NaN, numpy scalars and timestamps into plain JSON values
+        records = json.loads(build_final_dataframe(rows).to_json(orient="records", date_format="iso"))
+        self._send_json(200, {**details, "rows": records})
+
+    def do_POST(self):
+        path, params = self._params()
+        if path != "/invalidate":
+            self._send_json(404, {"error": f"Unknown path {path}"})
+            return
+        client_id = params.get("client")
+        if client_id is not None and not is_valid_client_id(client_id):
+            self._send_json(400, {"error": f"Invalid client {client_id!r}"})
+            return
+        self.server.service.invalidate(client_id)
+        self._send_json(200, {"invalidated": params.get("client", "all")})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(bq_client, host, port):
+    """Serve AnalysisService requests on host:port until interrupted."""
+    text_signal_cache = get_text_signal_cache()
+    text_signal_cache.load()
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = AnalysisService(bq_client)
+    logger.info(f"Serving single-client analysis on http://{host}:{port}/analyze?client=ID")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping service")
+    finally:
+        server.server_close()
+        text_signal_cache.save()
@@ -0,0 +1,97 @@
+import random
+from statistics import median
+
+import pandas as pd
+import pytest
+
+from data_fetching.appointment_stats import STATS_COLUMNS, AppointmentStatsAccumulator
+
+SEED = 11
+
+
+def _appointments(accounts=300, seed=SEED):
+    """Raw appointment rows with repeated days, year gaps and rows without a valid date."""
+    rng = random.Random(seed)
+    rows = []
+    for account in range(accounts):
+        type_id = rng.choice((1, 2, 3))
+        start = pd.Timestamp("2019-01-01") + pd.Timedelta(days=rng.randint(0, 1500))
+        for _ in range(rng.randint(1, 12)):
+            date = start + pd.Timedelta(days=rng.choice((0, 7, 30, 45, 90, 365, 800)) * rng.randint(0, 3))
+            rows.append({"type": type_id, "individualAccountID": account, "appointmentDate": date})
+        if rng.random() < 0.2:
+            rows.append({"type": type_id, "individualAccountID": account, "appointmentDate": pd.NaT})
+    rows.append({"type": 2, "individualAccountID": accounts, "appointmentDate": pd.NaT})
+    return pd.DataFrame(rows)
+
+
+def _stream_rows(appointments):
+    """What appointment_stream_query returns: raw rows by type, account and date (NULL dates first)."""
+    return appointments.sort_values(
+        ["type", "individualAccountID", "appointmentDate"], na_position="first", kind="stable",
+    ).reset_index(drop=True)
+
+
+def _expected_stats(appointments):
+    """Per-(type, account) statistics as account_stats_sql defines them."""
+    records = []
+    for (type_id, account), g in appointments.groupby(["type", "individualAccountID"]):
+        dates = sorted(g["appointmentDate"].dropna())
+        years = sorted({d.year for d in dates})
+        deltas = [(b - a).days for a, b in zip(dates, dates[1:])]
+        records.append({
+            "type": type_id,
+            "individualAccountID": account,
+            "appointmentCount": len(g),
+            "visits": len(dates),
+            "last_date": max(dates) if dates else pd.NaT,
+            "years_count": len(years),
+            "has_consecutive_years": any(b - a == 1 for a, b in zip(years, years[1:])),
+            "median_delta_days": median(deltas) if deltas else None,
+        })
+    return pd.DataFrame(records, columns=STATS_COLUMNS)
+
+
+def _normalized(frame):
+    frame = frame.sort_values(["type", "individualAccountID"]).reset_index(drop=True)
+    return frame.astype({
+        "type": "int64", "individualAccountID": "int64", "appointmentCount": "int64", "visits": "int64",
+        "years_count": "int64", "has_consecutive_years": "bool", "median_delta_days": "float64",
+        "last_date": "datetime64[ns]",
+    })
+
+
+@pytest.mark.parametrize("pages", [1, 4, 17, 250])
+def test_streamed_stats_match_account_stats_sql(pages):
+    # Page boundaries fall inside accounts, so state must carry across pages
+    appointments = _appointments()
+    rows = _stream_rows(appointments)
+    accumulator = AppointmentStatsAccumulator()
+    size = -(-len(rows) // pages)
+    for start in range(0, len(rows), size):
+        accumulator.update(rows.iloc[start:start + size])
+
+    assert accumulator.rows == len(appointments)
+    pd.testing.assert_frame_equal(_normalized(accumulator.to_frame()), _normalized(_expected_stats(appointments)))
+
+
+def test_page_of_invalid_dates_keeps_the_account_going():
+    rows = pd.DataFrame({
+        "type": [1, 1, 1, 1],
+        "individualAccountID": [7, 7, 7, 7],
+        "appointmentDate": pd.to_datetime([None, "2020-01-01", "2020-03-01", "2021-01-10"]),
+    })
+    accumulator = AppointmentStatsAccumulator()
+    for start in range(len(rows)):
+        accumulator.update(rows.iloc[start:start + 1])
+
+    pd.testing.assert_frame_equal(_normalized(accumulator.to_frame()), _normalized(_expected_stats(rows)))
+
+
+def test_empty_stream():
+    accumulator = AppointmentStatsAccumulator()
+    accumulator.update(pd.DataFrame(columns=["type", "individualAccountID", "appointmentDate"]))
+
+    frame = accumulator.to_frame()
+    assert frame.empty
+    assert list(frame.columns) == STATS_COLUMNS
@@ -0,0 +1,128 @@
+import random
+
+import pandas as pd
+import pytest
+
+from processing import analyzer
+from processing.analyzer import _GroupedAccountEvidence, score_appointment_recurring
+from processing.feature_store import FeatureStore
+from processing.sampling import sample_strong_ratio
+
+SEED = 7
+
+
+def _evidence(accounts, strong_share, seed=SEED):
+    """(visits, years_count, has_consecutive_years, median_delta_days) tuples, `strong_share` of them strong."""
+    rng = random.Random(seed)
+    evidence = []
+    for _ in range(accounts):
+        visits = rng.randint(1, 20)
+        if rng.random() < strong_share:
+            evidence.append((visits, 2, True, 30.0))
+        else:
+            evidence.append((visits, 1, False, 200.0))
+    return evidence
+
+
+def _appointments(accounts, seed=SEED):
+    rng = random.Random(seed)
+    rows = []
+    for account in range(accounts):
+        start = pd.Timestamp("2021-01-01") + pd.Timedelta(days=rng.randint(0, 300))
+        step = rng.choice((30, 60, 200, 400))
+        for visit in range(rng.randint(1, 6)):
+            rows.append({"individualAccountID": account, "appointmentDate": start + pd.Timedelta(days=step * visit)})
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def sampling(monkeypatch):
+    def configure(enabled, min_accounts=100, initial=200):
+        monkeypatch.setattr(analyzer, "APPT_SAMPLING", enabled)
+        monkeypatch.setattr(analyzer, "APPT_SAMPLE_MIN_ACCOUNTS", min_accounts)
+        monkeypatch.setattr(analyzer, "APPT_SAMPLE_INITIAL", initial)
+        monkeypatch.setattr(analyzer, "APPT_SAMPLE_SEED", SEED)
+    return configure
+
+
+def _full_ratio(evidence):
+    rules = analyzer.BQ_APPOINTMENT_RULES
+    flags = [
+        analyzer._is_strong_account(e, rules["APPT_MIN_VISITS_STRONG"], rules["CADENCE_BANDS"])
+        for e in evidence
+    ]
+    return sum(flags) / len(flags)
+
+
+@pytest.mark.parametrize("strong_share", [0.2, 0.45, 0.8, 0.95])
+def test_sampled_score_matches_full(sampling, strong_share):
+    evidence = _evidence(5000, strong_share)
+    sampling(False)
+    full = score_appointment_recurring(evidence, False)
+    sampling(True)
+    sampled = score_appointment_recurring(evidence, False)
+
+    assert sampled["appt_recurring_score"] == full["appt_recurring_score"]
+    assert sampled["appt_recurring_bool"] == full["appt_recurring_bool"]
+    assert "sampled accounts strong" in sampled["appt_recurring_reason"]
+
+
+@pytest.mark.parametrize("strong_share", [0.2, 0.45, 0.8])
+def test_interval_covers_full_ratio(strong_share):
+    evidence = _evidence(5000, strong_share)
+    rules = analyzer.BQ_APPOINTMENT_RULES
+    estimate = sample_strong_ratio(
+        len(evidence), [e[0] for e in evidence],
+        lambda i: analyzer._is_strong_account(evidence[i], rules["APPT_MIN_VISITS_STRONG"], rules["CADENCE_BANDS"]),
+        rules["POP_RATIO_STRONG"], 200, 0.95, SEED,
+    )
+
+    assert estimate["sampled"] < estimate["total"]
+    assert estimate["low"] <= _full_ratio(evidence) <= estimate["high"]
+
+
+def test_full_sample_is_exact():
+    evidence = _evidence(300, 0.6)
+    rules = analyzer.BQ_APPOINTMENT_RULES
+    estimate = sample_strong_ratio(
+        len(evidence), [e[0] for e in evidence],
+        lambda i: analyzer._is_strong_account(evidence[i], rules["APPT_MIN_VISITS_STRONG"], rules["CADENCE_BANDS"]),
+        rules["POP_RATIO_STRONG"], 1000, 0.95, SEED,
+    )
+
+    assert estimate["sampled"] == estimate["total"]
+    assert estimate["ratio"] == estimate["low"] == estimate["high"] == pytest.approx(_full_ratio(evidence))
+
+
+def test_sampled_raw_rows_match_full_and_stay_lazy(sampling, tmp_path):
+    appointments = _appointments(3000)
+    sampling(False)
+    full = score_appointment_recurring(
+        [analyzer._account_evidence_from_rows(g) for _, g in appointments.groupby("individualAccountID")], False,
+    )
+    sampling(True, initial=100)
+    evidence = _GroupedAccountEvidence(appointments)
+    sampled = score_appointment_recurring(evidence, False)
+
+    assert sampled["appt_recurring_score"] == full["appt_recurring_score"]
+    assert sampled["appt_recurring_bool"] == full["appt_recurring_bool"]
+    computed = len(evidence.computed())
+    assert computed < len(evidence)
+
+    # Storing the features must not evaluate the accounts the sample skipped
+    FeatureStore(str(tmp_path), "run").save_client(
+        "client", [{"Client": "client", "TYPE_ID": 1, "evidence": evidence}], [],
+    )
+    types, accounts, _ = FeatureStore(str(tmp_path), "run").load()
+    assert len(evidence.computed()) == computed
+    assert len(accounts) == computed
+    assert types["sampled_evidence"].tolist() == [True]
+
+
+def test_sampling_is_reproducible(sampling):
+    evidence = _evidence(5000, 0.55)
+    sampling(True)
+    first = score_appointment_recurring(evidence, False)
+    second = score_appointment_recurring(evidence, False)
+
+    assert first == second
@@ -0,0 +1,100 @@
+import itertools
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from config import WORD_SIGNALS
+from data_fetching.schemas import _to_bool, true_flag_sql
+from data_fetching.service_types import SERVICE_TYPE_ORDER, service_types_query
+from processing.analyzer import analyze_api_signals, analyze_text_signals
+from processing.rules import API_RULE_ORDER, API_SIGNAL_DEFAULTS
+from processing.signal_cache import SIGNAL_NAMES, normalize_description
+from processing.sql_compiler import _askclient_reason_sql, api_signal_sql, compile_analysis_sql, word_signal_sql
+
+
+@pytest.fixture
+def db():
+    """SQLite with the BigQuery functions the compiled expressions use."""
+    connection = sqlite3.connect(":memory:")
+    connection.create_function("IF", 3, lambda condition, then, otherwise: then if condition else otherwise)
+    connection.create_function("STRPOS", 2, lambda value, search: value.find(search) + 1)
+    yield connection
+    connection.close()
+
+
+def _as_bool(value):
+    return None if value is None else bool(value)
+
+
+def test_api_signal_sql_matches_python(db):
+    columns = [f"API_{name}" for name in API_RULE_ORDER]
+    db.execute(f"CREATE TABLE flags ({', '.join(columns)})")
+    combinations = list(itertools.product((0, 1, 2), repeat=len(columns)))
+    db.executemany(f"INSERT INTO flags VALUES ({', '.join('?' * len(columns))})", combinations)
+    signals = list(API_SIGNAL_DEFAULTS)
+    select = ", ".join([*columns, *(api_signal_sql(signal) for signal in signals)])
+
+    for row in db.execute(f"SELECT {select} FROM flags"):
+        flags = dict(zip(columns, row[:len(columns)]))
+        expected = analyze_api_signals({"TYPE_ID": 1, **flags})
+        actual = dict(zip(signals, map(_as_bool, row[len(columns):])))
+        assert actual == {signal: expected[signal] for signal in signals}, flags
+
+
+def test_word_signal_sql_matches_python(db):
+    keywords = [kw for name in SIGNAL_NAMES for kw in WORD_SIGNALS.get(name, [])]
+    descriptions = [
+        "",
+        "General Pest Control",
+        "monthly service",
+        *keywords,
+        *(f"Prefix {kw.upper()} suffix" for kw in keywords),
+        *(f"{a} / {b}" for a, b in zip(keywords, reversed(keywords))),
+    ]
+    db.execute("CREATE TABLE types (description_key)")
+    db.executemany("INSERT INTO types VALUES (?)", [(normalize_description(d),) for d in descriptions])
+    select = ", ".join(word_signal_sql(name) for name in SIGNAL_NAMES)
+
+    rows = db.execute(f"SELECT {select} FROM types").fetchall()
+    for description, row in zip(descriptions, rows):
+        expected = analyze_text_signals(description)
+        assert dict(zip(SIGNAL_NAMES, map(_as_bool, row))) == expected, description
+
+
+def test_askclient_reason_sql():
+    assert _askclient_reason_sql("isRervice") == (
+        "ARRAY_TO_STRING(["
+        "IF(ARRAY_LENGTH(isRervice_sources) >= 2 "
+        "AND isRervice_sources[OFFSET(0)].value != isRervice_sources[OFFSET(1)].value, "
+        "CONCAT('isRervice: ', isRervice_sources[OFFSET(0)].name, '=', "
+        "IF(isRervice_sources[OFFSET(0)].value, 'True', 'False'), ' vs ', "
+        "isRervice_sources[OFFSET(1)].name, '=', "
+        "IF(isRervice_sources[OFFSET(1)].value, 'True', 'False')), NULL), "
+        "IF(ARRAY_LENGTH(isRervice_sources) >= 2 AND NOT EXISTS("
+        "SELECT 1 FROM UNNEST(isRervice_sources) s WITH OFFSET pos "
+        "WHERE pos > 0 AND s.value = isRervice_sources[OFFSET(0)].value), "
+        "CONCAT('isRervice: ', isRervice_sources[OFFSET(0)].name, '=', "
+        "IF(isRervice_sources[OFFSET(0)].value, 'True', 'False'), ' vs others=[', ARRAY_TO_STRING(ARRAY("
+        "SELECT CONCAT(\"'\", s.name, '=', IF(s.value, 'True', 'False'), \"'\") "
+        "FROM UNNEST(isRervice_sources) s WITH OFFSET pos WHERE pos > 0 ORDER BY pos), ', '), ']'), NULL)"
+        "], '; ')"
+    )
+
+
+def test_service_type_dedup_is_ordered_like_the_pipeline():
+    order_by = f"ORDER BY {SERVICE_TYPE_ORDER}"
+    assert f"PARTITION BY CLIENT, CAST(TYPE_ID AS INT64) {order_by}) = 1" in compile_analysis_sql(["C1"])
+    assert service_types_query("C1").strip().endswith(order_by)
+
+
+def test_true_flag_sql_matches_cast(db):
+    values = ["true", " TRUE ", "False", "1", "0", "1.0", "0.0", "Yes", "", None, 1, 0, 1.0]
+    db.execute("CREATE TABLE subscriptions (active)")
+    db.executemany("INSERT INTO subscriptions VALUES (?)", [(v,) for v in values])
+    # SQLite spells BigQuery's STRING as TEXT
+    condition = true_flag_sql("active").replace("AS STRING", "AS TEXT")
+
+    actual = [bool(row[0]) for row in db.execute(f"SELECT COALESCE({condition}, FALSE) FROM subscriptions")]
+    expected = _to_bool(pd.Series(values, dtype=object)).fillna(False).tolist()
+    assert actual == expected
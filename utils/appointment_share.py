@@ -4,6 +4,7 @@ import pandas as pd
 
 from bq_client import get_bq_client
 from data_fetching.clients import get_distinct_clients
+from data_fetching.snapshot import refresh_service_type_snapshot
 from data_fetching.service_types import get_service_types_for_client
 from data_fetching.appointments import get_appointments_for_client
 from utils.logger import Logger
@@ -51,7 +52,8 @@ def compute_appointment_share(appointments_df: pd.DataFrame, service_types_df: p
         result["appointmentSharePct"] = 0.0
 
     # Finalize columns and ordering
-    result["service"] = result["DESCRIPTION"].fillna(result["TYPE_ID"].astype(str))
+    # DESCRIPTION is categorical (data_fetching.schemas); fill on object values
+    result["service"] = result["DESCRIPTION"].astype(object).fillna(result["TYPE_ID"].astype(str))
     result = result[["TYPE_ID", "service", "appointmentCount", "appointmentSharePct"]]
     result.sort_values(by="appointmentCount", ascending=False, inplace=True)
     result.reset_index(drop=True, inplace=True)
@@ -81,6 +83,7 @@ def main():
     args = parser.parse_args()
 
     bq_client = get_bq_client()
+    refresh_service_type_snapshot(bq_client)
 
     if args.clients:
         clients = [c.strip() for c in args.clients.split(",") if c.strip()]
@@ -1,10 +1,12 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, Iterable, List, Optional
 
 from google.cloud import bigquery
 
 from bq_client import get_bq_client
+from config import CATALOG_MAX_WORKERS
 from utils.logger import Logger
 
 
@@ -52,14 +54,246 @@ def _get_table_summary(
     return summary
 
 
-def export_bigquery_catalog(
+# Standard SQL type names as reported by INFORMATION_SCHEMA, mapped to the
+# legacy names that `Table.schema` (and so the catalog output) uses.
+_LEGACY_TYPE_NAMES = {
+    "INT64": "INTEGER",
+    "FLOAT64": "FLOAT",
+    "BOOL": "BOOLEAN",
+    "STRUCT": "RECORD",
+}
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are not nested inside <...> or (...)."""
+    parts, depth, current = [], 0, []
+    for ch in text:
+        if ch in "<(":
+            depth += 1
+        elif ch in ">)":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append("".join(current).strip())
+    return parts
+
+
+def _parse_data_type(data_type: str):
+    """Return (legacy type, is_repeated, ordered child names) for an INFORMATION_SCHEMA data_type."""
+    repeated = data_type.startswith("ARRAY<")
+    if repeated:
+        data_type = data_type[len("ARRAY<"):-1]
+    base = data_type.split("<", 1)[0].split("(", 1)[0].strip()
+    children: List[str] = []
+    if base == "STRUCT":
+        inner = data_type[len("STRUCT<"):-1]
+        children = [part.split(" ", 1)[0].strip("`") for part in _split_top_level(inner)]
+    return _LEGACY_TYPE_NAMES.get(base, base), repeated, children
+
+
+def _parse_option_string(value: Optional[str]) -> Optional[str]:
+    # TABLE_OPTIONS renders string options as double-quoted literals
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+_DATASET_CATALOG_SQL = """
+    SELECT
+        t.table_id AS table_name,
+        t.row_count,
+        o.option_value AS table_description,
+        c.column_name,
+        c.ordinal_position,
+        c.is_nullable,
+        f.field_path,
+        f.data_type,
+        f.description
+    FROM `{dataset}.__TABLES__` t
+    LEFT JOIN `{dataset}.INFORMATION_SCHEMA.TABLE_OPTIONS` o
+        ON o.table_name = t.table_id AND o.option_name = 'description'
+    LEFT JOIN `{dataset}.INFORMATION_SCHEMA.COLUMNS` c
+        ON c.table_name = t.table_id
+    LEFT JOIN `{dataset}.INFORMATION_SCHEMA.COLUMN_FIELD_PATHS` f
+        ON f.table_name = t.table_id AND f.column_name = c.column_name
+    WHERE t.table_id IN UNNEST(@table_ids)
+"""
+
+_MODIFIED_TIMES_SQL = """
+    SELECT table_id, last_modified_time
+    FROM `{dataset}.__TABLES__`
+"""
+
+
+class _NeedsTableFallback(Exception):
+    """Raised when INFORMATION_SCHEMA cannot reproduce a table's summary exactly."""
+
+
+def _summary_from_rows(fqtn: str, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    first = rows[0]
+    paths = {r["field_path"]: r for r in rows if r["field_path"] is not None}
+    top_level = sorted(
+        (r for r in rows if r["column_name"] is not None and r["field_path"] == r["column_name"]),
+        key=lambda r: r["ordinal_position"],
+    )
+
+    def convert_path(path: str, name: str, top: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        row = paths.get(path)
+        if row is None:
+            raise _NeedsTableFallback(f"missing field path {path}")
+        field_type, repeated, children = _parse_data_type(row["data_type"])
+        if "NOT NULL" in row["data_type"]:
+            # Nested REQUIRED fields are only visible inside the parent's type
+            raise _NeedsTableFallback(f"NOT NULL nested field under {path}")
+        if repeated:
+            mode = "REPEATED"
+        elif top is not None and top["is_nullable"] == "NO":
+            mode = "REQUIRED"
+        else:
+            mode = "NULLABLE"
+        item: Dict[str, Any] = {
+            "name": name,
+            "type": field_type,
+            "mode": mode,
+            "description": row["description"],
+        }
+        if field_type == "RECORD" and children:
+            item["fields"] = [convert_path(f"{path}.{child}", child, None) for child in children]
+        return item
+
+    try:
+        description = _parse_option_string(first["table_description"])
+    except ValueError:
+        raise _NeedsTableFallback("unparseable description option")
+    return {
+        "table": fqtn,
+        "num_rows": int(first["row_count"] or 0),
+        "description": description,
+        "schema": [convert_path(r["column_name"], r["column_name"], r) for r in top_level],
+    }
+
+
+def _summarize_dataset_with_information_schema(
+    client: bigquery.Client,
+    project: str,
+    dataset_id: str,
+    table_ids: List[str],
+    location: Optional[str],
+) -> Dict[str, Dict[str, Any]]:
+    """Summaries for the tables of one dataset from a single INFORMATION_SCHEMA query.
+
+    Tables that cannot be reproduced exactly are left out, for the caller to
+    fetch with `get_table`.
+    """
+    query = _DATASET_CATALOG_SQL.format(dataset=f"{project}.{dataset_id}")
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("table_ids", "STRING", table_ids)]
+    )
+    rows_by_table: Dict[str, List[Dict[str, Any]]] = {}
+    for row in client.query(query, job_config=job_config, location=location).result():
+        rows_by_table.setdefault(row["table_name"], []).append(dict(row.items()))
+
+    summaries: Dict[str, Dict[str, Any]] = {}
+    for table_id in table_ids:
+        rows = rows_by_table.get(table_id)
+        if not rows:
+            continue
+        fqtn = f"{project}.{dataset_id}.{table_id}"
+        try:
+            summaries[table_id] = _summary_from_rows(fqtn, rows)
+        except _NeedsTableFallback as e:
+            logger.debug("Falling back to get_table for %s: %s", fqtn, e)
+    return summaries
+
+
+def _summarize_with_get_table(
+    client: bigquery.Client,
+    project: str,
+    dataset_id: str,
+    table_ids: List[str],
+    max_workers: int,
+) -> Dict[str, Dict[str, Any]]:
+    dataset_ref = bigquery.DatasetReference(project, dataset_id)
+
+    def summarize(table_id: str) -> Dict[str, Any]:
+        try:
+            return _get_table_summary(client, dataset_ref.table(table_id))
+        except Exception as e:
+            fqtn = f"{project}.{dataset_id}.{table_id}"
+            logger.warning(f"Failed to summarize {fqtn}", error=str(e))
+            return {"table": fqtn, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(table_ids, pool.map(summarize, table_ids)))
+
+
+def _modified_times(
+    client: bigquery.Client,
+    project: str,
+    dataset_id: str,
+    location: Optional[str],
+) -> Dict[str, Optional[int]]:
+    """last_modified_time (epoch ms) per table of one dataset; empty if __TABLES__ cannot be read."""
+    query = _MODIFIED_TIMES_SQL.format(dataset=f"{project}.{dataset_id}")
+    try:
+        return {row["table_id"]: row["last_modified_time"] for row in client.query(query, location=location).result()}
+    except Exception as e:
+        logger.warning(f"Modification times unavailable for {project}.{dataset_id}; refetching all its tables", error=str(e))
+        return {}
+
+
+def _summarize_tables(
+    client: bigquery.Client,
+    project: str,
+    dataset_id: str,
+    table_ids: List[str],
+    location: Optional[str],
+    max_workers: int,
+) -> Dict[str, Dict[str, Any]]:
+    try:
+        by_table = _summarize_dataset_with_information_schema(client, project, dataset_id, table_ids, location)
+    except Exception as e:
+        logger.warning(
+            f"INFORMATION_SCHEMA unavailable for {project}.{dataset_id}; using get_table",
+            error=str(e),
+        )
+        by_table = {}
+    missing = [t for t in table_ids if t not in by_table]
+    if missing:
+        by_table.update(_summarize_with_get_table(client, project, dataset_id, missing, max_workers))
+    return by_table
+
+
+def refresh_bigquery_catalog(
     projects: List[str],
     *,
     location: Optional[str] = None,
-) -> List[Dict[str, Any]]:
+    max_workers: int = CATALOG_MAX_WORKERS,
+    previous: Optional[List[Dict[str, Any]]] = None,
+    previous_state: Optional[Dict[str, Any]] = None,
+):
+    """Catalog of `projects`, reusing unchanged entries of a previous run.
+
+    A table is re-summarized only if it is new, its `__TABLES__`
+    last_modified_time differs from the one recorded in `previous_state`, or
+    its previous entry was an error. Tables that no longer exist are dropped,
+    so the result equals a full rebuild. `list_tables` items carry no
+    modification time or etag, hence the one `__TABLES__` query per dataset.
+
+    Returns (summaries, state, changes) where `changes` lists the added,
+    changed and removed table names.
+    """
     client = get_bq_client()
+    previous_by_table = {t["table"]: t for t in (previous or []) if t.get("table")}
+    previous_modified = (previous_state or {}).get("modified", {})
 
     summaries: List[Dict[str, Any]] = []
+    modified: Dict[str, Optional[int]] = {}
+    changes: Dict[str, List[str]] = {"added": [], "changed": [], "removed": []}
     for project in projects:
         logger.info(f"Enumerating datasets in project {project}...")
         for ds in client.list_datasets(project=project):
@@ -67,19 +301,88 @@ def export_bigquery_catalog(
                 continue
             dataset_ref = bigquery.DatasetReference(project, ds.dataset_id)
             logger.info(f"Enumerating tables in {project}.{ds.dataset_id}...")
-            for tbl in client.list_tables(dataset_ref):
-                table_ref = dataset_ref.table(tbl.table_id)
-                try:
-                    summaries.append(
-                        _get_table_summary(client, table_ref)
-                    )
-                except Exception as e:
-                    fqtn = f"{project}.{ds.dataset_id}.{tbl.table_id}"
-                    logger.warning(f"Failed to summarize {fqtn}", error=str(e))
-                    summaries.append({"table": fqtn, "error": str(e)})
+            table_ids = [tbl.table_id for tbl in client.list_tables(dataset_ref)]
+            if not table_ids:
+                continue
+            ds_location = getattr(ds, "location", None) or location
+            times = _modified_times(client, project, ds.dataset_id, ds_location)
+
+            stale = []
+            for table_id in table_ids:
+                fqtn = f"{project}.{ds.dataset_id}.{table_id}"
+                modified[fqtn] = times.get(table_id)
+                old = previous_by_table.get(fqtn)
+                if old is None:
+                    changes["added"].append(fqtn)
+                    stale.append(table_id)
+                elif (
+                    old.get("error")
+                    or times.get(table_id) is None
+                    or times.get(table_id) != previous_modified.get(fqtn)
+                ):
+                    changes["changed"].append(fqtn)
+                    stale.append(table_id)
+
+            by_table = _summarize_tables(client, project, ds.dataset_id, stale, ds_location, max_workers) if stale else {}
+            summaries.extend(
+                by_table.get(t) or previous_by_table[f"{project}.{ds.dataset_id}.{t}"] for t in table_ids
+            )
+
+    current = {t["table"] for t in summaries}
+    changes["removed"] = [
+        fqtn for fqtn in previous_by_table
+        if fqtn not in current and fqtn.split(".", 1)[0] in projects
+    ]
+    if previous_by_table:
+        # "changed" includes tables re-read because their modification time was unknown
+        logger.info(
+            f"Catalog refresh: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+            f"{len(changes['removed'])} removed, {len(summaries) - len(changes['added']) - len(changes['changed'])} unchanged"
+        )
+        for kind in ("added", "changed", "removed"):
+            for fqtn in changes[kind]:
+                logger.info(f"  {kind}: {fqtn}")
+    return summaries, {"modified": modified}, changes
+
+
+def export_bigquery_catalog(
+    projects: List[str],
+    *,
+    location: Optional[str] = None,
+    max_workers: int = CATALOG_MAX_WORKERS,
+) -> List[Dict[str, Any]]:
+    """Schema, row count and description of every table in `projects`.
+
+    Each dataset is summarized with one INFORMATION_SCHEMA / __TABLES__ query.
+    Tables that query cannot describe exactly (nested REQUIRED fields, tables
+    created after the query ran), and whole datasets where it fails, fall
+    back to `get_table` calls spread over a thread pool. Output order follows
+    `list_tables`, as before.
+    """
+    summaries, _, _ = refresh_bigquery_catalog(projects, location=location, max_workers=max_workers)
     return summaries
 
 
+def _load_json(path: str) -> Optional[Any]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {path}", error=str(e))
+        return None
+
+
+def write_state(state: Dict[str, Any], changes: Dict[str, List[str]], state_path: str) -> None:
+    _ensure_output_dir(state_path)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({**state, "last_changes": changes}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+    logger.info(f"Wrote {state_path}")
+
+
 def write_outputs(
     summaries: List[Dict[str, Any]],
     json_path: str = "output/bq_catalog.json",
@@ -139,6 +442,12 @@ if __name__ == "__main__":
         "--location",
         help="Optional BigQuery location to filter datasets (e.g., US, EU, asia-northeast1).",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=CATALOG_MAX_WORKERS,
+        help="Threads for get_table fallbacks where INFORMATION_SCHEMA cannot be used",
+    )
     parser.add_argument(
         "--json-path",
         default=os.getenv("BQ_CATALOG_JSON_PATH", "output/bq_catalog.json"),
@@ -150,6 +459,17 @@ if __name__ == "__main__":
         help="Where to write the Markdown output",
     )
 
+    parser.add_argument(
+        "--state-path",
+        default=os.getenv("BQ_CATALOG_STATE_PATH", "output/bq_catalog.state.json"),
+        help="Table modification times from the previous run, used for incremental refresh",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the previous catalog and rebuild every table",
+    )
+
     args = parser.parse_args()
 
     # Discover default project from credentials
@@ -159,10 +479,21 @@ if __name__ == "__main__":
     if not projects:
         raise SystemExit("No GCP project specified or discoverable from credentials.")
 
-    summaries = export_bigquery_catalog(
+    # Incremental unless --full: unchanged tables are copied from the previous catalog
+    previous = None if args.full else _load_json(args.json_path)
+    previous_state = None if args.full else _load_json(args.state_path)
+    if previous is not None and previous_state is None:
+        logger.info(f"No state at {args.state_path}; rebuilding the whole catalog")
+        previous = None
+
+    summaries, state, changes = refresh_bigquery_catalog(
         projects,
         location=args.location,
+        max_workers=args.workers,
+        previous=previous,
+        previous_state=previous_state,
     )
     write_outputs(summaries, json_path=args.json_path, md_path=args.md_path)
+    write_state(state, changes, args.state_path)
 
 
@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from utils.logger import Logger
+
+
+logger = Logger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+def _safe_name(client_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(client_id))
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _write_json_atomic(path: str, payload: Any) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, default=_json_default)
+    os.replace(tmp_path, path)
+
+
+class RunCheckpoint:
+    """Per-client checkpoints of one run under `<root>/<run_id>/`.
+
+    Layout:
+        manifest.json              clients, sinks, fetch strategies, TYPE_IDs, analysis date, progress
+        clients/<client>.json      analysis rows of a completed client
+        fetch/<client>/<name>.pkl  fetched frames, so a resumed client skips BigQuery
+
+    A client's fetched frames are deleted once its rows are saved, and the
+    whole fetch/ directory once every sink is written.
+    The manifest is rewritten atomically after every change, so a crash at
+    any point leaves a consistent view of what has finished.
+    """
+
+    def __init__(self, root: str, run_id: str, cache_fetches: bool = True):
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+        self.cache_fetches = cache_fetches
+        self.manifest: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls,
+        root: str,
+        run_id: str,
+        clients: List[str],
+        sinks: List[str],
+        now,
+        cache_fetches: bool = True,
+        strategies: Optional[Dict[str, str]] = None,
+        type_ids: Optional[Iterable[int]] = None,
+    ):
+        checkpoint = cls(root, run_id, cache_fetches=cache_fetches)
+        if os.path.exists(os.path.join(checkpoint.path, MANIFEST)):
+            raise ValueError(f"Run {run_id} already exists in {root}; use --resume {run_id}")
+        os.makedirs(os.path.join(checkpoint.path, "clients"), exist_ok=True)
+        checkpoint.manifest = {
+            "run_id": run_id,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "now": pd.Timestamp(now).isoformat(),
+            "clients": list(clients),
+            "sinks": list(sinks),
+            "strategies": dict(strategies or {}),
+            "type_ids": sorted(type_ids) if type_ids is not None else None,
+            "completed": {},
+            "fetched": {},
+            "sinks_done": [],
+        }
+        checkpoint._save_manifest()
+        logger.info(f"Checkpointing run {run_id} to {checkpoint.path}")
+        return checkpoint
+
+    @classmethod
+    def load(cls, root: str, run_id: str, cache_fetches: bool = True):
+        checkpoint = cls(root, run_id, cache_fetches=cache_fetches)
+        manifest_path = os.path.join(checkpoint.path, MANIFEST)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No checkpoint manifest at {manifest_path}")
+        with open(manifest_path, encoding="utf-8") as f:
+            checkpoint.manifest = json.load(f)
+        done = len(checkpoint.manifest["completed"])
+        total = len(checkpoint.manifest["clients"])
+        logger.info(f"Resuming run {run_id}: {done}/{total} clients completed, sinks done: {checkpoint.manifest['sinks_done']}")
+        return checkpoint
+
+    @property
+    def clients(self) -> List[str]:
+        return self.manifest["clients"]
+
+    @property
+    def sinks(self) -> List[str]:
+        return self.manifest["sinks"]
+
+    @property
+    def strategies(self) -> Dict[str, str]:
+        return self.manifest.get("strategies", {})
+
+    @property
+    def type_ids(self) -> Optional[Set[int]]:
+        """TYPE_IDs a `--type-ids` run is restricted to, None for a full run."""
+        type_ids = self.manifest.get("type_ids")
+        return set(type_ids) if type_ids is not None else None
+
+    @property
+    def now(self) -> pd.Timestamp:
+        return pd.Timestamp(self.manifest["now"])
+
+    def _save_manifest(self) -> None:
+        _write_json_atomic(os.path.join(self.path, MANIFEST), self.manifest)
+
+    def is_complete(self, client_id: str) -> bool:
+        return client_id in self.manifest["completed"]
+
+    def save_fetch(self, client_id: str, data: Dict[str, pd.DataFrame]) -> None:
+        if not self.cache_fetches:
+            return
+        directory = os.path.join(self.path, "fetch", _safe_name(client_id))
+        os.makedirs(directory, exist_ok=True)
+        pointers = {}
+        for name, df in data.items():
+            if df is None:
+                continue
+            rel_path = os.path.join("fetch", _safe_name(client_id), f"{name}.pkl")
+            df.to_pickle(os.path.join(self.path, rel_path))
+            pointers[name] = rel_path
+        with self._lock:
+            self.manifest["fetched"][client_id] = pointers
+            self._save_manifest()
+
+    def load_fetch(self, client_id: str) -> Optional[Dict[str, pd.DataFrame]]:
+        pointers = self.manifest["fetched"].get(client_id)
+        if not pointers:
+            return None
+        try:
+            data = {name: pd.read_pickle(os.path.join(self.path, rel)) for name, rel in pointers.items()}
+            data.setdefault("appointments", None)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Fetch cache for {client_id} unreadable, refetching: {e}")
+            return None
+        logger.info(f"Loaded cached fetches for {client_id} from run {self.run_id}")
+        return data
+
+    def save_client(self, client_id: str, rows: List[Dict[str, Any]]) -> None:
+        rel_path = os.path.join("clients", f"{_safe_name(client_id)}.json")
+        _write_json_atomic(os.path.join(self.path, rel_path), rows)
+        with self._lock:
+            self.manifest["completed"][client_id] = {
+                "rows": rel_path,
+                "row_count": len(rows),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }
+            # A completed client is never fetched again
+            fetched = self.manifest["fetched"].pop(client_id, None)
+            self._save_manifest()
+        if fetched:
+            shutil.rmtree(os.path.join(self.path, "fetch", _safe_name(client_id)), ignore_errors=True)
+
+    def load_rows(self, client_id: str) -> List[Dict[str, Any]]:
+        rel_path = self.manifest["completed"][client_id]["rows"]
+        with open(os.path.join(self.path, rel_path), encoding="utf-8") as f:
+            return json.load(f)
+
+    def set_deferred(self, clients: List[str], deferred_runs: Optional[Dict[str, int]] = None) -> None:
+        """Record clients left for a later `--resume` by the scheduler's time budget.
+
+        `deferred_runs` holds how many runs in a row each client had already
+        been deferred before this one (see load_deferred_runs).
+        """
+        deferred_runs = deferred_runs or {}
+        with self._lock:
+            self.manifest["deferred"] = list(clients)
+            self.manifest["deferred_runs"] = {c: deferred_runs.get(c, 0) + 1 for c in clients}
+            self._save_manifest()
+
+    def sink_done(self, name: str) -> bool:
+        return name in self.manifest["sinks_done"]
+
+    def mark_sink_done(self, name: str) -> None:
+        with self._lock:
+            if name not in self.manifest["sinks_done"]:
+                self.manifest["sinks_done"].append(name)
+            finished = set(self.sinks) <= set(self.manifest["sinks_done"])
+            if finished:
+                self.manifest["fetched"] = {}
+            self._save_manifest()
+        if finished:
+            shutil.rmtree(os.path.join(self.path, "fetch"), ignore_errors=True)
+
+
+def load_deferred_runs(root: str) -> Dict[str, int]:
+    """Clients deferred by the most recent run under `root`, with how many runs in a row they have waited.
+
+    A fresh run admits these first, so clients the time budget keeps
+    deferring are not starved by daily runs that never `--resume`.
+    """
+    latest = None
+    if os.path.isdir(root):
+        for run_id in os.listdir(root):
+            manifest_path = os.path.join(root, run_id, MANIFEST)
+            if not os.path.exists(manifest_path):
+                continue
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable checkpoint manifest {manifest_path}: {e}")
+                continue
+            if latest is None or manifest.get("created_at", "") > latest.get("created_at", ""):
+                latest = manifest
+    if latest is None:
+        return {}
+    deferred_runs = latest.get("deferred_runs", {})
+    return {c: int(deferred_runs.get(c, 1)) for c in latest.get("deferred", [])}
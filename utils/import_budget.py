@@ -0,0 +1,112 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+from config import IMPORT_TIME_BUDGET_MS, IMPORT_TIME_HISTORY_PATH
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Backends that only enabled output sinks may import (see output/sinks.py), and
+# the BigQuery client libraries, which bq_client.py loads on first use
+LAZY_MODULES = (
+    "google.cloud.bigquery",
+    "google.api_core.exceptions",
+    "requests",
+    "gspread",
+    "gspread_dataframe",
+    "openpyxl",
+    "output.google_sheets",
+    "output.exporter",
+    "output.uploader",
+)
+
+
+def measure_import(module: str) -> List[Tuple[str, int, int]]:
+    """Import `module` in a fresh interpreter with `-X importtime`.
+
+    Returns (module, self_us, cumulative_us) per imported module, nested
+    modules included; top-level imports are the names without indentation.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip()[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # One separator space, then two spaces per nesting level
+        entries.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))
+    return entries
+
+
+def check_import_budget(module: str = "main", budget_ms: float = IMPORT_TIME_BUDGET_MS, top_n: int = 15) -> Dict[str, Any]:
+    """Measure the import time of `module` and check it against the budget.
+
+    The check fails when the total exceeds `budget_ms` or when one of
+    LAZY_MODULES is imported eagerly.
+    """
+    entries = measure_import(module)
+    top_level = [(name, cumulative) for name, _, cumulative in entries if not name.startswith(" ")]
+    total_ms = sum(cumulative for _, cumulative in top_level) / 1000
+    imported = {name.strip() for name, _, _ in entries}
+    eager = [name for name in LAZY_MODULES if name in imported]
+    slowest = sorted(top_level, key=lambda e: -e[1])[:top_n]
+    return {
+        "measured_at": datetime.now(timezone.utc).isoformat(),
+        "module": module,
+        "total_ms": round(total_ms, 1),
+        "budget_ms": budget_ms,
+        "modules": len(entries),
+        "eager_lazy_modules": eager,
+        "slowest": [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, us in slowest],
+        "ok": total_ms <= budget_ms and not eager,
+    }
+
+
+def append_history(report: Dict[str, Any], path: str) -> None:
+    """Append the report as one JSON line, so import time can be tracked across commits."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check the import time of the pipeline entry point")
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=IMPORT_TIME_BUDGET_MS,
+        help="Fail when the cumulative import time exceeds this many milliseconds",
+    )
+    parser.add_argument(
+        "--history-path",
+        default=IMPORT_TIME_HISTORY_PATH,
+        help="JSON Lines file the measurement is appended to; empty to skip",
+    )
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest top-level imports listed")
+    args = parser.parse_args()
+
+    report = check_import_budget(args.module, args.budget_ms, args.top)
+    print(f"import {report['module']}: {report['total_ms']:.1f} ms (budget {report['budget_ms']:.0f} ms, {report['modules']} modules)")
+    for entry in report["slowest"]:
+        print(f"  {entry['cumulative_ms']:>8.1f} ms  {entry['module']}")
+    if report["eager_lazy_modules"]:
+        print(f"Imported eagerly, should be lazy: {', '.join(report['eager_lazy_modules'])}")
+    if args.history_path:
+        append_history(report, args.history_path)
+    sys.exit(0 if report["ok"] else 1)
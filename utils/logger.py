@@ -1,29 +1,167 @@
+import atexit
+import json
 import logging
-from typing import Any, Dict
+import logging.handlers
+import queue
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Union
+
+TEXT_FORMAT = "%(asctime)s %(name)s [%(levelname)s] %(message)s"
+
+# Per-type events are aggregated into this counter while a summary scope is
+# active and summary mode is on (see `configure_logging`).
+_tallies: ContextVar[Optional[Counter]] = ContextVar("log_tallies", default=None)
+_summary_mode = False
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class TextFormatter(logging.Formatter):
+    """Default text format; structured fields are appended as a dict."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        return f"{text} {fields}" if fields else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields become top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def _ensure_default_handler() -> None:
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(TextFormatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
 
 
 class Logger:
     def __init__(self, name: str = __name__):
-        """Simple wrapper around Python's logging with sensible defaults."""
-        root = logging.getLogger()
-        if not root.handlers:
-            logging.basicConfig(
-                level=logging.INFO,
-                format="%(asctime)s %(name)s [%(levelname)s] %(message)s",
-            )
+        """Simple wrapper around Python's logging with sensible defaults.
+
+        Messages may use %-style args or be a zero-argument callable; either way
+        nothing is formatted unless the level is enabled.
+        """
+        _ensure_default_handler()
         self._std_logger = logging.getLogger(name)
 
-    def _format_message(self, message: str, extra: Dict[str, Any]) -> str:
-        return f"{message} {extra}" if extra else message
+    def is_enabled_for(self, level: int) -> bool:
+        return self._std_logger.isEnabledFor(level)
+
+    def _log(self, level: int, message: Union[str, Callable[[], str]], args: tuple, extra: Dict[str, Any]) -> None:
+        if not self._std_logger.isEnabledFor(level):
+            return
+        if callable(message):
+            message = message()
+        self._std_logger.log(level, message, *args, extra={"fields": extra} if extra else None)
+
+    def debug(self, message: Union[str, Callable[[], str]], *args: Any, **extra: Any) -> None:
+        self._log(logging.DEBUG, message, args, extra)
+
+    def info(self, message: Union[str, Callable[[], str]], *args: Any, **extra: Any) -> None:
+        self._log(logging.INFO, message, args, extra)
+
+    def warning(self, message: Union[str, Callable[[], str]], *args: Any, **extra: Any) -> None:
+        self._log(logging.WARNING, message, args, extra)
+
+    def error(self, message: Union[str, Callable[[], str]], *args: Any, **extra: Any) -> None:
+        self._log(logging.ERROR, message, args, extra)
+
+    def tally(
+        self,
+        event: str,
+        message: Optional[str] = None,
+        *args: Any,
+        level: int = logging.INFO,
+        **extra: Any,
+    ) -> None:
+        """Count `event` in summary mode, otherwise log `message` as usual.
+
+        Use for per-type events on the hot path; in summary mode they collapse
+        into one line per `summary_scope`.
+        """
+        counter = _tallies.get()
+        if _summary_mode and counter is not None:
+            counter[event] += 1
+            return
+        if message is not None:
+            self._log(level, message, args, extra)
+
+
+@contextmanager
+def summary_scope(name: str):
+    """Aggregate `Logger.tally` events inside the block into one summary line."""
+    counter: Counter = Counter()
+    token = _tallies.set(counter)
+    try:
+        yield counter
+    finally:
+        _tallies.reset(token)
+        if _summary_mode and counter:
+            logging.getLogger(__name__).info(
+                "Event summary for %s", name, extra={"fields": dict(counter)}
+            )
+
+
+def configure_logging(
+    level: Union[int, str] = logging.INFO,
+    json_output: bool = False,
+    async_output: bool = False,
+    summary: bool = False,
+) -> None:
+    """Configure the root logger for a run.
+
+    json_output: emit one JSON object per line instead of text.
+    async_output: hand records to a QueueListener thread so that handler I/O
+        does not block the caller.
+    summary: aggregate `Logger.tally` events per `summary_scope`.
+    """
+    global _summary_mode, _listener
+    _summary_mode = summary
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
 
-    def debug(self, message: str, **extra: Any) -> None:
-        self._std_logger.debug(self._format_message(message, extra))
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_output else TextFormatter(TEXT_FORMAT))
 
-    def info(self, message: str, **extra: Any) -> None:
-        self._std_logger.info(self._format_message(message, extra))
+    if async_output:
+        log_queue: queue.Queue = queue.Queue(-1)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_stop_listener)
+    else:
+        root.addHandler(handler)
 
-    def warning(self, message: str, **extra: Any) -> None:
-        self._std_logger.warning(self._format_message(message, extra))
 
-    def error(self, message: str, **extra: Any) -> None:
-        self._std_logger.error(self._format_message(message, extra))
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
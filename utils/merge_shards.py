@@ -0,0 +1,111 @@
+from typing import List, Optional
+
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+from bq_client import get_bq_client
+from config import BQ_OUTPUT_TABLE, ASK_CLIENT_TABLE
+from utils.logger import Logger
+from utils.sharding import staging_table_id
+
+
+logger = Logger(__name__)
+
+# Output sinks that load BigQuery tables, by sink name
+SHARDED_TABLES = {
+    "bigquery": BQ_OUTPUT_TABLE,
+    "askclient": ASK_CLIENT_TABLE,
+}
+
+
+def _missing_staging_tables(bq_client, table_id: str, shard_count: int, run_id: Optional[str]) -> List[str]:
+    missing = []
+    for index in range(shard_count):
+        source = staging_table_id(table_id, index, shard_count, run_id)
+        try:
+            bq_client.get_table(source)
+        except NotFound:
+            missing.append(source)
+    return missing
+
+
+def merge_shards(
+    bq_client,
+    table_id: str,
+    shard_count: int,
+    run_id: Optional[str] = None,
+    drop_staging: bool = True,
+) -> None:
+    """Publish the staging tables of every shard as `table_id`.
+
+    All shards must have written their staging table; otherwise nothing is
+    published. A single copy job with WRITE_TRUNCATE replaces the target
+    atomically (readers see the old or the new table, never a partial one)
+    and, unlike a query, is not billed for bytes.
+    """
+    missing = _missing_staging_tables(bq_client, table_id, shard_count, run_id)
+    if missing:
+        raise RuntimeError(f"Cannot publish {table_id}: {len(missing)} shard(s) not written: {', '.join(missing)}")
+
+    sources = [staging_table_id(table_id, index, shard_count, run_id) for index in range(shard_count)]
+    job_config = bigquery.CopyJobConfig(write_disposition="WRITE_TRUNCATE")
+    bq_client.copy_table(sources, table_id, job_config=job_config).result()
+    logger.info(f"Published {table_id} from {shard_count} shards")
+
+    if drop_staging:
+        for source in sources:
+            bq_client.delete_table(source, not_found_ok=True)
+        logger.info(f"Dropped {len(sources)} staging tables of {table_id}")
+
+
+def merge_sink_tables(
+    bq_client,
+    sink_names: List[str],
+    shard_count: int,
+    run_id: Optional[str] = None,
+    drop_staging: bool = True,
+) -> None:
+    """Check every staging table of every sink first, then publish each table."""
+    unknown = [name for name in sink_names if name not in SHARDED_TABLES]
+    if unknown:
+        raise ValueError(f"No sharded tables for sinks {unknown}. Available: {sorted(SHARDED_TABLES)}")
+    # Fail before publishing anything if one table is incomplete
+    missing = [
+        source
+        for name in sink_names
+        for source in _missing_staging_tables(bq_client, SHARDED_TABLES[name], shard_count, run_id)
+    ]
+    if missing:
+        raise RuntimeError(f"Nothing published: {len(missing)} staging table(s) not written: {', '.join(missing)}")
+    for name in sink_names:
+        merge_shards(bq_client, SHARDED_TABLES[name], shard_count, run_id, drop_staging=drop_staging)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Publish the output tables of a sharded run")
+    parser.add_argument("--shard-count", type=int, required=True, help="Number of shards of the run")
+    parser.add_argument(
+        "--run-id",
+        help="Run ID the shards were started with (SHARD_RUN_ID / CLOUD_RUN_EXECUTION), if any",
+    )
+    parser.add_argument(
+        "--sinks",
+        default=",".join(SHARDED_TABLES),
+        help="Comma-separated sinks whose tables are published: bigquery,askclient",
+    )
+    parser.add_argument(
+        "--keep-staging",
+        action="store_true",
+        help="Keep the per-shard staging tables after publishing",
+    )
+    args = parser.parse_args()
+
+    merge_sink_tables(
+        get_bq_client(),
+        [n.strip() for n in args.sinks.split(",") if n.strip()],
+        args.shard_count,
+        run_id=args.run_id,
+        drop_staging=not args.keep_staging,
+    )
@@ -0,0 +1,275 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import Logger
+
+
+logger = Logger(__name__)
+
+# (client_id, stage) of the stage currently running in this thread. Queries
+# issued inside a stage are attributed to it.
+_current_stage: ContextVar[Tuple[Optional[str], Optional[str]]] = ContextVar(
+    "current_stage", default=(None, None)
+)
+
+RUN_CLIENT = "_run"
+
+
+class RunMetrics:
+    """Per-client stage timings and BigQuery job statistics for one run."""
+
+    def __init__(self, run_id: Optional[str] = None):
+        self.run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.started_at = time.time()
+        self.stages: List[Dict[str, Any]] = []
+        self.queries: List[Dict[str, Any]] = []
+        self.counts: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._listeners: List[Callable[[str, str, str], None]] = []
+        self._lock = threading.Lock()
+
+    def add_stage_listener(self, listener: Callable[[str, str, str], None]) -> None:
+        """Call `listener(event, client_id, stage)` with event "start"/"end" around every stage."""
+        self._listeners.append(listener)
+
+    @contextmanager
+    def stage(self, client_id: Optional[str], name: str):
+        """Time the enclosed block as stage `name` of `client_id`."""
+        token = _current_stage.set((client_id, name))
+        for listener in self._listeners:
+            listener("start", client_id or RUN_CLIENT, name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_stage.reset(token)
+            for listener in self._listeners:
+                listener("end", client_id or RUN_CLIENT, name)
+            with self._lock:
+                self.stages.append({
+                    "client": client_id or RUN_CLIENT,
+                    "stage": name,
+                    "seconds": elapsed,
+                })
+
+    def record_query(self, job: Any, seconds: float, attempts: int = 1, hedged: bool = False) -> None:
+        """Record the statistics of a finished BigQuery query job.
+
+        `seconds` covers every attempt; `attempts` > 1 means the query was
+        retried and `hedged` that a duplicate job was started for it.
+        """
+        client_id, stage = _current_stage.get()
+        entry = {
+            "client": client_id or RUN_CLIENT,
+            "stage": stage or "unstaged",
+            "job_id": getattr(job, "job_id", None),
+            "seconds": seconds,
+            "bytes_processed": int(getattr(job, "total_bytes_processed", None) or 0),
+            "bytes_billed": int(getattr(job, "total_bytes_billed", None) or 0),
+            "slot_ms": int(getattr(job, "slot_millis", None) or 0),
+            "cache_hit": bool(getattr(job, "cache_hit", False)),
+            "attempts": attempts,
+            "hedged": hedged,
+        }
+        with self._lock:
+            self.queries.append(entry)
+
+    def record_counts(self, name: str, counts_by_client: Dict[str, Dict[str, int]]) -> None:
+        """Attach per-client counts, e.g. {client: {"missing": 3}}, to the report under `name`."""
+        with self._lock:
+            self.counts[name] = {client: dict(counts) for client, counts in counts_by_client.items()}
+
+    def report(self) -> Dict[str, Any]:
+        """Aggregate stages and queries per client and per stage."""
+        clients: Dict[str, Dict[str, Any]] = {}
+
+        def client_entry(client_id: str) -> Dict[str, Any]:
+            return clients.setdefault(client_id, {
+                "seconds": 0.0,
+                "bytes_processed": 0,
+                "bytes_billed": 0,
+                "slot_ms": 0,
+                "queries": 0,
+                "cache_hits": 0,
+                "retries": 0,
+                "hedged": 0,
+                "stages": {},
+            })
+
+        def stage_entry(client: Dict[str, Any], name: str) -> Dict[str, Any]:
+            return client["stages"].setdefault(name, {
+                "seconds": 0.0,
+                "bytes_processed": 0,
+                "bytes_billed": 0,
+                "slot_ms": 0,
+                "queries": 0,
+                "cache_hits": 0,
+                "retries": 0,
+                "hedged": 0,
+            })
+
+        with self._lock:
+            stages = list(self.stages)
+            queries = list(self.queries)
+            counts = {name: dict(by_client) for name, by_client in self.counts.items()}
+
+        for s in stages:
+            client = client_entry(s["client"])
+            client["seconds"] += s["seconds"]
+            stage_entry(client, s["stage"])["seconds"] += s["seconds"]
+
+        for q in queries:
+            client = client_entry(q["client"])
+            stage = stage_entry(client, q["stage"])
+            for target in (client, stage):
+                target["bytes_processed"] += q["bytes_processed"]
+                target["bytes_billed"] += q["bytes_billed"]
+                target["slot_ms"] += q["slot_ms"]
+                target["queries"] += 1
+                target["cache_hits"] += int(q["cache_hit"])
+                target["retries"] += q.get("attempts", 1) - 1
+                target["hedged"] += int(q.get("hedged", False))
+
+        stage_totals: Dict[str, float] = {}
+        for s in stages:
+            stage_totals[s["stage"]] = stage_totals.get(s["stage"], 0.0) + s["seconds"]
+
+        return {
+            "run_id": self.run_id,
+            "started_at": datetime.fromtimestamp(self.started_at, tz=timezone.utc).isoformat(),
+            "wall_seconds": time.time() - self.started_at,
+            "bytes_processed": sum(q["bytes_processed"] for q in queries),
+            "bytes_billed": sum(q["bytes_billed"] for q in queries),
+            "slot_ms": sum(q["slot_ms"] for q in queries),
+            "stage_seconds": dict(sorted(stage_totals.items(), key=lambda kv: -kv[1])),
+            "clients": clients,
+            "counts": counts,
+            "queries": queries,
+        }
+
+    def write_json(self, path: str) -> None:
+        _ensure_output_dir(path)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2, default=str)
+        logger.info(f"Wrote run report {path}")
+
+    def write_prometheus(self, path: str) -> None:
+        """Write the report in the Prometheus textfile-collector format."""
+        report = self.report()
+        lines: List[str] = []
+
+        def metric(name: str, help_text: str, samples: List[Tuple[Dict[str, str], float]]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+
+        per_stage = [
+            ({"client": client_id, "stage": stage_name}, stage)
+            for client_id, client in report["clients"].items()
+            for stage_name, stage in client["stages"].items()
+        ]
+        metric(
+            "service_type_stage_seconds",
+            "Wall-clock seconds spent per client and stage.",
+            [(labels, round(s["seconds"], 6)) for labels, s in per_stage],
+        )
+        metric(
+            "service_type_bigquery_bytes_processed",
+            "BigQuery bytes processed per client and stage.",
+            [(labels, s["bytes_processed"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_bigquery_bytes_billed",
+            "BigQuery bytes billed per client and stage.",
+            [(labels, s["bytes_billed"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_bigquery_slot_ms",
+            "BigQuery slot milliseconds per client and stage.",
+            [(labels, s["slot_ms"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_bigquery_queries",
+            "BigQuery queries issued per client and stage.",
+            [(labels, s["queries"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_bigquery_cache_hits",
+            "BigQuery queries answered from the query cache per client and stage.",
+            [(labels, s["cache_hits"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_bigquery_retries",
+            "BigQuery query attempts retried after a timeout or transient error, per client and stage.",
+            [(labels, s["retries"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_bigquery_hedged",
+            "BigQuery queries that started a duplicate (hedge) job, per client and stage.",
+            [(labels, s["hedged"]) for labels, s in per_stage if s["queries"]],
+        )
+        metric(
+            "service_type_client_count",
+            "Per-client counts recorded during the run (e.g. merged_service_type mismatches), by name and kind.",
+            [
+                ({"name": name, "client": client_id, "kind": kind}, value)
+                for name, by_client in report["counts"].items()
+                for client_id, counts in by_client.items()
+                for kind, value in counts.items()
+            ],
+        )
+        metric(
+            "service_type_run_seconds",
+            "Wall-clock seconds of the whole run.",
+            [({}, round(report["wall_seconds"], 6))],
+        )
+        metric(
+            "service_type_run_bytes_billed",
+            "BigQuery bytes billed by the whole run.",
+            [({}, report["bytes_billed"])],
+        )
+
+        _ensure_output_dir(path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        # Atomic rename so the textfile collector never reads a partial file
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote Prometheus metrics {path}")
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _ensure_output_dir(path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+
+def current_stage() -> Tuple[Optional[str], Optional[str]]:
+    """(client_id, stage) active in the calling thread, (None, None) outside any stage."""
+    return _current_stage.get()
+
+
+_run_metrics = RunMetrics()
+
+
+def get_run_metrics() -> RunMetrics:
+    return _run_metrics
+
+
+def start_run(run_id: Optional[str] = None) -> RunMetrics:
+    """Reset the process-wide metrics for a new run and return them."""
+    global _run_metrics
+    _run_metrics = RunMetrics(run_id)
+    return _run_metrics
@@ -0,0 +1,96 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, List
+
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+def run_prefetched(
+    items: Iterable[Any],
+    fetch: Callable[[Any], Any],
+    process: Callable[[Any, Any], Any],
+    export: Callable[[Any, Any], None],
+    depth: int,
+) -> None:
+    """Run fetch -> process -> export for every item as three overlapping stages.
+
+    `fetch(item)` runs on a background thread and may run up to `depth`
+    items ahead of `process(item, fetched)`, which runs on the calling thread;
+    `export(item, processed)` runs on a second background thread behind a
+    queue of the same depth. The bounded queues cap how many fetched frames
+    are held at once. A fetch returning None skips the item. The first error
+    in any stage stops the others and is re-raised here.
+    """
+    fetched_queue: "queue.Queue" = queue.Queue(maxsize=depth)
+    export_queue: "queue.Queue" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(target: "queue.Queue", entry: Any) -> bool:
+        while not stop.is_set():
+            try:
+                target.put(entry, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source: "queue.Queue") -> Any:
+        while True:
+            try:
+                return source.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if stop.is_set():
+                    return _DONE
+
+    def fail(error: BaseException) -> None:
+        errors.append(error)
+        stop.set()
+
+    def fetcher() -> None:
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                fetched = fetch(item)
+                if fetched is not None and not put(fetched_queue, (item, fetched)):
+                    return
+            put(fetched_queue, _DONE)
+        except BaseException as e:
+            fail(e)
+
+    def exporter() -> None:
+        try:
+            while True:
+                entry = get(export_queue)
+                if entry is _DONE:
+                    return
+                export(*entry)
+        except BaseException as e:
+            fail(e)
+
+    threads = [
+        threading.Thread(target=fetcher, name="prefetch-fetch", daemon=True),
+        threading.Thread(target=exporter, name="prefetch-export", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            entry = get(fetched_queue)
+            if entry is _DONE:
+                break
+            item, fetched = entry
+            processed = process(item, fetched)
+            if not put(export_queue, (item, processed)):
+                break
+        put(export_queue, _DONE)
+    except BaseException as e:
+        fail(e)
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,185 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from utils.logger import Logger
+
+
+logger = Logger(__name__)
+
+PROFILE_MODES = ("cpu", "mem")
+
+
+def _safe_name(client_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(client_id))
+
+
+class ClientProfiler:
+    """Wrap each client's processing with cProfile (cpu) or tracemalloc (mem).
+
+    With mode None every hook is a no-op, so callers can always go through the
+    profiler. Per-client files are written to `output_dir`; `write_summary()`
+    adds a top-N hotspot / peak-allocation summary for the whole run.
+    """
+
+    def __init__(self, mode: Optional[str], output_dir: str, top_n: int = 25):
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.summary: Dict[str, Dict[str, Any]] = {}
+        self._stage_start: Dict[str, int] = {}
+        self._stage_peaks: Dict[str, Dict[str, int]] = {}
+        self._client_peak: Dict[str, int] = {}
+
+    def attach(self, metrics) -> None:
+        """Collect per-stage peak allocations from the run's metrics stages."""
+        if self.mode == "mem":
+            metrics.add_stage_listener(self._on_stage)
+
+    def _on_stage(self, event: str, client_id: str, stage: str) -> None:
+        if not tracemalloc.is_tracing():
+            return
+        if event == "start":
+            # Fold the peak reached so far into the client peak before resetting it
+            self._client_peak[client_id] = max(
+                self._client_peak.get(client_id, 0), tracemalloc.get_traced_memory()[1]
+            )
+            tracemalloc.reset_peak()
+            self._stage_start[stage] = tracemalloc.get_traced_memory()[0]
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        start = self._stage_start.pop(stage, 0)
+        peaks = self._stage_peaks.setdefault(client_id, {})
+        peaks[stage] = max(peaks.get(stage, 0), peak - start)
+
+    @contextmanager
+    def profile_client(self, client_id: str):
+        if self.mode is None:
+            yield
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.mode == "cpu":
+            with self._profile_cpu(client_id):
+                yield
+        else:
+            with self._profile_mem(client_id):
+                yield
+
+    @contextmanager
+    def _profile_cpu(self, client_id: str):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            base = os.path.join(self.output_dir, _safe_name(client_id))
+            profile.dump_stats(f"{base}.prof")
+
+            text = io.StringIO()
+            stats = pstats.Stats(profile, stream=text)
+            stats.sort_stats("cumulative").print_stats(self.top_n)
+            stats.sort_stats("tottime").print_stats(self.top_n)
+            with open(f"{base}.cpu.txt", "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+
+            self.summary[client_id] = {
+                "total_seconds": stats.total_tt,
+                "by_cumulative": self._top_functions(stats, "cumulative"),
+                "by_own_time": self._top_functions(stats, "tottime"),
+            }
+            logger.info(f"CPU profile for {client_id} written to {base}.prof")
+
+    def _top_functions(self, stats: pstats.Stats, key: str) -> List[Dict[str, Any]]:
+        index = 3 if key == "cumulative" else 2
+        rows = sorted(stats.stats.items(), key=lambda kv: kv[1][index], reverse=True)
+        top = []
+        for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows[: self.top_n]:
+            top.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "calls": ncalls,
+                "own_seconds": round(tottime, 4),
+                "cumulative_seconds": round(cumtime, 4),
+            })
+        return top
+
+    @contextmanager
+    def _profile_mem(self, client_id: str):
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start(25)
+        tracemalloc.reset_peak()
+        self._stage_peaks[client_id] = {}
+        self._client_peak[client_id] = 0
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            peak = max(self._client_peak.pop(client_id, 0), tracemalloc.get_traced_memory()[1])
+            if not already_tracing:
+                tracemalloc.stop()
+
+            base = os.path.join(self.output_dir, _safe_name(client_id))
+            snapshot.dump(f"{base}.tracemalloc")
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            top_stats = snapshot.statistics("lineno")[: self.top_n]
+            with open(f"{base}.mem.txt", "w", encoding="utf-8") as f:
+                f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n")
+                for stat in top_stats:
+                    f.write(f"{stat}\n")
+
+            self.summary[client_id] = {
+                "peak_bytes": peak,
+                "stage_peak_bytes": dict(sorted(
+                    self._stage_peaks.get(client_id, {}).items(), key=lambda kv: -kv[1]
+                )),
+                "top_allocations": [
+                    {
+                        "location": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                        "bytes": stat.size,
+                        "blocks": stat.count,
+                    }
+                    for stat in top_stats
+                ],
+            }
+            logger.info(f"Memory profile for {client_id} written to {base}.tracemalloc (peak {peak / 1024 / 1024:.1f} MiB)")
+
+    def write_summary(self) -> None:
+        """Write profile_summary.json/.txt with the top-N entries for every client."""
+        if self.mode is None or not self.summary:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        json_path = os.path.join(self.output_dir, "profile_summary.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"mode": self.mode, "clients": self.summary}, f, indent=2, default=str)
+
+        txt_path = os.path.join(self.output_dir, "profile_summary.txt")
+        with open(txt_path, "w", encoding="utf-8") as f:
+            for client_id, entry in self.summary.items():
+                f.write(f"## {client_id}\n")
+                if self.mode == "cpu":
+                    f.write(f"total: {entry['total_seconds']:.2f}s\n")
+                    for item in entry["by_cumulative"]:
+                        f.write(
+                            f"  {item['cumulative_seconds']:>9.3f}s cum {item['own_seconds']:>9.3f}s own "
+                            f"{item['calls']:>9} calls  {item['function']}\n"
+                        )
+                else:
+                    f.write(f"peak: {entry['peak_bytes'] / 1024 / 1024:.1f} MiB\n")
+                    for stage, size in entry["stage_peak_bytes"].items():
+                        f.write(f"  stage {stage}: {size / 1024 / 1024:.1f} MiB\n")
+                    for item in entry["top_allocations"]:
+                        f.write(f"  {item['bytes'] / 1024:>10.1f} KiB {item['blocks']:>8} blocks  {item['location']}\n")
+                f.write("\n")
+        logger.info(f"Profile summary written to {txt_path}")
@@ -0,0 +1,149 @@
+import heapq
+import json
+import os
+import statistics
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import SCHEDULER_SECONDS_PER_ROW, SCHEDULER_DEFAULT_SECONDS
+from utils.logger import Logger
+
+
+logger = Logger(__name__)
+
+
+def load_previous_timings(report_path: str) -> Dict[str, float]:
+    """Per-client seconds from the run report of the previous run, if there is one."""
+    if not report_path or not os.path.exists(report_path):
+        return {}
+    try:
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable run report {report_path}: {e}")
+        return {}
+    return {
+        client_id: float(entry.get("seconds", 0.0))
+        for client_id, entry in report.get("clients", {}).items()
+        if not client_id.startswith("_")
+    }
+
+
+def load_priorities(path: Optional[str]) -> Dict[str, float]:
+    """Client weights (e.g. revenue) from a JSON object {client_id: weight}."""
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {str(k): float(v) for k, v in json.load(f).items()}
+
+
+def estimate_client_costs(
+    clients: List[str],
+    previous_timings: Dict[str, float],
+    appointment_rows: Optional[Dict[str, int]] = None,
+) -> Dict[str, float]:
+    """Estimated seconds per client.
+
+    Previous run timings are used where available, then appointment row
+    counts (SCHEDULER_SECONDS_PER_ROW), and the median of the other estimates
+    (or SCHEDULER_DEFAULT_SECONDS) for clients with neither.
+    """
+    appointment_rows = appointment_rows or {}
+    estimates: Dict[str, float] = {}
+    for client_id in clients:
+        if previous_timings.get(client_id):
+            estimates[client_id] = previous_timings[client_id]
+        elif client_id in appointment_rows:
+            estimates[client_id] = appointment_rows[client_id] * SCHEDULER_SECONDS_PER_ROW
+    fallback = statistics.median(estimates.values()) if estimates else SCHEDULER_DEFAULT_SECONDS
+    for client_id in clients:
+        estimates.setdefault(client_id, fallback)
+    return estimates
+
+
+def lpt_makespan(costs: List[float], workers: int) -> float:
+    """Makespan of assigning `costs` longest-first to the least-loaded of `workers`."""
+    loads = [0.0] * max(workers, 1)
+    for cost in sorted(costs, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads)
+
+
+class ClientScheduler:
+    """Orders clients longest-processing-time first and enforces a time budget.
+
+    Without a budget every client runs, largest first, so a huge client never
+    starts last and sets the makespan. With a budget (seconds), clients with
+    a positive priority weight are always scheduled, highest weight first;
+    the others are admitted while the predicted LPT makespan stays within
+    the budget and deferred otherwise. While running, a non-priority client
+    that would start after the budget is exhausted is deferred as well.
+
+    `deferred_runs` ({client_id: runs in a row it was deferred}) comes from
+    the previous run; the longest-waiting clients are admitted first, so the
+    same expensive clients are not deferred by every run.
+    """
+
+    def __init__(
+        self,
+        estimates: Dict[str, float],
+        workers: int = 1,
+        time_budget: Optional[float] = None,
+        priorities: Optional[Dict[str, float]] = None,
+        deferred_runs: Optional[Dict[str, int]] = None,
+    ):
+        self.estimates = estimates
+        self.workers = max(workers, 1)
+        self.time_budget = time_budget
+        self.priorities = priorities or {}
+        self.deferred_runs = deferred_runs or {}
+        self.deferred: List[str] = []
+        self._lock = threading.Lock()
+
+    def is_priority(self, client_id: str) -> bool:
+        return self.priorities.get(client_id, 0) > 0
+
+    def schedule(self, clients: List[str]) -> Tuple[List[str], List[str]]:
+        """Return (clients to run in start order, clients deferred up front)."""
+        if self.time_budget is None:
+            admitted = list(clients)
+        else:
+            priority = sorted(
+                (c for c in clients if self.is_priority(c)),
+                key=lambda c: -self.priorities[c],
+            )
+            admitted = list(priority)
+            if priority and lpt_makespan([self.estimates[c] for c in priority], self.workers) > self.time_budget:
+                logger.warning("Priority clients alone are predicted to exceed the time budget")
+            # Longest-waiting first, then cheapest, so the budget finishes as many clients as possible
+            # without deferring the same ones every run
+            candidates = sorted(
+                (c for c in clients if not self.is_priority(c)),
+                key=lambda c: (-self.deferred_runs.get(c, 0), self.estimates[c]),
+            )
+            for client_id in candidates:
+                costs = [self.estimates[c] for c in admitted + [client_id]]
+                if lpt_makespan(costs, self.workers) <= self.time_budget:
+                    admitted.append(client_id)
+                else:
+                    self.deferred.append(client_id)
+
+        # LPT start order; priority breaks ties so it is never left for last
+        ordered = sorted(admitted, key=lambda c: (-self.estimates[c], -self.priorities.get(c, 0)))
+        predicted = lpt_makespan([self.estimates[c] for c in ordered], self.workers)
+        logger.info(
+            f"Scheduled {len(ordered)} clients on {self.workers} worker(s), predicted makespan {predicted:.0f}s"
+            + (f", {len(self.deferred)} deferred" if self.deferred else "")
+        )
+        return ordered, list(self.deferred)
+
+    def should_start(self, client_id: str, elapsed: float) -> bool:
+        """False if a non-priority client would start after the budget has run out."""
+        if self.time_budget is None or self.is_priority(client_id):
+            return True
+        if elapsed + self.estimates.get(client_id, 0.0) <= self.time_budget:
+            return True
+        with self._lock:
+            self.deferred.append(client_id)
+        logger.info(f"Deferring {client_id}: time budget exhausted after {elapsed:.0f}s")
+        return False
@@ -0,0 +1,76 @@
+import hashlib
+import os
+from typing import List, Optional
+
+
+def _env_int(*names: str) -> Optional[int]:
+    for name in names:
+        value = os.getenv(name)
+        if value not in (None, ""):
+            return int(value)
+    return None
+
+
+def shard_of(client_id: str, shard_count: int) -> int:
+    """Deterministic shard of a client: md5 of its ID modulo the shard count.
+
+    Python's hash() is salted per process, so it would put the same client
+    in different shards on different tasks.
+    """
+    digest = hashlib.md5(str(client_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+class Shard:
+    """One of `count` tasks of a sharded run.
+
+    Each shard processes the clients hashed to it and loads its BigQuery
+    results into staging tables named after the output table, the run and the
+    shard; `utils/merge_shards.py` publishes the combined tables once every
+    shard has finished.
+    """
+
+    def __init__(self, index: int, count: int, run_id: Optional[str] = None):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index} of {count}")
+        self.index = index
+        self.count = count
+        self.run_id = run_id
+
+    @classmethod
+    def from_env(cls, index: Optional[int] = None, count: Optional[int] = None, run_id: Optional[str] = None):
+        """Shard from explicit values, else SHARD_INDEX/SHARD_COUNT, else Cloud Run task variables.
+
+        Returns None for an unsharded run (count missing or 1).
+        """
+        if index is None:
+            index = _env_int("SHARD_INDEX", "CLOUD_RUN_TASK_INDEX")
+        if count is None:
+            count = _env_int("SHARD_COUNT", "CLOUD_RUN_TASK_COUNT")
+        if not count or count == 1:
+            return None
+        # All tasks of one Cloud Run execution share its name
+        run_id = run_id or os.getenv("SHARD_RUN_ID") or os.getenv("CLOUD_RUN_EXECUTION")
+        return cls(index or 0, count, run_id)
+
+    def owns(self, client_id: str) -> bool:
+        return shard_of(client_id, self.count) == self.index
+
+    def select(self, clients: List[str]) -> List[str]:
+        return [client_id for client_id in clients if self.owns(client_id)]
+
+    def staging_table(self, table_id: str) -> str:
+        return staging_table_id(table_id, self.index, self.count, self.run_id)
+
+    def __repr__(self):
+        return f"Shard({self.index}/{self.count}" + (f", run {self.run_id})" if self.run_id else ")")
+
+
+def staging_table_id(table_id: str, index: int, count: int, run_id: Optional[str] = None) -> str:
+    """`dataset.table` -> `dataset.table__<run>_shard<index>of<count>` (run part only when given)."""
+    run_part = f"{_safe_table_part(run_id)}_" if run_id else ""
+    return f"{table_id}__{run_part}shard{index}of{count}"
+
+
+def _safe_table_part(value: str) -> str:
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in value)